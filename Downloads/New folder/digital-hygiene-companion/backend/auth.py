@@ -1,55 +1,170 @@
 """API Key authentication and rate limiting module"""
 
+import asyncio
+import contextvars
+import math
 import os
 import logging
-from typing import Optional, Dict
-from datetime import datetime, timedelta
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional, Dict, List
 from fastapi import Header, HTTPException, status
 from functools import lru_cache
 
+from detectors.timing import timed_stage
+from shared_state import LocalState, SharedStateFull, create_shared_state_from_env
+
 logger = logging.getLogger(__name__)
 
 
+@dataclass(frozen=True)
+class RateLimitDecision:
+    allowed: bool
+    limit: int  # requests per window for this key
+    remaining: int  # requests still allowed right now
+    retry_after: float  # seconds until the request would be allowed (0.0 when allowed)
+
+
 class RateLimiter:
-    """Simple in-memory rate limiter with per-API-key tracking"""
-    
-    def __init__(self, requests_per_minute: int = 60):
-        self.requests_per_minute = requests_per_minute
-        self.requests: Dict[str, list] = {}  # key -> list of timestamps
-    
-    def is_allowed(self, api_key: str) -> bool:
-        """Check if a request from api_key is allowed (returns False if rate limited)"""
-        now = datetime.utcnow()
-        cutoff = now - timedelta(minutes=1)
-        
-        if api_key not in self.requests:
-            self.requests[api_key] = []
-        
-        # Remove old requests outside the 1-minute window
-        self.requests[api_key] = [ts for ts in self.requests[api_key] if ts > cutoff]
-        
-        # Check if limit exceeded
-        if len(self.requests[api_key]) >= self.requests_per_minute:
-            return False
-        
-        # Record this request
-        self.requests[api_key].append(now)
-        return True
-    
+    """
+    Sliding-window counter per API key. Each key keeps three integers: the index of the
+    current fixed window and the request counts of the current and previous windows.
+    The requests in the last ``window_seconds`` are estimated as the current count plus
+    the previous count weighted by how much of the previous window still overlaps, so
+    every check is O(1) whatever the traffic. Keys idle for two windows count zero and
+    are dropped by ``evict_idle`` (run periodically by ``evict_idle_keys``).
+
+    The counters live in ``state`` (see shared_state.py): a LocalState for one process,
+    or an MmapState shared by all workers so the limit holds for the whole server. Times
+    come from the monotonic clock, which is system-wide and so agrees between workers.
+    """
+
+    def __init__(self, requests_per_minute: int = 60, key_limits: Optional[Dict[str, int]] = None,
+                 window_seconds: float = 60.0, clock: Callable[[], float] = time.monotonic, state=None):
+        self.requests_per_minute = requests_per_minute  # default limit per window
+        self.key_limits: Dict[str, int] = dict(key_limits or {})  # api key -> its own limit
+        self.window_seconds = window_seconds
+        self.clock = clock
+        self.windows = state if state is not None else LocalState(fields=3)  # key -> [window index, current, previous]
+        self.rejected = 0  # requests refused by this process
+
+    def limit_for(self, api_key: str) -> int:
+        return self.key_limits.get(api_key, self.requests_per_minute)
+
+    def _window(self, api_key: str, now: float) -> List[int]:
+        """The key's counters rolled forward to the window containing ``now``"""
+        index = int(now // self.window_seconds)
+        window = self.windows.get(api_key)
+        if window is None:
+            window = [index, 0, 0]
+        elif window[0] != index:
+            window[2] = window[1] if window[0] == index - 1 else 0
+            window[1] = 0
+            window[0] = index
+        return window
+
+    def check(self, api_key: str, cost: int = 1) -> RateLimitDecision:
+        """
+        Count a request of ``cost`` units (e.g. items in a batch) if it fits under the key's
+        limit; the decision carries the X-RateLimit-Remaining and Retry-After values.
+        """
+        limit = self.limit_for(api_key)
+        with self.windows.locked():
+            now = self.clock()
+            window = self._window(api_key, now)
+            overlap = 1.0 - (now % self.window_seconds) / self.window_seconds
+            used = window[2] * overlap + window[1]
+            if used + cost > limit:
+                self.rejected += 1
+                return RateLimitDecision(False, limit, max(0, int(limit - used)),
+                                         self._retry_after(window, overlap, limit, cost))
+            window[1] += cost
+            try:
+                self.windows.put(api_key, window)
+            except SharedStateFull:
+                # Evict and retry once; a table full of active keys lets the request through
+                self.evict_idle()
+                try:
+                    self.windows.put(api_key, window)
+                except SharedStateFull:
+                    logger.warning("Rate limit state is full, request not counted")
+        return RateLimitDecision(True, limit, max(0, int(limit - used - cost)), 0.0)
+
+    def _retry_after(self, window: List[int], overlap: float, limit: int, cost: int) -> float:
+        """Seconds until the weighted count has dropped enough for ``cost`` more requests"""
+        current, previous = window[1], window[2]
+        if cost > limit:
+            return self.window_seconds  # never fits; the client has to send less per request
+        room = limit - cost - current
+        if room >= 0 and previous:
+            # Fits later in this window, once the previous window's weight has decayed
+            return (overlap - room / previous) * self.window_seconds
+        # Only after the window turns over, when the current count becomes the previous one
+        wait = 1.0 - (limit - cost) / current if current else 0.0
+        return (overlap + max(0.0, wait)) * self.window_seconds
+
+    def is_allowed(self, api_key: str, cost: int = 1) -> bool:
+        """
+        Check if a request from api_key is allowed (returns False if rate limited).
+        ``cost`` is the number of requests this call counts as (e.g. items in a batch).
+        """
+        return self.check(api_key, cost).allowed
+
     def get_remaining(self, api_key: str) -> int:
-        """Get remaining requests for this API key in current minute"""
-        now = datetime.utcnow()
-        cutoff = now - timedelta(minutes=1)
-        
-        if api_key not in self.requests:
-            return self.requests_per_minute
-        
-        active = [ts for ts in self.requests[api_key] if ts > cutoff]
-        return max(0, self.requests_per_minute - len(active))
+        """Get remaining requests for this API key in the current window"""
+        limit = self.limit_for(api_key)
+        now = self.clock()
+        window = self._window(api_key, now)
+        overlap = 1.0 - (now % self.window_seconds) / self.window_seconds
+        return max(0, int(limit - window[2] * overlap - window[1]))
+
+    def evict_idle(self) -> int:
+        """Drop keys with no requests in the current or previous window; returns how many"""
+        index = int(self.clock() // self.window_seconds)
+        return self.windows.remove_if(lambda window: window[0] < index - 1)
+
+    def stats(self) -> Dict[str, object]:
+        stats = self.windows.stats()
+        stats.update(requests_per_minute=self.requests_per_minute, rejected=self.rejected)
+        return stats
 
 
-# Initialize rate limiter (60 requests per minute by default)
-rate_limiter = RateLimiter(requests_per_minute=60)
+def parse_key_limits(value: str) -> Dict[str, int]:
+    """Per-key limits from "key1:600,key2:30" (entries without a valid number are skipped)"""
+    limits = {}
+    for entry in value.split(","):
+        key, _, limit = entry.strip().rpartition(":")
+        if key and limit.strip().isdigit():
+            limits[key.strip()] = int(limit)
+        elif entry.strip():
+            logger.warning(f"Ignoring malformed API_KEY_RATE_LIMITS entry for key {key[:8]}...")
+    return limits
+
+
+# Initialize rate limiter (60 requests per minute by default), shared by every worker
+# process when SHARED_STATE=mmap
+rate_limiter = RateLimiter(
+    requests_per_minute=int(os.getenv("RATE_LIMIT_PER_MINUTE", "60")),
+    key_limits=parse_key_limits(os.getenv("API_KEY_RATE_LIMITS", "")),
+    state=create_shared_state_from_env("rate-limits", fields=3),
+)
+# How often idle keys are dropped from the rate limiter
+RATE_LIMIT_EVICTION_SECONDS = float(os.getenv("RATE_LIMIT_EVICTION_SECONDS", "60"))
+
+# Decision of the current request, read by RateLimitHeadersMiddleware
+_rate_limit_decision: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("rate_limit_decision", default=None)
+
+
+async def evict_idle_keys(limiter: RateLimiter, interval: float) -> None:
+    """
+    Background task: drop idle rate limiter keys every ``interval`` seconds. The sweep
+    runs on a worker thread: with SHARED_STATE=mmap it reads the whole shared table.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        evicted = await asyncio.to_thread(limiter.evict_idle)
+        if evicted:
+            logger.debug(f"Evicted {evicted} idle rate limit keys ({len(limiter.windows)} active)")
 
 
 @lru_cache(maxsize=10)
@@ -69,6 +184,7 @@ def get_valid_api_keys() -> list:
     return [key.strip() for key in keys_env.split(",") if key.strip()]
 
 
+@timed_stage("auth")
 def validate_api_key(
     authorization: Optional[str] = Header(None),
     api_key: Optional[str] = Header(None)
@@ -117,14 +233,64 @@ def validate_api_key(
     return provided_key
 
 
-def check_rate_limit(api_key: str):
+@timed_stage("auth")
+def check_rate_limit(api_key: str, cost: int = 1):
     """
     Check if API key has exceeded rate limit.
-    Raises HTTPException if rate limit exceeded.
+    Batch endpoints pass ``cost`` so each item counts against the limit.
+    Raises HTTPException (429 with Retry-After) if rate limit exceeded, or 413 if
+    ``cost`` exceeds the key's whole limit (waiting would never help).
     """
-    if not rate_limiter.is_allowed(api_key):
-        remaining = rate_limiter.get_remaining(api_key)
+    limit = rate_limiter.limit_for(api_key)
+    if cost > limit:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Batch of {cost} items exceeds the rate limit of {limit} requests per minute. "
+                   f"Send at most {limit} items per request.",
+            headers={"X-RateLimit-Limit": str(limit)},
+        )
+    decision = rate_limiter.check(api_key, cost)
+    holder = _rate_limit_decision.get()
+    if holder is not None:
+        holder.append(decision)
+    if not decision.allowed:
         raise HTTPException(
             status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-            detail=f"Rate limit exceeded. Max 60 requests per minute. Retrying in 1 minute."
+            detail=f"Rate limit exceeded. Max {decision.limit} requests per minute.",
+            headers={
+                "Retry-After": str(max(1, math.ceil(decision.retry_after))),
+                "X-RateLimit-Limit": str(decision.limit),
+                "X-RateLimit-Remaining": str(decision.remaining),
+            },
         )
+
+
+class RateLimitHeadersMiddleware:
+    """
+    ASGI middleware adding X-RateLimit-Limit and X-RateLimit-Remaining to responses of
+    requests that went through check_rate_limit (429 responses carry them already)
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        decisions: list = []
+        token = _rate_limit_decision.set(decisions)
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start" and decisions and decisions[-1].allowed:
+                decision = decisions[-1]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-ratelimit-limit", str(decision.limit).encode("latin-1")),
+                    (b"x-ratelimit-remaining", str(decision.remaining).encode("latin-1")),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            _rate_limit_decision.reset(token)
@@ -0,0 +1,14 @@
+"""
+Performance benchmarks for the detection hot path.
+
+Run from the backend directory:
+
+    python -m benchmarks                      # run everything, compare with baseline.json
+    python -m benchmarks --filter detector    # only cases whose name contains "detector"
+    python -m benchmarks --update-baseline    # store this run as the new baseline
+
+Exits with status 1 when a case is slower than the stored baseline by more than the
+tolerance, so changes to the detectors can be judged by measurements, or when a fast
+path gives different answers from its reference (streamed vs whole-body text labels,
+columnar vs per-URL scores); those parity checks run whatever --filter selects.
+"""
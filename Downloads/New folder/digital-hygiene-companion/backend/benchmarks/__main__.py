@@ -0,0 +1,308 @@
+"""Benchmark runner - see benchmarks/__init__.py for usage"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+from typing import Any, Callable, Dict, List, Tuple
+
+from benchmarks import corpora
+from benchmarks.harness import compare, environment, load_report, measure, measure_async, save_report
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+logger = logging.getLogger("benchmarks")
+
+
+def text_inputs() -> List[Tuple[str, str]]:
+    """(label, text) for every text corpus"""
+    inputs = [
+        ("sms", corpora.sms()),
+        ("email", corpora.email()),
+        ("newsletter_1mb", corpora.newsletter()),
+    ]
+    inputs += [(f"adversarial.{name}", text) for name, text in corpora.adversarial().items()]
+    return inputs
+
+
+def detector_cases() -> List[Tuple[str, Callable[[], Any], int]]:
+    """(case name, call, payload bytes) for each detector class"""
+    from pipeline import (
+        credential_theft_detector, link_extractor, malware_detector, phishing_detector,
+        social_engineering_detector, url_analyzer,
+    )
+
+    cases = []
+    for label, text in text_inputs():
+        size = len(text.encode("utf-8"))
+        cases += [
+            (f"detector.phishing.{label}", lambda text=text: phishing_detector.evaluate(text), size),
+            (f"detector.social_engineering.{label}",
+             lambda text=text: social_engineering_detector.evaluate(text), size),
+            (f"detector.credential_theft.{label}",
+             lambda text=text: credential_theft_detector.evaluate(text, "email"), size),
+            (f"detector.malware_content.{label}", lambda text=text: malware_detector.evaluate_content(text), size),
+            (f"detector.link_extractor.{label}", lambda text=text: link_extractor.extract(text), size),
+        ]
+
+    def all_urls(evaluate):
+        return lambda: [evaluate(url) for url in corpora.URLS]
+
+    scorer = url_batch_scorer()
+    link_log = corpora.link_log()
+    document = b"%PDF-1.7\n" + corpora.newsletter().encode("utf-8")
+
+    cases += [
+        ("detector.url_analyzer.urls", all_urls(url_analyzer.evaluate), 0),
+        ("detector.url_analyzer.link_log_20k", lambda: [url_analyzer.evaluate(url) for url in link_log], 0),
+        ("detector.url_batch.link_log_20k", lambda: scorer.score_urls(link_log), 0),
+        ("detector.malware_url.urls", all_urls(malware_detector.evaluate_url), 0),
+        ("detector.malware_attachment.filenames",
+         lambda: [malware_detector.evaluate_attachment(name) for name in corpora.FILENAMES], 0),
+        ("detector.signatures.document_1mb", lambda: malware_detector.signatures.scan(document, "pdf"), len(document)),
+    ]
+    return cases
+
+
+def url_batch_scorer():
+    from detectors.url_batch import URLBatchScorer
+    from pipeline import url_analyzer
+
+    return URLBatchScorer(url_analyzer)
+
+
+def check_url_batch_parity() -> int:
+    """Number of link-log URLs the columnar scorer scores differently from URLAnalyzer.evaluate"""
+    urls = list(dict.fromkeys(corpora.URLS + corpora.link_log()))
+    mismatches = url_batch_scorer().check_parity(urls)
+    for i in mismatches[:10]:
+        print(f"PARITY url_batch differs from URLAnalyzer.evaluate for {urls[i]!r}")
+    return len(mismatches)
+
+
+def check_text_stream_parity() -> int:
+    """
+    Number of messages whose streamed label (with early exit) differs from the label of
+    the whole body: stopping early is only allowed when the rest cannot change it
+    """
+    from pipeline import TextStreamAnalysis, analyze_text_content
+
+    messages = [(first, first + rest) for first, rest in corpora.STREAM_SPLITS]
+    for label, text in text_inputs():
+        if label == "adversarial.whitespace":
+            continue  # its matches span far more than the stream overlap, which StreamScanner may miss
+        messages += [(text[:size], text) for size in (256, 64 * 1024) if size < len(text)]
+    mismatches = 0
+    for first, text in messages:
+        analysis = TextStreamAnalysis("email", chunk_size=len(first))
+        for start in range(0, len(text), len(first)):
+            if analysis.feed(text[start:start + len(first)]):
+                break
+        streamed = analysis.verdict()["safety_label"]
+        full = analyze_text_content(text, "email")["safety_label"]
+        if streamed != full:
+            mismatches += 1
+            print(f"PARITY streamed label {streamed} differs from {full} for {text[:80]!r}")
+    return mismatches
+
+
+def explainer_cases() -> List[Tuple[str, Callable[[], Any], int]]:
+    from pipeline import risk_explainer
+
+    all_risks = list(risk_explainer.risk_explanations)
+    return [
+        ("explainer.explain_structured.none", lambda: risk_explainer.explain_structured([], "LOW"), 0),
+        ("explainer.explain_structured.one",
+         lambda: risk_explainer.explain_structured(all_risks[:1], "HIGH"), 0),
+        ("explainer.explain_structured.all",
+         lambda: risk_explainer.explain_structured(all_risks, "CRITICAL"), 0),
+    ]
+
+
+def metrics_cases() -> List[Tuple[str, Callable[[], Any], int]]:
+    from metrics import MetricsRegistry
+
+    registry = MetricsRegistry()
+    requests = registry.counter("http_requests_total", "", ("endpoint", "method", "status"), windowed=True)
+    latency = registry.histogram("http_request_duration_seconds", "", ("endpoint",), windowed=True)
+    verdicts = registry.counter("verdicts_total", "", ("endpoint", "safety_label"), windowed=True)
+    risks = registry.counter("detections_total", "", ("endpoint", "risk"))
+    run_time = registry.histogram("detection_run_seconds", "")
+
+    def record_request():
+        # What MetricsMiddleware, record_verdict and the executor observer add to one request
+        requests.inc("/api/analyze/text", "POST", "200")
+        latency.observe(0.0042, "/api/analyze/text")
+        verdicts.inc("/api/analyze/text", "UNSAFE")
+        risks.inc("/api/analyze/text", "Phishing attempt")
+        risks.inc("/api/analyze/text", "Credential theft attempt")
+        run_time.observe(0.0031)
+
+    for endpoint in ("/api/analyze/text", "/api/analyze/url", "/api/analyze/qr"):
+        for status in ("200", "400", "429"):
+            for i in range(100):
+                requests.inc(endpoint, "POST", status)
+                latency.observe(i / 1000, endpoint)
+    registry.snapshot()
+    return [
+        ("metrics.record_request", record_request, 0),
+        ("metrics.render", registry.render, 0),
+    ]
+
+
+async def run_endpoint_cases(selected: Callable[[str], bool], options: Dict[str, Any]) -> Dict[str, Dict]:
+    """Drive the FastAPI app in-process through an ASGI client (no sockets, no server)"""
+    try:
+        import httpx
+    except ImportError:
+        logger.warning("httpx is not installed; skipping endpoint benchmarks")
+        return {}
+
+    import auth
+    import main
+    import pipeline
+
+    # Measure the analysis path, not the limiter or the verdict cache
+    auth.rate_limiter.requests_per_minute = 10 ** 9
+    cache_size = main.verdict_cache.max_entries
+    main.verdict_cache.max_entries = 0
+    pipeline.warm_up()
+    main.detection_executor.start()
+
+    email = corpora.email()
+    newsletter = corpora.newsletter().encode("utf-8")
+    batch = [{"content": corpora.email(seed), "content_type": "email"} for seed in range(50)]
+    # A crawled page: 200 links, many repeated, over a handful of hosts
+    links = [corpora.URLS[i % len(corpora.URLS)] + ("" if i % 3 else f"?page={i}") for i in range(200)]
+    linked_email = email + "\n\n" + "\n".join(links[:30])
+    attachment = b"%PDF-1.7\n" + newsletter
+    # 120 scans: each code 10 times with a per-scan tracking parameter on the links
+    qr_codes = [code + (f"?scan={i}" if code.startswith("https://") else "") for i in range(10)
+                for code in corpora.QR_PAYLOADS]
+
+    cases = [
+        ("endpoint.text.sms", "/api/analyze/text", {"json": {"content": corpora.sms()}}, 0),
+        ("endpoint.text.email", "/api/analyze/text", {"json": {"content": email}}, 0),
+        ("endpoint.text_batch.50_emails", "/api/analyze/text/batch", {"json": batch}, 0),
+        ("endpoint.text_stream.newsletter_1mb", "/api/analyze/text/stream", {"content": newsletter}, len(newsletter)),
+        ("endpoint.url.phishing", "/api/analyze/url", {"json": {"url": corpora.URLS[3]}}, 0),
+        ("endpoint.url_batch.200_links", "/api/analyze/url/batch", {"json": links}, 0),
+        ("endpoint.combined.email_30_links", "/api/analyze/combined",
+         {"json": {"text_request": {"content": linked_email}}}, 0),
+        ("endpoint.qr.url", "/api/analyze/qr", {"json": {"qr_data": corpora.URLS[7]}}, 0),
+        ("endpoint.qr_batch.120_codes", "/api/analyze/qr/batch", {"json": qr_codes}, 0),
+        ("endpoint.attachment.pdf_1mb", "/api/analyze/attachment",
+         {"files": {"file": ("lecture-notes.pdf", attachment, "application/pdf")}}, len(attachment)),
+    ]
+
+    results = {}
+    transport = httpx.ASGITransport(app=main.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            async def post(path, kwargs):
+                response = await client.post(path, **kwargs)
+                if response.status_code != 200:
+                    raise RuntimeError(f"{path} returned {response.status_code}: {response.text[:200]}")
+
+            for name, path, kwargs, size in cases:
+                if selected(name):
+                    results[name] = await measure_async(
+                        lambda path=path, kwargs=kwargs: post(path, kwargs), payload_bytes=size, **options
+                    )
+
+            # Repeated input answered from the verdict cache
+            name = "endpoint.text.email_cached"
+            if selected(name) and cache_size:
+                main.verdict_cache.max_entries = cache_size
+                results[name] = await measure_async(
+                    lambda: post("/api/analyze/text", {"json": {"content": email}}), **options
+                )
+    finally:
+        main.verdict_cache.max_entries = cache_size
+        main.detection_executor.shutdown()
+    return results
+
+
+def print_results(results: Dict[str, Dict[str, Any]]) -> None:
+    print(f"{'case':<52} {'iter':>6} {'min ms':>10} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} "
+          f"{'ops/s':>11} {'MB/s':>8}")
+    for name, stats in sorted(results.items()):
+        print(f"{name:<52} {stats['iterations']:>6} {stats['min_ms']:>10.3f} {stats['p50_ms']:>10.3f} "
+              f"{stats['p95_ms']:>10.3f} {stats['p99_ms']:>10.3f} {stats['ops_per_sec']:>11.1f} "
+              f"{stats.get('mb_per_sec', ''):>8}")
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Detection hot path benchmarks")
+    parser.add_argument("--filter", default="", help="only run cases whose name contains this text")
+    parser.add_argument("--quick", action="store_true", help="shorter runs (noisier, for local iteration)")
+    parser.add_argument("--rounds", type=int, default=5, help="timed rounds per case; the quietest one is reported")
+    parser.add_argument("--output", default="", help="write this run's report (JSON) to a file")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline report to compare against")
+    parser.add_argument("--update-baseline", action="store_true", help="store this run as the baseline")
+    # The fastest sample is the statistic least disturbed by other load on the machine;
+    # gate on p95_ms/p99_ms only where the benchmark machine is quiet
+    parser.add_argument("--metric", default="min_ms", choices=["min_ms", "mean_ms", "p50_ms", "p95_ms", "p99_ms"])
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed slowdown before a case counts as a regression (0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    # Per-request logs would dominate the endpoint timings
+    for noisy in ("httpx", "main", "pipeline", "executor", "detectors.scan_engine"):
+        logging.getLogger(noisy).setLevel(logging.WARNING)
+
+    options = {"min_seconds": 0.1, "max_iterations": 200} if args.quick else {"min_seconds": 1.0, "max_iterations": 1000}
+    options["rounds"] = args.rounds
+
+    def selected(name: str) -> bool:
+        return args.filter in name
+
+    results: Dict[str, Dict[str, Any]] = {}
+    for name, fn, size in detector_cases() + explainer_cases() + metrics_cases():
+        if selected(name):
+            results[name] = measure(fn, payload_bytes=size, **options)
+    results.update(asyncio.run(run_endpoint_cases(selected, options)))
+
+    print_results(results)
+    # Fast paths must give the same answers as the code they replace, not just run fast:
+    # early exit must never change a streamed verdict, and the columnar URL scorer must
+    # reproduce the per-URL scores exactly. Checked on every run, whatever --filter selects.
+    parity_failures = check_text_stream_parity() + check_url_batch_parity()
+    status = 1 if parity_failures else 0
+    report = {"environment": environment(), "metric": args.metric, "results": results}
+    if args.output:
+        save_report(args.output, report)
+
+    baseline = load_report(args.baseline)
+    if baseline is None:
+        print(f"\nNo baseline at {args.baseline}; run with --update-baseline to create one.")
+    else:
+        rows = compare(results, baseline.get("results", {}), args.metric, args.tolerance)
+        regressions = [row for row in rows if row["regressed"]]
+        print(f"\nCompared {len(rows)} cases on {args.metric} (tolerance {args.tolerance:.0%}) "
+              f"against the baseline from {baseline.get('environment', {}).get('timestamp', 'unknown')}")
+        for row in regressions:
+            print(f"REGRESSION {row['case']}: {row['baseline']:.3f} ms -> {row['current']:.3f} ms "
+                  f"(x{row['ratio']})")
+        if regressions and not args.update_baseline:
+            status = 1
+
+    if parity_failures:
+        print(f"\nPARITY FAILED: {parity_failures} results differ from the reference path", file=sys.stderr)
+    if args.update_baseline and parity_failures:
+        print("Baseline not written: fix the parity failures first", file=sys.stderr)
+    elif args.update_baseline:
+        if baseline is not None and args.filter:
+            # Keep the baseline entries of the cases that were not run this time
+            merged = dict(baseline.get("results", {}))
+            merged.update(results)
+            report["results"] = merged
+        save_report(args.baseline, report)
+        print(f"Baseline written to {args.baseline}")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
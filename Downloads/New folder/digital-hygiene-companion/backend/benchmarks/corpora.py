@@ -0,0 +1,148 @@
+"""Synthetic, deterministic inputs for the benchmarks (same seed -> same bytes every run)"""
+
+import random
+from typing import Dict, List
+
+_BENIGN_SENTENCES = [
+    "Hi team, the quarterly report is attached for your review.",
+    "Lunch is at noon tomorrow in the main cafeteria.",
+    "Reminder: the library closes early on Friday.",
+    "Thanks for the notes from today's lecture, they were really helpful.",
+    "The project meeting has moved to room 204.",
+    "Please bring your laptop to the workshop on Thursday.",
+    "Our club newsletter has photos from the weekend trip.",
+    "Check out the new schedule on the student portal.",
+]
+
+_PHISHING_SENTENCES = [
+    "URGENT: your PayPal account has been suspended due to unusual activity.",
+    "Verify your account now or it will be locked within 24 hours.",
+    "Click here to confirm your password and security code immediately.",
+    "Dear customer, we noticed a problem with your bank account.",
+    "You have won an exclusive prize! Provide your details to claim your reward.",
+    "This is an official notice from Microsoft support, act now.",
+    "Enter your username and password at http://secure-login.example.tk/verify",
+    "Don't miss this last chance, the offer will expire today.",
+]
+
+URLS = [
+    "https://www.example.com/",
+    "https://docs.python.org/3/library/re.html",
+    "https://university.edu/students/portal/schedule?term=fall",
+    "http://paypal-secure-login.tk/verify/account",
+    "http://192.168.4.20/login/confirm.php",
+    "bit.ly/3xYzAbC",
+    "http://a.b.c.d.e.example.ml/update%2eaccount",
+    "https://amazon.com.account-verify.cf/authenticate?session=" + "a" * 80,
+    "https://download.example.com/files/invoice_2024_0042.exe",
+    "http://secure.example.com/login",
+]
+
+# Decoded QR codes of every payload type, as a poster-scanning kiosk uploads them
+QR_PAYLOADS = [
+    "https://university.edu/students/portal/schedule?term=fall",
+    "WIFI:T:WPA;S:Campus-Guest;P:welcome2024;;",
+    "WIFI:T:nopass;S:Free Airport WiFi;H:true;;",
+    "SMSTO:+1900555012:WIN a prize! Reply YES to claim your reward",
+    "sms:12345?body=JOIN%20CLUB",
+    "tel:*#21#",
+    "mailto:support@example.com?subject=Account%20locked&body=Verify%20your%20password%20at%20"
+    "http://paypal-secure-login.tk/verify",
+    "MATMSG:TO:club@university.edu;SUB:Sign up;BODY:See you at the fair!;;",
+    "MECARD:N:Doe,Jane;TEL:+15550100;EMAIL:jane@example.com;URL:https://www.example.com/;;",
+    "BEGIN:VCARD\r\nVERSION:3.0\r\nFN:Help Desk\r\nURL:http://192.168.4.20/login/confirm.php\r\n"
+    "NOTE:Scan to reset your password\r\nEND:VCARD",
+    "geo:40.7580,-73.9855?q=Student%20Center",
+    "Lost cat! Call 555-0199 or see www.example.com/cat",
+]
+
+FILENAMES = [
+    "report.pdf",
+    "holiday photos.zip",
+    "invoice_2024_0042.pdf.exe",
+    ".hidden_config",
+    "payment_details.vbs",
+    "lecture-notes.docx",
+]
+
+
+# Messages streamed in two parts whose second part lowers a score the first part had
+# already reached (credential theft clamps at 0.85 once "verify your account" appears)
+STREAM_SPLITS = [
+    ("password . token . pin code . submit . urgent . exclusive offer . verify . ",
+     "account suspended . must . verify your account"),
+    ("enter password token . ", "exclusive offer . verify your account . password"),
+]
+
+
+def _paragraph(rng: random.Random, sentences: List[str], count: int) -> str:
+    return " ".join(rng.choice(sentences) for _ in range(count))
+
+
+def sms(seed: int = 1) -> str:
+    """A short text message (~160 characters) with a phishing lure"""
+    rng = random.Random(seed)
+    return _paragraph(rng, _PHISHING_SENTENCES, 2)[:160]
+
+
+def email(seed: int = 2) -> str:
+    """A typical email (~2 KB) mixing ordinary text with phishing phrases"""
+    rng = random.Random(seed)
+    paragraphs = [
+        _paragraph(rng, _BENIGN_SENTENCES + _PHISHING_SENTENCES, 5) for _ in range(6)
+    ]
+    return "\n\n".join(paragraphs)
+
+
+def newsletter(size: int = 1024 * 1024, seed: int = 3) -> str:
+    """A large, mostly benign newsletter (default 1 MB) with a few links"""
+    rng = random.Random(seed)
+    parts: List[str] = []
+    length = 0
+    while length < size:
+        part = _paragraph(rng, _BENIGN_SENTENCES, 8)
+        if rng.random() < 0.05:
+            part += f" Read more at {rng.choice(URLS[:3])}"
+        parts.append(part)
+        length += len(part) + 2
+    return "\n\n".join(parts)[:size]
+
+
+def link_log(count: int = 20000, seed: int = 5) -> List[str]:
+    """A day of logged links: mostly repeats of popular URLs, plus a long tail of generated ones"""
+    rng = random.Random(seed)
+    hosts = [
+        "example.com", "www.example.com", "docs.python.org", "university.edu", "mail.google.com",
+        "paypa1.com", "xn--pypal-4ve.com", "googie.com", "secure.login.official", "a.b.c.d.example.ml",
+        "paypal-secure-login.tk", "10.0.0.7", "192.168.4.20:8080", "bit.ly", "amazon.co.uk", "[::1]",
+    ]
+    paths = ["", "/", "/login", "/verify/account", "/secure/confirm", "/update%2eaccount", "/a%3ab",
+             "/files/report.pdf", "/authenticate?session=" + "x" * 90, "/search?q=steam"]
+    schemes = ["https://", "http://", "HTTP://", ""]
+    popular = URLS + [rng.choice(schemes) + rng.choice(hosts) + rng.choice(paths) for _ in range(40)]
+    log = []
+    for _ in range(count):
+        if rng.random() < 0.8:
+            log.append(rng.choice(popular))
+        else:
+            host = rng.choice(hosts)
+            if rng.random() < 0.5:
+                host = f"{rng.choice(['cdn', 'login', 'm', 'x1'])}{rng.randrange(1000)}.{host}"
+            log.append(rng.choice(schemes) + host + rng.choice(paths))
+    return log
+
+
+def adversarial() -> Dict[str, str]:
+    """Inputs built to stress the matcher rather than to look realistic"""
+    return {
+        # Every anchor literal present many times: maximum regex confirmation work
+        "anchor_flood": " ".join(_PHISHING_SENTENCES) * 200,
+        # Anchors whose patterns never complete, e.g. "verify" without an object
+        "near_miss": "verify confirm update validate act click " * 5000,
+        # Long runs of whitespace inside patterns that allow \s+
+        "whitespace": "act" + " " * 100000 + "now unusual" + "\t" * 100000 + "activity",
+        # Dotless i and long s: characters only IGNORECASE folds onto ASCII letters
+        "case_folds": "verıfy your accounţ ſuspended ınformation " * 3000,
+        # No spaces at all, so word-oriented shortcuts cannot help
+        "no_spaces": "passwordverifyaccounturgent" * 4000,
+    }
@@ -0,0 +1,130 @@
+"""Timing, percentile and baseline-comparison helpers for the benchmark runner"""
+
+import json
+import math
+import platform
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# Every round runs at least this many timed iterations, and keeps going until its
+# share of min_seconds has passed or max_iterations is reached
+MIN_ITERATIONS = 5
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of the samples (pct in 0-100)"""
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(samples: List[float], payload_bytes: int = 0) -> Dict[str, Any]:
+    """Latency percentiles (milliseconds) and throughput of one case"""
+    total = sum(samples)
+    summary = {
+        "iterations": len(samples),
+        "min_ms": round(min(samples) * 1000, 4),
+        "mean_ms": round(total / len(samples) * 1000, 4),
+        "p50_ms": round(percentile(samples, 50) * 1000, 4),
+        "p95_ms": round(percentile(samples, 95) * 1000, 4),
+        "p99_ms": round(percentile(samples, 99) * 1000, 4),
+        "ops_per_sec": round(len(samples) / total, 2) if total else 0.0,
+    }
+    if payload_bytes:
+        summary["bytes"] = payload_bytes
+        summary["mb_per_sec"] = round(payload_bytes * len(samples) / total / 1e6, 2) if total else 0.0
+    return summary
+
+
+def _best_round(rounds: List[List[float]], payload_bytes: int) -> Dict[str, Any]:
+    """
+    Report the round with the lowest median. Rounds that overlapped with other load on
+    the machine are slower as a whole, so keeping the quietest one makes runs comparable.
+    min_ms is the fastest sample of any round.
+    """
+    summary = summarize(min(rounds, key=lambda samples: percentile(samples, 50)), payload_bytes)
+    summary["min_ms"] = round(min(min(samples) for samples in rounds) * 1000, 4)
+    summary["rounds"] = len(rounds)
+    return summary
+
+
+def measure(fn: Callable[[], Any], min_seconds: float = 0.5, max_iterations: int = 1000,
+            warmup: int = 2, payload_bytes: int = 0, rounds: int = 5) -> Dict[str, Any]:
+    """Time repeated calls of ``fn()``"""
+    for _ in range(warmup):
+        fn()
+    timed = []
+    for _ in range(rounds):
+        samples: List[float] = []
+        deadline = time.perf_counter() + min_seconds / rounds
+        while len(samples) < MIN_ITERATIONS or (len(samples) < max_iterations and time.perf_counter() < deadline):
+            started = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - started)
+        timed.append(samples)
+    return _best_round(timed, payload_bytes)
+
+
+async def measure_async(fn: Callable[[], Awaitable[Any]], min_seconds: float = 0.5, max_iterations: int = 1000,
+                        warmup: int = 2, payload_bytes: int = 0, rounds: int = 5) -> Dict[str, Any]:
+    """Time repeated awaits of ``fn()`` (one at a time, so samples are per-request latencies)"""
+    for _ in range(warmup):
+        await fn()
+    timed = []
+    for _ in range(rounds):
+        samples: List[float] = []
+        deadline = time.perf_counter() + min_seconds / rounds
+        while len(samples) < MIN_ITERATIONS or (len(samples) < max_iterations and time.perf_counter() < deadline):
+            started = time.perf_counter()
+            await fn()
+            samples.append(time.perf_counter() - started)
+        timed.append(samples)
+    return _best_round(timed, payload_bytes)
+
+
+def environment() -> Dict[str, str]:
+    """Where the numbers came from; baselines are only comparable on similar machines"""
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "system": platform.system(),
+        "processor": platform.processor(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+
+def load_report(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, "r", encoding="utf-8") as handle:
+            return json.load(handle)
+    except FileNotFoundError:
+        return None
+
+
+def save_report(path: str, report: Dict[str, Any]) -> None:
+    with open(path, "w", encoding="utf-8") as handle:
+        json.dump(report, handle, indent=2, sort_keys=True)
+        handle.write("\n")
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]],
+            metric: str = "min_ms", tolerance: float = 0.25) -> List[Dict[str, Any]]:
+    """
+    Compare each case present in both runs. A case regresses when its ``metric`` is
+    more than ``tolerance`` (a fraction, 0.25 = 25%) above the baseline value.
+    """
+    rows = []
+    for name, current in sorted(results.items()):
+        previous = baseline.get(name)
+        if not previous or metric not in previous or not previous[metric]:
+            continue
+        ratio = current[metric] / previous[metric]
+        rows.append({
+            "case": name,
+            "baseline": previous[metric],
+            "current": current[metric],
+            "ratio": round(ratio, 3),
+            "regressed": ratio > 1 + tolerance,
+        })
+    return rows
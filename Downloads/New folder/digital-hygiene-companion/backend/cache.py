@@ -0,0 +1,146 @@
+"""Bounded in-memory caches with LRU + TTL eviction, a memory cap and hit/miss counters"""
+
+import os
+import sys
+import threading
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_size(value: Any) -> int:
+    """Rough deep size in bytes of plain dict/list/tuple/str/number values"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item) for item in value)
+    return size
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache. Entries expire after ``ttl_seconds`` (0 = never) and the
+    least recently used entries are evicted once ``max_entries`` or ``max_bytes`` is
+    exceeded. A cache with max_entries=0 is disabled and never stores anything.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 0, max_bytes: int = 0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, Tuple[Any, float, int]]" = OrderedDict()  # key -> (value, expires_at, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value or None; a hit refreshes the entry's LRU position"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at, _ = entry
+            if expires_at and expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any, size: Optional[int] = None) -> None:
+        if not self.enabled:
+            return
+        size = estimate_size(value) if size is None else size
+        if self.max_bytes and size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else 0.0
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, expires_at, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or (self.max_bytes and self._bytes > self.max_bytes):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key: Hashable) -> None:
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters and current occupancy"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+        }
+
+
+class VerdictCache(LRUCache):
+    """
+    Cache of finished verdicts keyed by the SHA-256 of the analyzed input. Only the
+    digest and the verdict are kept - never the raw text or URL - so caching does not
+    weaken the privacy model. The ruleset version is part of the key, so changing the
+    detector rules never serves stale verdicts.
+    """
+
+    def __init__(self, ruleset_version: str, **kwargs):
+        super().__init__(**kwargs)
+        self.ruleset_version = ruleset_version
+
+    def key(self, digest: str, kind: str, qualifier: str) -> Tuple[str, str, str, str]:
+        """kind is "text" or "url"; qualifier is the content_type or context"""
+        return (digest, kind, qualifier, self.ruleset_version)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats["ruleset_version"] = self.ruleset_version
+        return stats
+
+
+def create_verdict_cache_from_env(ruleset_version: str) -> VerdictCache:
+    """
+    Build the verdict cache from environment variables:
+    VERDICT_CACHE_SIZE (entries, 0 disables, default 10000),
+    VERDICT_CACHE_TTL (seconds, 0 = no expiry, default 3600),
+    VERDICT_CACHE_MAX_BYTES (approximate memory cap, default 64 MB).
+    """
+    return VerdictCache(
+        ruleset_version,
+        max_entries=int(os.getenv("VERDICT_CACHE_SIZE", "10000")),
+        ttl_seconds=float(os.getenv("VERDICT_CACHE_TTL", "3600")),
+        max_bytes=int(os.getenv("VERDICT_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    )
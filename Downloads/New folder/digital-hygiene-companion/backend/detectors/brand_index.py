@@ -0,0 +1,173 @@
+"""
+Brand impersonation index - finds hosts that imitate a protected brand domain.
+
+Every brand's name label ("paypal" of paypal.com) is reduced to its confusable
+skeleton (Unicode UTS #39: NFKD, accents dropped, each character replaced by its
+prototype, so "pаypa1" with a Cyrillic "а" and a digit "1" becomes "paypal" again).
+Hosts are IDNA-decoded and reduced the same way, then looked up in two hash tables:
+
+    skeletons   skeleton -> brands            (homographs: same skeleton, other domain)
+    neighbours  name minus one character      (typosquats: one insertion, deletion,
+                -> brand names                 substitution or transposition away)
+
+A lookup costs a fixed number of hash probes per host label, whatever the number of
+brands (the deletion-neighbourhood trick of SymSpell, with edit distance 1).
+"""
+
+import hashlib
+import logging
+import os
+import unicodedata
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set
+
+from detectors.public_suffix import HostParts, PublicSuffixList, default_suffix_list
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+BUNDLED_BRANDS_PATH = os.path.join(DATA_DIR, "brands.txt")
+BUNDLED_CONFUSABLES_PATH = os.path.join(DATA_DIR, "confusables.txt")
+
+
+@dataclass(frozen=True)
+class BrandMatch:
+    """A host that imitates a protected brand domain"""
+
+    brand: str  # the protected domain, e.g. "paypal.com"
+    technique: str  # "homograph" or "typosquat"
+
+
+def load_confusables(path: str = BUNDLED_CONFUSABLES_PATH) -> Dict[str, str]:
+    """Character -> lowercase prototype from a file in UTS #39 confusables.txt format"""
+    table: Dict[str, str] = {}
+    with open(path, "r", encoding="utf-8-sig") as handle:
+        for line in handle:
+            fields = line.split("#", 1)[0].split(";")
+            if len(fields) < 2:
+                continue
+            source = "".join(chr(int(code, 16)) for code in fields[0].split())
+            target = "".join(chr(int(code, 16)) for code in fields[1].split())
+            if len(source) == 1:
+                table[source] = target.lower()
+    # Prototypes can themselves be confusable ("ԁ" -> "d" -> "cl"); resolve the chains
+    for _ in range(4):
+        resolved = {source: "".join(table.get(char, char) for char in target) for source, target in table.items()}
+        if resolved == table:
+            break
+        table = resolved
+    return table
+
+
+def decode_idna(label: str) -> str:
+    """Unicode form of a punycode label ("xn--..."); other labels are returned as they are"""
+    if label.startswith("xn--"):
+        try:
+            return label.encode("ascii").decode("idna")
+        except UnicodeError:
+            return label
+    return label
+
+
+def deletions(word: str) -> Set[str]:
+    """Every string one character shorter than the word"""
+    return {word[:i] + word[i + 1:] for i in range(len(word))}
+
+
+def within_one_edit(a: str, b: str) -> bool:
+    """True if a and b differ by at most one insertion, deletion, substitution or adjacent swap"""
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+    prefix = 0
+    while prefix < min(len(a), len(b)) and a[prefix] == b[prefix]:
+        prefix += 1
+    if len(a) == len(b):
+        if a[prefix + 1:] == b[prefix + 1:]:
+            return True
+        return a[prefix:prefix + 2] == b[prefix:prefix + 2][::-1] and a[prefix + 2:] == b[prefix + 2:]
+    longer, shorter = (a, b) if len(a) > len(b) else (b, a)
+    return longer[prefix + 1:] == shorter[prefix:]
+
+
+class BrandIndex:
+    """Precomputed skeleton and one-edit neighbourhood tables over a protected-brand list"""
+
+    def __init__(self, brands: Iterable[str], confusables: Optional[Dict[str, str]] = None,
+                 suffixes: Optional[PublicSuffixList] = None, min_typosquat_length: int = 5):
+        self.confusables = load_confusables() if confusables is None else confusables
+        self.suffixes = suffixes or default_suffix_list
+        # Short names have too many real domains one edit away ("ups" -> "cups")
+        self.min_typosquat_length = min_typosquat_length
+        self.domains: Set[str] = set()
+        self.labels: Dict[str, List[str]] = {}  # brand name as written ("amazon") -> its domains
+        self.skeletons: Dict[str, List[str]] = {}  # skeleton -> brand domains, in list order
+        self.neighbours: Dict[str, Set[str]] = {}  # one-deletion variant -> brand names
+        for brand in brands:
+            self.add(brand)
+        digest = hashlib.sha256("\n".join(sorted(self.domains)).encode("utf-8"))
+        digest.update(repr(sorted(self.confusables.items())).encode("utf-8"))
+        self.fingerprint = digest.hexdigest()[:16]
+
+    @classmethod
+    def load(cls, brands_path: str = BUNDLED_BRANDS_PATH,
+             confusables_path: str = BUNDLED_CONFUSABLES_PATH, **kwargs) -> "BrandIndex":
+        """Brand list: one registrable domain per line, '#' comments"""
+        with open(brands_path, "r", encoding="utf-8") as handle:
+            brands = [line.split("#", 1)[0].strip() for line in handle]
+        index = cls((brand for brand in brands if brand), load_confusables(confusables_path), **kwargs)
+        logger.info(f"Brand index: {len(index.domains)} protected domains, {len(index.neighbours)} neighbourhood keys")
+        return index
+
+    def skeleton(self, text: str) -> str:
+        """Confusable skeleton: NFKD, combining marks dropped, characters mapped to prototypes"""
+        decomposed = unicodedata.normalize("NFKD", text.lower())
+        return "".join(
+            self.confusables.get(char, char) for char in decomposed if not unicodedata.combining(char)
+        )
+
+    def add(self, domain: str) -> None:
+        parts = self.suffixes.decompose(domain.strip().lower())
+        if not parts.registrable_domain:
+            logger.warning(f"Ignoring brand entry without a registrable domain: {domain}")
+            return
+        if parts.registrable_domain in self.domains:
+            return
+        label = self.name(parts)
+        self.domains.add(parts.registrable_domain)
+        self.labels.setdefault(label, []).append(parts.registrable_domain)
+        self.skeletons.setdefault(self.skeleton(label), []).append(parts.registrable_domain)
+        # Typos are edits of the name as typed, so the neighbourhood is built on plain
+        # names (a skeleton would turn "githud" -> "githucl" into two edits)
+        if len(label) >= self.min_typosquat_length:
+            for key in deletions(label) | {label}:
+                self.neighbours.setdefault(key, set()).add(label)
+
+    def name(self, parts: HostParts) -> str:
+        """Name label of the registrable domain, IDNA-decoded, lowercase, accents kept"""
+        return unicodedata.normalize("NFC", decode_idna(parts.registrable_domain.split(".", 1)[0]))
+
+    def match(self, parts: HostParts) -> Optional[BrandMatch]:
+        """The brand a decomposed host imitates, if any (brand domains themselves never match)"""
+        if not parts.registrable_domain or parts.registrable_domain in self.domains:
+            return None
+        label = self.name(parts)
+        if label in self.labels:
+            return None  # the brand's own name under another suffix is not a lookalike
+        brands = self.skeletons.get(self.skeleton(label))
+        if brands:
+            return BrandMatch(brands[0], "homograph")
+        if len(label) < self.min_typosquat_length - 1:
+            return None
+        candidates: Set[str] = set()
+        for key in deletions(label) | {label}:
+            candidates |= self.neighbours.get(key, set())
+        close = sorted(candidate for candidate in candidates if within_one_edit(label, candidate))
+        if close:
+            return BrandMatch(self.labels[close[0]][0], "typosquat")
+        return None
+
+    def match_host(self, netloc: str) -> Optional[BrandMatch]:
+        return self.match(self.suffixes.decompose(netloc))
+
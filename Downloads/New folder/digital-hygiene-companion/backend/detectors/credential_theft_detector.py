@@ -1,17 +1,25 @@
 """Credential theft detection module - identifies attempts to steal credentials"""
 
-import re
-from typing import List
+from typing import List, Optional
 import logging
 
+from detectors.result import DetectionResult
+from detectors.scan_engine import ScanEngine, ScanResult, default_engine
+
 logger = logging.getLogger(__name__)
 
 
 class CredentialTheftDetector:
     """Detects credential theft attempts and account compromise tactics"""
 
-    def __init__(self):
+    name = "credential_theft"
+    max_confidence = 1.0  # highest confidence evaluate() can report (used by the planner)
+    # sub_scores steps that clamp the score, min(cap, confidence + bonus): name -> cap
+    clamp_caps = {"password_request": 0.9, "urgency": 0.95, "multiple_actions": 0.9, "verify_account": 0.85}
+
+    def __init__(self, engine: Optional[ScanEngine] = None):
         self.confidence = 0.0
+        self.engine = engine or default_engine
         # Password/credential related patterns
         self.credential_keywords = [
             r"password", r"(?:user)?name", r"pin\s+code", r"security\s+code",
@@ -23,52 +31,106 @@ class CredentialTheftDetector:
             r"(?:enter|provide|submit|send)\s+(?:password|pin|security\s+code|account\s+details)",
             r"(?:please\s+)?(?:click|confirm|verify)",
         ]
+        self.submit_words = ["send", "provide", "enter", "submit"]
+        self.urgency_words = ["urgent", "immediate", "act now", "must", "required"]
+        self.link_pattern = r"https?://\S+"
+        self.verify_account_pattern = r"verify\s+(?:your|my|account)"
+
+        self.engine.register("credential_theft.credentials", self.credential_keywords)
+        self.engine.register("credential_theft.actions", self.action_keywords)
+        self.engine.register_literals("credential_theft.password", ["password"])
+        self.engine.register_literals("credential_theft.submit", self.submit_words)
+        self.engine.register_literals("credential_theft.urgency", self.urgency_words)
+        self.engine.register("credential_theft.link", [self.link_pattern])
+        self.engine.register("credential_theft.verify_account", [self.verify_account_pattern])
 
-    def detect(self, content: str, content_type: str = "email") -> bool:
+    def evaluate(self, content: str, content_type: str = "email",
+                 scan: Optional[ScanResult] = None) -> DetectionResult:
         """
-        Detect credential theft attempts
-        Returns True if credential theft tactic detected
+        Score content for credential theft tactics without touching instance state.
+        Pass ``scan`` to reuse hits from a shared scan of the same content.
         """
-        content_lower = content.lower()
-        self.confidence = 0.0
+        if scan is None:
+            scan = self.engine.scan(content)
+        confidence = 0.0
+        sub_scores = []
 
         # Count credential-related keywords
-        credentials_mentioned = 0
-        for pattern in self.credential_keywords:
-            if re.search(pattern, content_lower):
-                credentials_mentioned += 1
-                self.confidence += 0.12
+        credentials_mentioned = scan.count("credential_theft.credentials")
+        for _ in range(credentials_mentioned):
+            confidence += 0.12
+        sub_scores.append(("credentials", 0.12 * credentials_mentioned))
 
         # Count action keywords (requests to provide credentials)
-        actions_requested = 0
-        for pattern in self.action_keywords:
-            if re.search(pattern, content_lower):
-                actions_requested += 1
-                self.confidence += 0.15
+        actions_requested = scan.count("credential_theft.actions")
+        for _ in range(actions_requested):
+            confidence += 0.15
+        sub_scores.append(("actions", 0.15 * actions_requested))
 
         # High alert: requesting password via email/unsolicited
-        if content_type in ["email", "message", "sms"]:
-            if "password" in content_lower and any(word in content_lower for word in ["send", "provide", "enter", "submit"]):
-                self.confidence = min(0.9, self.confidence + 0.3)
+        password_request = (
+            content_type in ["email", "message", "sms"]
+            and scan.any("credential_theft.password")
+            and scan.any("credential_theft.submit")
+        )
+        if password_request:
+            confidence = min(0.9, confidence + 0.3)
+        sub_scores.append(("password_request", 0.3 if password_request else 0.0))
 
         # Links combined with credential requests
-        if re.search(r"https?://\S+", content) and credentials_mentioned > 0:
-            self.confidence += 0.15
+        credential_link = scan.any("credential_theft.link") and credentials_mentioned > 0
+        if credential_link:
+            confidence += 0.15
+        sub_scores.append(("credential_link", 0.15 if credential_link else 0.0))
 
         # Urgency + credential request = very suspicious
-        urgency_words = ["urgent", "immediate", "act now", "must", "required"]
-        if any(word in content_lower for word in urgency_words) and credentials_mentioned > 0:
-            self.confidence = min(0.95, self.confidence + 0.25)
+        urgent_request = scan.any("credential_theft.urgency") and credentials_mentioned > 0
+        if urgent_request:
+            confidence = min(0.95, confidence + 0.25)
+        sub_scores.append(("urgency", 0.25 if urgent_request else 0.0))
 
         # Multiple action requests
         if actions_requested >= 2:
-            self.confidence = min(0.9, self.confidence + 0.2)
+            confidence = min(0.9, confidence + 0.2)
+        sub_scores.append(("multiple_actions", 0.2 if actions_requested >= 2 else 0.0))
 
         # Check for "verify your account" patterns
-        if re.search(r"verify\s+(?:your|my|account)", content_lower):
-            self.confidence = min(0.85, self.confidence + 0.2)
+        verify_account = scan.any("credential_theft.verify_account")
+        if verify_account:
+            confidence = min(0.85, confidence + 0.2)
+        sub_scores.append(("verify_account", 0.2 if verify_account else 0.0))
+
+        return DetectionResult(
+            detector=self.name,
+            detected=confidence > 0.5,
+            confidence=min(1.0, confidence),
+            matched_rules=scan.rule_ids(
+                "credential_theft.credentials", "credential_theft.actions",
+                "credential_theft.link", "credential_theft.verify_account",
+            ),
+            sub_scores=tuple(sub_scores),
+        )
 
-        return self.confidence > 0.5
+    def lowest_reachable(self, result: DetectionResult) -> float:
+        """
+        Lowest confidence evaluate() can report once more text is added to the content of
+        ``result``. Counts and flags only grow, but a clamp step that is not applied yet
+        can pull the score down to its cap (0.95 becomes 0.85 when "verify your account"
+        turns up later).
+        """
+        applied = {name for name, score in result.sub_scores if score}
+        return min([result.confidence] + [cap for name, cap in self.clamp_caps.items() if name not in applied])
+
+    def detect(self, content: str, content_type: str = "email", scan: Optional[ScanResult] = None) -> bool:
+        """
+        Detect credential theft attempts
+        Returns True if credential theft tactic detected. Kept for single-threaded callers:
+        the score is stored on the instance for get_confidence(); concurrent code should
+        use evaluate().
+        """
+        result = self.evaluate(content, content_type, scan)
+        self.confidence = result.confidence
+        return result.detected
 
     def get_confidence(self) -> float:
         """Get the confidence score of the last detection"""
@@ -0,0 +1,97 @@
+"""
+File type sniffing - identifies a file from its leading bytes, whatever its name says.
+
+Each signature is a byte string expected at a fixed offset ("MZ" at 0 for Windows
+executables, "%PDF-" for PDF, "CD001" at 32769 for ISO images). ``sniff`` only needs
+the first SNIFF_BYTES of a file, so an upload can be typed as it streams in.
+"""
+
+import os
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+# Longest offset + signature below (the ISO 9660 volume descriptor)
+SNIFF_BYTES = 32769 + 5
+
+
+@dataclass(frozen=True)
+class FileType:
+    name: str  # e.g. "pe", "pdf", "zip"
+    description: str
+    category: str  # executable, script, archive, document, image
+    extensions: FrozenSet[str]  # extensions a file of this type is expected to carry
+
+
+def _type(name: str, description: str, category: str, extensions: str) -> FileType:
+    return FileType(name, description, category, frozenset(extensions.split()))
+
+
+FILE_TYPES: Dict[str, FileType] = {t.name: t for t in [
+    _type("pe", "Windows executable", "executable", "exe dll scr sys com cpl ocx drv efi msstyles mui"),
+    _type("elf", "Linux executable", "executable", "elf so o bin run out axf prx ko"),
+    _type("macho", "macOS executable", "executable", "dylib bundle o"),
+    _type("java_class", "Java class or macOS universal binary", "executable", "class"),
+    _type("script", "script with an interpreter line", "script", "sh bash zsh py pl rb php command"),
+    _type("zip", "ZIP archive (also Office, Java and Android packages)", "archive",
+          "zip docx xlsx pptx docm xlsm pptm odt ods odp jar apk epub xpi vsix whl nupkg ipa"),
+    _type("rar", "RAR archive", "archive", "rar"),
+    _type("7z", "7-Zip archive", "archive", "7z"),
+    _type("gzip", "gzip archive", "archive", "gz tgz"),
+    _type("cab", "Windows cabinet archive", "archive", "cab msu"),
+    _type("iso", "ISO disc image", "archive", "iso img"),
+    _type("ole2", "legacy Office document or Windows installer", "document", "doc xls ppt msg msi pub vsd"),
+    _type("pdf", "PDF document", "document", "pdf"),
+    _type("rtf", "RTF document", "document", "rtf doc"),
+    _type("png", "PNG image", "image", "png"),
+    _type("jpeg", "JPEG image", "image", "jpg jpeg jpe jfif"),
+    _type("gif", "GIF image", "image", "gif"),
+]}
+
+# (offset, signature, type name), longest signatures first where they share a prefix
+SIGNATURES: List[Tuple[int, bytes, str]] = [
+    (0, b"MZ", "pe"),
+    (0, b"\x7fELF", "elf"),
+    (0, b"\xfe\xed\xfa\xce", "macho"),
+    (0, b"\xfe\xed\xfa\xcf", "macho"),
+    (0, b"\xce\xfa\xed\xfe", "macho"),
+    (0, b"\xcf\xfa\xed\xfe", "macho"),
+    (0, b"\xca\xfe\xba\xbe", "java_class"),
+    (0, b"#!", "script"),
+    (0, b"PK\x03\x04", "zip"),
+    (0, b"PK\x05\x06", "zip"),  # empty archive
+    (0, b"Rar!\x1a\x07", "rar"),
+    (0, b"7z\xbc\xaf\x27\x1c", "7z"),
+    (0, b"\x1f\x8b", "gzip"),
+    (0, b"MSCF", "cab"),
+    (0, b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", "ole2"),
+    (0, b"%PDF-", "pdf"),
+    (0, b"{\\rtf", "rtf"),
+    (0, b"\x89PNG\r\n\x1a\n", "png"),
+    (0, b"\xff\xd8\xff", "jpeg"),
+    (0, b"GIF87a", "gif"),
+    (0, b"GIF89a", "gif"),
+    (32769, b"CD001", "iso"),
+]
+
+
+def _pe_header(head: bytes) -> bool:
+    """A text file can start with "MZ" too; a real executable points to its PE header at 0x3c"""
+    if len(head) < 0x40:
+        return False
+    header = int.from_bytes(head[0x3c:0x40], "little")
+    return header + 4 > len(head) or head.startswith(b"PE\0\0", header)
+
+
+def sniff(head: bytes) -> Optional[FileType]:
+    """Type of a file from its first bytes (at least SNIFF_BYTES for every signature); None if unknown"""
+    for offset, signature, name in SIGNATURES:
+        if head.startswith(signature, offset):
+            if name == "pe" and not _pe_header(head):
+                continue
+            return FILE_TYPES[name]
+    return None
+
+
+def extension_of(filename: str) -> str:
+    """Last extension of a filename, lowercase and without the dot ("" if none)"""
+    return os.path.splitext(filename.strip().rstrip("."))[1][1:].lower()
@@ -0,0 +1,118 @@
+"""Link extraction module - finds every URL in message text, including defanged and bare forms"""
+
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional
+import logging
+
+from detectors.public_suffix import PublicSuffixList, default_suffix_list, split_netloc
+
+logger = logging.getLogger(__name__)
+
+# "[.]", "(.)", "{.}", "[dot]", "(dot)": dots written so a mail client will not link them
+_DOT = r"(?:\.|\[\.\]|\(\.\)|\{\.\}|\[dot\]|\(dot\))"
+_LABEL = r"[a-z0-9][a-z0-9-]*+"  # possessive: a word without a dot fails without backtracking
+_TAIL = r"[^\s<>\"'`]*"
+
+_LINK_PATTERN = re.compile(
+    # scheme form: http://, hxxps://, hXXp[:]//, ftp[://]
+    rf"(?P<scheme>\b(?:h(?:tt|xx)ps?|ftp)(?:://|\[:\]//|\[://\]))(?P<rest>[^\s<>\"'`]+)"
+    # www. without a scheme
+    rf"|(?P<www>(?<![\w@.-])www{_DOT}{_LABEL}(?:{_DOT}{_LABEL})+(?::\d{{1,5}})?(?:/{_TAIL})?)"
+    # bare domain, accepted only when its last label is a known TLD
+    rf"|(?P<bare>(?<![\w@.-]){_LABEL}(?:{_DOT}{_LABEL})+(?::\d{{1,5}})?(?:/{_TAIL})?)",
+    re.IGNORECASE,
+)
+_DEFANGED = re.compile(r"\[\.\]|\(\.\)|\{\.\}|\[dot\]|\(dot\)|\[:\]|\[://\]|^hxxp", re.IGNORECASE)
+_REFANG = [
+    (re.compile(r"\[\.\]|\(\.\)|\{\.\}|\[dot\]|\(dot\)", re.IGNORECASE), "."),
+    (re.compile(r"\[://\]"), "://"),
+    (re.compile(r"\[:\]"), ":"),
+    (re.compile(r"^hxxp", re.IGNORECASE), "http"),
+]
+# Closing characters that usually belong to the sentence rather than the link
+_TRAILING = ".,;:!?'\")]}>"
+_BRACKETS = {")": "(", "]": "[", "}": "{", ">": "<"}
+
+
+@dataclass(frozen=True)
+class ExtractedLink:
+    """One distinct link found in a message"""
+
+    url: str  # refanged, with a scheme
+    defanged: bool  # written as hxxp / [.] / [:] in the message
+    bare: bool  # written without scheme (www. or a bare domain)
+    occurrences: int
+
+
+class LinkExtractor:
+    """
+    Pulls links out of text with a single regex pass: scheme URLs (also defanged
+    "hxxp://evil[.]com" forms), "www." hosts and bare domains. Bare domains only count
+    when their TLD is on the Public Suffix List, so "e.g." or "file.exe" are skipped.
+    """
+
+    name = "links"
+
+    def __init__(self, suffixes: Optional[PublicSuffixList] = None, max_links: int = 50):
+        self.suffixes = suffixes or default_suffix_list
+        self.max_links = max_links
+        # TLDs that are also common file extensions: bare "setup.py" needs a path to count
+        self.file_extension_tlds = ["py", "sh", "md", "rs", "pl"]
+
+    def extract(self, content: str) -> List[ExtractedLink]:
+        """Distinct links in order of first appearance, at most max_links of them"""
+        links: Dict[str, List] = {}  # url -> [defanged, bare, occurrences]
+        for match in self._matches(content):
+            raw = _trim(match.group(0))
+            if match.group("scheme"):
+                if len(raw) <= len(match.group("scheme")):
+                    continue
+            elif not self._plausible_host(raw, bare=bool(match.group("bare"))):
+                continue
+            url = _refang(raw)
+            bare = not match.group("scheme")
+            if bare:
+                url = "http://" + url
+            entry = links.get(url)
+            if entry is None:
+                if len(links) >= self.max_links:
+                    continue
+                links[url] = entry = [bool(_DEFANGED.search(raw)), bare, 0]
+            entry[2] += 1
+        return [ExtractedLink(url, defanged, bare, count) for url, (defanged, bare, count) in links.items()]
+
+    @staticmethod
+    def _matches(content: str) -> Iterator[re.Match]:
+        # Links never contain whitespace and always contain a (possibly defanged) dot, so
+        # the regex only runs over the few words that have one before their last character
+        for word in content.split():
+            if "." in word.rstrip(_TRAILING) or "dot" in word.lower():
+                yield from _LINK_PATTERN.finditer(word)
+
+    def _plausible_host(self, raw: str, bare: bool) -> bool:
+        host = _refang(raw).split("/", 1)[0]
+        host, _ = split_netloc(host)
+        tld = host.rsplit(".", 1)[-1]
+        if not self.suffixes.is_tld(tld):
+            return False
+        if bare and tld in self.file_extension_tlds and "/" not in raw:
+            return False
+        return bool(self.suffixes.decompose(host).registrable_domain)
+
+
+def _refang(text: str) -> str:
+    for pattern, replacement in _REFANG:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def _trim(link: str) -> str:
+    """Drop sentence punctuation and closing brackets that were not opened inside the link"""
+    while link and link[-1] in _TRAILING:
+        closing = link[-1]
+        opening = _BRACKETS.get(closing)
+        if opening and link.count(opening) >= link.count(closing) and not link.endswith(("[.]", "(.)", "{.}")):
+            break
+        link = link[:-1]
+    return link
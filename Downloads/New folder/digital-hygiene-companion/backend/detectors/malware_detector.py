@@ -1,17 +1,31 @@
 """Malware detection module - identifies potential malware indicators"""
 
 import re
-from typing import List, Dict
+from typing import List, Dict, Optional
 import logging
 
+from detectors.file_type import FILE_TYPES, FileType, extension_of
+from detectors.public_suffix import PublicSuffixList, default_suffix_list, netloc_of
+from detectors.result import DetectionResult
+from detectors.scan_engine import ScanEngine, default_engine
+from detectors.signatures import SignatureSet
+from reputation import ReputationStore
+
 logger = logging.getLogger(__name__)
 
 
 class MalwareDetector:
     """Detects potential malware indicators and suspicious file/executable patterns"""
 
-    def __init__(self):
+    name = "malware"
+
+    def __init__(self, engine: Optional[ScanEngine] = None, reputation: Optional[ReputationStore] = None,
+                 suffixes: Optional[PublicSuffixList] = None, signatures: Optional[SignatureSet] = None):
         self.confidence = 0.0
+        self.engine = engine or default_engine
+        self.suffixes = suffixes or default_suffix_list
+        # Offline blocklists (hosts, URL prefixes, file hashes); see reputation.py
+        self.reputation = reputation or ReputationStore()
         # Suspicious file extensions associated with malware
         self.malicious_extensions = [
             r"\.exe", r"\.scr", r"\.bat", r"\.cmd", r"\.com", r"\.vbs", r"\.js",
@@ -25,94 +39,210 @@ class MalwareDetector:
             r"(?:drop|dropper)",
             r"(?:trojan|backdoor|ransomware|worm|virus)",
         ]
-        # Suspicious domains known for malware
+        # Suspicious domains known for malware: ".tld" entries match the host's TLD or
+        # public suffix, the others its registrable domain
         self.malicious_domains = [
-            r"\.tk$", r"\.ml$", r"\.ga$", r"\.cf$",  # Suspicious free TLDs
-            r"bit\.ly", r"tinyurl", r"short\.link",  # URL shorteners often used in malware
+            ".tk", ".ml", ".ga", ".cf",  # Suspicious free TLDs
+            "bit.ly", "tinyurl.com", "short.link",  # URL shorteners often used in malware
         ]
-
-    def check_url_reputation(self, url: str) -> bool:
-        """
-        Check URL for malware reputation indicators
-        Returns True if malware indicators found
-        """
+        self._domain_policy = {entry: i for i, entry in enumerate(self.malicious_domains)}
+        self.url_shorteners = ["bit.ly", "tinyurl", "short.link"]
+        # Malware-related keywords and download lures in message content
+        self.malware_keywords = ["trojan", "ransomware", "virus", "worm", "backdoor", "exploit"]
+        self.download_extensions = [".exe", ".scr", ".dll"]
+        # Sniffed file types that must never hide behind another type's extension
+        self.disguise_categories = ["executable"]
+        self._known_extensions = frozenset().union(*(file_type.extensions for file_type in FILE_TYPES.values()))
+        # Content rules for uploaded files (detectors/data/signatures.yar by default)
+        self.signatures = signatures or SignatureSet.load()
+        self.signature_version = self.signatures.fingerprint
+
+        # Keyword checks are answered by the scan engine's literal automaton
+        self.engine.register_literals("malware.shorteners", self.url_shorteners)
+        self.engine.register_literals("malware.keywords", self.malware_keywords)
+        self.engine.register_literals("malware.download", ["download"])
+        self.engine.register_literals("malware.download_extensions", self.download_extensions)
+
+    def evaluate_url(self, url: str) -> DetectionResult:
+        """Score a URL for malware reputation indicators without touching instance state"""
         url_lower = url.lower()
-        self.confidence = 0.0
+        confidence = 0.0
+        matched_rules = []
+
+        # Listed in the local reputation index
+        if self.reputation.enabled:
+            if self.reputation.lookup_url(url_lower):
+                confidence += 0.9
+                matched_rules.append("malware.reputation.url")
+            elif self.reputation.lookup_host(netloc_of(url_lower)):
+                confidence += 0.9
+                matched_rules.append("malware.reputation.host")
 
         # Check for suspicious file attachments in URLs
         if any(re.search(pattern, url_lower) for pattern in self.malicious_extensions):
-            self.confidence += 0.4
-            return self.confidence > 0.3
+            confidence += 0.4
+            return self._result(confidence, 0.3, matched_rules + ["malware.extension"])
 
         # Check for URL shorteners
-        if any(shortener in url_lower for shortener in ["bit.ly", "tinyurl", "short.link"]):
-            self.confidence += 0.2  # URL shorteners hide true destination
+        if self.engine.scan(url_lower, group=self.name).any("malware.shorteners"):
+            confidence += 0.2  # URL shorteners hide true destination
+            matched_rules.append("malware.shortener")
 
         # Check for suspicious patterns
-        for pattern in self.suspicious_patterns:
+        for i, pattern in enumerate(self.suspicious_patterns):
             if re.search(pattern, url_lower):
-                self.confidence += 0.25
+                confidence += 0.25
+                matched_rules.append(f"malware.suspicious_pattern:{i}")
 
         # Check for malicious domains
-        for pattern in self.malicious_domains:
-            if re.search(pattern, url_lower):
-                self.confidence += 0.15
+        host = self.suffixes.decompose(netloc_of(url_lower))
+        policies = {self._domain_policy.get(name) for name in
+                    (f".{host.tld}", f".{host.public_suffix}", host.registrable_domain)
+                    if host.registrable_domain}
+        for i in sorted(policies - {None}):
+            confidence += 0.15
+            matched_rules.append(f"malware.domain:{i}")
 
         # DNS-based checks (simplified - in production would use real DNS services)
         if re.search(r"(?:ddns|duckdns|no-ip)", url_lower):
-            self.confidence += 0.2  # Dynamic DNS often used for malware C&C
+            confidence += 0.2  # Dynamic DNS often used for malware C&C
+            matched_rules.append("malware.dynamic_dns")
 
-        return self.confidence > 0.3
+        return self._result(confidence, 0.3, matched_rules)
 
-    def check_attachment(self, filename: str) -> bool:
-        """
-        Check attachment filename for malware indicators
-        Returns True if suspicious attachment detected
-        """
+    def evaluate_attachment(self, filename: str) -> DetectionResult:
+        """Score an attachment filename for malware indicators without touching instance state"""
         filename_lower = filename.lower()
-        self.confidence = 0.0
+        confidence = 0.0
+        matched_rules = []
 
         # Check file extension
         if any(re.search(pattern, filename_lower) for pattern in self.malicious_extensions):
-            self.confidence += 0.4
+            confidence += 0.4
+            matched_rules.append("malware.extension")
 
         # Check for double extensions (common malware trick)
         if re.search(r"\.(txt|pdf|doc|docx|jpg|png)\.\w+$", filename_lower):
-            self.confidence += 0.35
+            confidence += 0.35
+            matched_rules.append("malware.double_extension")
 
         # Check for suspicious naming patterns
-        for pattern in self.suspicious_patterns:
+        for i, pattern in enumerate(self.suspicious_patterns):
             if re.search(pattern, filename_lower):
-                self.confidence += 0.3
+                confidence += 0.3
+                matched_rules.append(f"malware.suspicious_pattern:{i}")
 
         # Whitespace attempts to hide real extension
-        if " " in filename and self.confidence > 0:
-            self.confidence += 0.15
+        if " " in filename and confidence > 0:
+            confidence += 0.15
+            matched_rules.append("malware.hidden_extension")
 
         # Check for hidden attributes (common in Windows)
         if filename.startswith("."):
-            self.confidence += 0.1
-
-        return self.confidence > 0.3
-
-    def detect_suspicious_content(self, content: str) -> bool:
+            confidence += 0.1
+            matched_rules.append("malware.hidden_file")
+
+        return self._result(confidence, 0.3, matched_rules)
+
+    def evaluate_file_hash(self, sha256: str) -> DetectionResult:
+        """Score a file by its SHA-256 digest against the local reputation index"""
+        if self.reputation.enabled and self.reputation.lookup_hash(sha256):
+            return self._result(1.0, 0.3, ["malware.reputation.hash"])
+        return self._result(0.0, 0.3, [])
+
+    def evaluate_file_type(self, filename: str, file_type: Optional[FileType]) -> DetectionResult:
+        """Score an attachment's sniffed type (see detectors/file_type.py) against its extension"""
+        confidence = 0.0
+        matched_rules = []
+        extension = extension_of(filename)
+
+        if file_type is not None and extension not in file_type.extensions:
+            # An executable named report.pdf is built to be double-clicked by mistake
+            if file_type.category in self.disguise_categories:
+                confidence += 0.7
+                matched_rules.append("malware.disguised_executable")
+            # Content of one known type under another known type's extension
+            elif extension in self._known_extensions:
+                confidence += 0.35
+                matched_rules.append("malware.type_mismatch")
+
+        return self._result(confidence, 0.3, matched_rules)
+
+    def detect_file(self, path: str, file_type: Optional[str] = None) -> DetectionResult:
         """
-        Detect suspicious content that might indicate malware distribution
+        Scan a file's bytes with the content signatures; each matched rule adds its score,
+        and details["signatures"] lists (rule, string, offset) for every string it found
         """
-        content_lower = content.lower()
-        self.confidence = 0.0
+        confidence = 0.0
+        matched_rules = []
+        indicators = []
+        hits = []
+        for rule, matches in self.signatures.scan_file(path, file_type):
+            confidence += rule.score
+            matched_rules.append(f"malware.signature:{rule.name}")
+            indicators.append(rule.description)
+            hits.extend((match.rule, match.string, match.offset) for match in matches)
+
+        return DetectionResult(
+            detector=self.name,
+            detected=confidence > 0.3,
+            confidence=min(1.0, confidence),
+            matched_rules=tuple(matched_rules),
+            indicators=tuple(indicators),
+            details=(("signatures", tuple(hits)),),
+        )
+
+    def evaluate_content(self, content: str) -> DetectionResult:
+        """Score text content for malware distribution without touching instance state"""
+        scan = self.engine.scan(content, group=self.name)
+        confidence = 0.0
+        matched_rules = []
 
         # Check for malware-related keywords
-        malware_keywords = ["trojan", "ransomware", "virus", "worm", "backdoor", "exploit"]
-        for keyword in malware_keywords:
-            if keyword in content_lower:
-                self.confidence += 0.15
+        for index in scan.matched("malware.keywords"):
+            confidence += 0.15
+            matched_rules.append(f"malware.keyword:{self.malware_keywords[index]}")
 
         # Check for suspicious download requests
-        if "download" in content_lower and any(ext in content_lower for ext in [".exe", ".scr", ".dll"]):
-            self.confidence += 0.3
+        if scan.any("malware.download") and scan.any("malware.download_extensions"):
+            confidence += 0.3
+            matched_rules.append("malware.download_request")
+
+        return self._result(confidence, 0.3, matched_rules)
+
+    def _result(self, confidence: float, threshold: float, matched_rules: List[str]) -> DetectionResult:
+        return DetectionResult(
+            detector=self.name,
+            detected=confidence > threshold,
+            confidence=min(1.0, confidence),
+            matched_rules=tuple(matched_rules),
+        )
+
+    def check_url_reputation(self, url: str) -> bool:
+        """
+        Check URL for malware reputation indicators
+        Returns True if malware indicators found
+        """
+        result = self.evaluate_url(url)
+        self.confidence = result.confidence
+        return result.detected
 
-        return self.confidence > 0.3
+    def check_attachment(self, filename: str) -> bool:
+        """
+        Check attachment filename for malware indicators
+        Returns True if suspicious attachment detected
+        """
+        result = self.evaluate_attachment(filename)
+        self.confidence = result.confidence
+        return result.detected
+
+    def detect_suspicious_content(self, content: str) -> bool:
+        """
+        Detect suspicious content that might indicate malware distribution
+        """
+        result = self.evaluate_content(content)
+        self.confidence = result.confidence
+        return result.detected
 
     def get_confidence(self) -> float:
         """Get the confidence score of the last detection"""
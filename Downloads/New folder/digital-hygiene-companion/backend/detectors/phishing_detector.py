@@ -1,17 +1,24 @@
 """Phishing detection module - identifies phishing attempts in text content"""
 
 import re
-from typing import List, Dict
+from typing import List, Dict, Optional
 import logging
 
+from detectors.result import DetectionResult
+from detectors.scan_engine import ScanEngine, ScanResult, default_engine
+
 logger = logging.getLogger(__name__)
 
 
 class PhishingDetector:
     """Detects phishing attempts using pattern matching and linguistic analysis"""
 
-    def __init__(self):
+    name = "phishing"
+    max_confidence = 0.95  # highest confidence evaluate() can report (used by the planner)
+
+    def __init__(self, engine: Optional[ScanEngine] = None):
         self.confidence = 0.0
+        self.engine = engine or default_engine
         # Common phishing keywords and patterns
         self.phishing_keywords = [
             r"verify\s+(?:your|my|account|identity|password)",
@@ -28,41 +35,80 @@ class PhishingDetector:
             r"(?:private|confidential)\s+information",
             r"(?:only\s+you|just\s+between\s+us)",
         ]
+        self.urgency_pattern = r"urgent|immediate|act\s+now"
+        self.action_pattern = r"click|confirm|verify|update"
+        # Suspicious sender attempts or email spoofing patterns
+        self.spoofing_pattern = r"(?:from|on\s+behalf\s+of)\s+\w+@\w+"
 
-    def detect(self, content: str) -> bool:
+        self.engine.register("phishing.keywords", self.phishing_keywords, flags=re.IGNORECASE)
+        self.engine.register("phishing.urgency", [self.urgency_pattern])
+        self.engine.register("phishing.action", [self.action_pattern])
+        self.engine.register("phishing.spoofing", [self.spoofing_pattern])
+
+    def evaluate(self, content: str, scan: Optional[ScanResult] = None) -> DetectionResult:
         """
-        Detect if content contains phishing indicators
-        Returns True if phishing detected
+        Score content for phishing indicators without touching instance state.
+        Pass ``scan`` to reuse hits from a shared scan of the same content.
         """
-        content_lower = content.lower()
-        self.confidence = 0.0
+        if scan is None:
+            scan = self.engine.scan(content)
+        confidence = 0.0
 
         # Check for phishing keywords
-        matched_keywords = 0
-        for pattern in self.phishing_keywords:
-            if re.search(pattern, content_lower, re.IGNORECASE):
-                matched_keywords += 1
+        matched_keywords = scan.count("phishing.keywords")
 
         # Check for urgency indicators combined with action requests
-        has_urgency = bool(re.search(r"urgent|immediate|act\s+now", content_lower))
-        has_action = bool(re.search(r"click|confirm|verify|update", content_lower))
+        has_urgency = scan.any("phishing.urgency")
+        has_action = scan.any("phishing.action")
 
         # Check for suspicious sender attempts or email spoofing patterns
-        has_spoofing_indicators = bool(
-            re.search(r"(?:from|on\s+behalf\s+of)\s+\w+@\w+", content_lower)
-        )
+        has_spoofing_indicators = scan.any("phishing.spoofing")
 
         # Calculate confidence score
+        keyword_score = 0.0
         if matched_keywords >= 2:
-            self.confidence = min(0.9, 0.3 + (matched_keywords * 0.15))
+            keyword_score = min(0.9, 0.3 + (matched_keywords * 0.15))
+            confidence = keyword_score
 
         if has_urgency and has_action:
-            self.confidence = max(self.confidence, 0.7)
+            confidence = max(confidence, 0.7)
+
+        spoofing_score = 0.0
+        if has_spoofing_indicators and confidence > 0.3:
+            confidence = min(0.95, confidence + 0.2)
+            spoofing_score = 0.2
 
-        if has_spoofing_indicators and self.confidence > 0.3:
-            self.confidence = min(0.95, self.confidence + 0.2)
+        return DetectionResult(
+            detector=self.name,
+            detected=confidence > 0.5,
+            confidence=min(1.0, confidence),
+            matched_rules=scan.rule_ids(
+                "phishing.keywords", "phishing.urgency", "phishing.action", "phishing.spoofing"
+            ),
+            sub_scores=(
+                ("keywords", keyword_score),
+                ("urgency_action", 0.7 if has_urgency and has_action else 0.0),
+                ("spoofing", spoofing_score),
+            ),
+        )
+
+    def lowest_reachable(self, result: DetectionResult) -> float:
+        """
+        Lowest confidence evaluate() can report once more text is added to the content of
+        ``result``: more matches only raise the score (the spoofing cap, 0.95, is above
+        anything reachable without it)
+        """
+        return result.confidence
 
-        return self.confidence > 0.5
+    def detect(self, content: str, scan: Optional[ScanResult] = None) -> bool:
+        """
+        Detect if content contains phishing indicators
+        Returns True if phishing detected. Kept for single-threaded callers: the score is
+        stored on the instance for get_confidence(); concurrent code should use evaluate().
+        """
+        result = self.evaluate(content, scan)
+        self.confidence = result.confidence
+        return result.detected
 
     def get_confidence(self) -> float:
         """Get the confidence score of the last detection"""
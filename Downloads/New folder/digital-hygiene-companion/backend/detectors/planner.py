@@ -0,0 +1,107 @@
+"""Evaluation planner - runs detector stages cheapest-first and stops once the label is settled"""
+
+import itertools
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence
+
+from detectors.result import DetectionResult
+
+# Lowest confidence a detector reports when it fires
+MIN_DETECTED_CONFIDENCE = 0.5
+
+
+@dataclass(frozen=True)
+class Stage:
+    """One detector as the planner sees it"""
+
+    name: str  # key in risk_scores, also the scan engine family group
+    cost: float  # relative cost of running the stage (e.g. pattern count)
+    max_confidence: float  # cap on the confidence the detector can report
+
+    @property
+    def priority(self) -> float:
+        """Cheap, high-impact stages first: a stage that can move the average further settles the label sooner"""
+        return self.cost / self.max_confidence
+
+
+class EvaluationPlanner:
+    """
+    Decides the order detector stages run in and when the remaining ones can be
+    skipped. The verdict averages the confidences of the detectors that fired, so
+    after each stage the planner checks every way the remaining stages could still
+    turn out (not firing, or firing anywhere between MIN_DETECTED_CONFIDENCE and
+    their cap). If none of them changes ``label_fn(average)``, evaluation stops.
+
+    With ``full=True`` every stage always runs, which keeps detected_risks complete
+    for auditing.
+
+    A stage whose prefilter says none of its anchor literals occur is not run at all;
+    it gets a zero-confidence result and counts as skipped by the prefilter.
+    """
+
+    def __init__(self, stages: Sequence[Stage], label_fn: Callable[[float], Hashable], full: bool = False):
+        self.stages: List[Stage] = sorted(stages, key=lambda stage: stage.priority)
+        self.label_fn = label_fn
+        self.full = full
+        self._lock = threading.Lock()
+        self._stats = {"evaluations": 0, "stages_run": 0, "stages_skipped": 0}
+        self._prefiltered = {stage.name: 0 for stage in self.stages}
+
+    def settled(self, risk_scores: Dict[str, float], remaining: Sequence[Stage]) -> bool:
+        """True when no outcome of the ``remaining`` stages can change the label"""
+        if not remaining:
+            return True
+        fired_total = sum(risk_scores.values())
+        fired = len(risk_scores)
+        labels = set()
+        for size in range(len(remaining) + 1):
+            for subset in itertools.combinations(remaining, size):
+                count = fired + size
+                if not count:
+                    labels.add(self.label_fn(0.0))
+                    continue
+                # The label is monotonic in the average, so the two extremes cover the range
+                labels.add(self.label_fn((fired_total + size * MIN_DETECTED_CONFIDENCE) / count))
+                labels.add(self.label_fn((fired_total + sum(s.max_confidence for s in subset)) / count))
+                if len(labels) > 1:
+                    return False
+        return True
+
+    def run(self, evaluate: Callable[[Stage], DetectionResult],
+            prefilter: Optional[Callable[[Stage], bool]] = None) -> Dict[str, DetectionResult]:
+        """
+        Run stages in planned order. ``evaluate(stage)`` returns a DetectionResult;
+        ``prefilter(stage)`` returns False when the stage cannot fire. Returns
+        {stage name: result} for the stages that were reached.
+        """
+        results: Dict[str, DetectionResult] = {}
+        risk_scores: Dict[str, float] = {}
+        prefiltered = []
+        for position, stage in enumerate(self.stages):
+            if prefilter is not None and not prefilter(stage):
+                result = DetectionResult(detector=stage.name, detected=False, confidence=0.0)
+                prefiltered.append(stage.name)
+            else:
+                result = evaluate(stage)
+            results[stage.name] = result
+            if result.detected:
+                risk_scores[stage.name] = result.confidence
+            remaining = self.stages[position + 1:]
+            if not self.full and self.settled(risk_scores, remaining):
+                break
+
+        with self._lock:
+            self._stats["evaluations"] += 1
+            self._stats["stages_run"] += len(results) - len(prefiltered)
+            self._stats["stages_skipped"] += len(self.stages) - len(results)
+            for name in prefiltered:
+                self._prefiltered[name] += 1
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["skipped_by_prefilter"] = dict(self._prefiltered)
+        snapshot.update(full=self.full, order=[stage.name for stage in self.stages])
+        return snapshot
@@ -0,0 +1,173 @@
+"""
+Host decomposition backed by the Public Suffix List.
+
+The bundled snapshot (data/public_suffix_list.dat, from https://publicsuffix.org/list/,
+MPL 2.0) is loaded into a trie keyed by reversed labels, so finding the effective TLD
+of a host walks at most one node per label. ``decompose`` splits a URL's netloc once
+into host, effective TLD, registrable domain and subdomain, and detectors look up their
+TLD and domain policies against those parts instead of scanning the raw netloc.
+"""
+
+import ipaddress
+import logging
+import os
+from dataclasses import dataclass
+from typing import Dict, Iterator, Optional, Tuple
+
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+BUNDLED_LIST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "public_suffix_list.dat")
+
+# Trie node markers (labels never contain these characters)
+_RULE = "$"
+_EXCEPTION = "!"
+_WILDCARD = "*"
+
+
+@dataclass(frozen=True)
+class HostParts:
+    """One host split along the Public Suffix List"""
+
+    host: str  # lowercase, without credentials, port or trailing dot
+    public_suffix: str  # effective TLD, e.g. "co.uk"; "" for IP addresses
+    registrable_domain: str  # public suffix plus one label; "" when the host is a suffix or an IP
+    subdomain: str  # labels left of the registrable domain
+    is_ip: bool
+
+    @property
+    def tld(self) -> str:
+        """Last label of the host ("uk" for a.b.co.uk)"""
+        return "" if self.is_ip else self.host.rsplit(".", 1)[-1]
+
+    @property
+    def subdomain_depth(self) -> int:
+        return self.subdomain.count(".") + 1 if self.subdomain else 0
+
+    def domains(self) -> Iterator[str]:
+        """The host and each parent domain down to the registrable domain"""
+        if not self.registrable_domain:
+            if self.host:
+                yield self.host
+            return
+        yield self.registrable_domain
+        labels = self.subdomain.split(".") if self.subdomain else []
+        for i in range(len(labels)):
+            yield ".".join(labels[-1 - i:]) + "." + self.registrable_domain
+
+
+def split_netloc(netloc: str) -> Tuple[str, Optional[str]]:
+    """(host, port) of a netloc: credentials dropped, host lowercased, trailing dot removed"""
+    netloc = netloc.strip().lower().rsplit("@", 1)[-1]
+    if netloc.startswith("["):  # IPv6 literal
+        host, _, rest = netloc[1:].partition("]")
+        return host, rest[1:] if rest.startswith(":") else None
+    host, _, port = netloc.partition(":")
+    return host.rstrip("."), port or None
+
+
+def netloc_of(url: str) -> str:
+    """Netloc of a URL, also for URLs written without a scheme ("bit.ly/x")"""
+    _, separator, rest = url.partition("//")
+    if not separator:
+        rest = url
+    for delimiter in "/?#":
+        rest = rest.split(delimiter, 1)[0]
+    return rest
+
+
+def _ip_address(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return True
+
+
+def _ascii_label(label: str) -> Optional[str]:
+    """Punycode form of a Unicode rule label (None if it has no valid IDNA form)"""
+    try:
+        return label.encode("idna").decode("ascii")
+    except UnicodeError:
+        return None
+
+
+class PublicSuffixList:
+    """Reversed-label suffix trie with the list's wildcard and exception rules"""
+
+    def __init__(self, rules: Iterator[str], cache_size: int = 4096):
+        self._root: Dict[str, dict] = {}
+        self.rule_count = 0
+        for rule in rules:
+            self.add_rule(rule)
+        # Both URL detectors decompose the same hosts; share the work
+        self.cache = LRUCache(max_entries=cache_size)
+
+    @classmethod
+    def load(cls, path: str = BUNDLED_LIST_PATH, cache_size: int = 4096) -> "PublicSuffixList":
+        """Load a list in publicsuffix.org format (ICANN and private sections)"""
+        with open(path, "r", encoding="utf-8") as handle:
+            suffixes = cls((line.split()[0] for line in handle if line.strip() and not line.startswith("//")),
+                           cache_size=cache_size)
+        logger.info(f"Loaded {suffixes.rule_count} public suffix rules from {path}")
+        return suffixes
+
+    def add_rule(self, rule: str) -> None:
+        rule = rule.strip().lower()
+        exception = rule.startswith("!")
+        labels = rule.lstrip("!").split(".")
+        forms = [labels]
+        ascii_labels = [label if label.isascii() else _ascii_label(label) for label in labels]
+        if ascii_labels != labels and None not in ascii_labels:
+            forms.append(ascii_labels)
+        for form in forms:
+            node = self._root
+            for label in reversed(form):
+                node = node.setdefault(label, {})
+            node[_EXCEPTION if exception else _RULE] = True
+        self.rule_count += 1
+
+    def is_tld(self, label: str) -> bool:
+        """True if the label is a top-level domain on the list (e.g. "com", not "exe")"""
+        return label.lower() in self._root
+
+    def suffix_length(self, labels: list) -> int:
+        """Number of trailing labels that form the public suffix (the "*" default rule gives 1)"""
+        length = 1
+        node = self._root
+        for i, label in enumerate(reversed(labels)):
+            child = node.get(label)
+            if child is not None and _EXCEPTION in child:
+                return i  # "!www.ck": the suffix is the exception rule minus its first label
+            if child is None:
+                child = node.get(_WILDCARD)
+                if child is None:
+                    break
+            if _RULE in child:
+                length = i + 1
+            node = child
+        return min(length, len(labels))
+
+    def decompose(self, netloc: str) -> HostParts:
+        """Split a netloc (or bare host) into its Public Suffix List parts"""
+        parts = self.cache.get(netloc)
+        if parts is None:
+            host, _ = split_netloc(netloc)
+            if _ip_address(host):
+                parts = HostParts(host, "", "", "", True)
+            else:
+                labels = host.split(".") if host else []
+                length = self.suffix_length(labels) if labels else 0
+                public_suffix = ".".join(labels[len(labels) - length:])
+                if len(labels) > length:
+                    registrable = ".".join(labels[len(labels) - length - 1:])
+                    subdomain = ".".join(labels[:len(labels) - length - 1])
+                else:
+                    registrable = subdomain = ""
+                parts = HostParts(host, public_suffix, registrable, subdomain, False)
+            self.cache.put(netloc, parts, size=0)
+        return parts
+
+
+default_suffix_list = PublicSuffixList.load()
@@ -0,0 +1,235 @@
+"""
+QR payload module - reads the text of a scanned QR code into typed targets and scores
+the action the code asks for.
+
+QR codes carry more than links: Wi-Fi logins (WIFI:), prefilled text messages (SMSTO:,
+sms:), emails (MAILTO:, MATMSG:), phone numbers (tel:), contacts (MECARD:, vCard),
+bookmarks (MEBKM:) and places (geo:). ``parse_qr_payload`` lists the URLs, phone
+numbers, email addresses and free text of each, so the pipeline can send URLs to the
+URL detectors and text to the text detectors; QRPayloadDetector covers what neither
+sees, like a tel: code that dials a USSD command or a network without a password.
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote
+import logging
+
+from detectors.result import DetectionResult
+
+logger = logging.getLogger(__name__)
+
+# Schemes that make a payload a link on its own (the URL analyzer gets the whole payload)
+_URL_PAYLOAD = re.compile(r"^(?:[a-z][a-z0-9+.-]*://|www\.|(?:intent|market|javascript|data):)", re.IGNORECASE)
+_VCARD_LINE_BREAK = re.compile(r"\r\n|\r|\n")
+
+
+@dataclass(frozen=True)
+class QRPayload:
+    """What a QR code contains, split by the detector each part goes to"""
+
+    kind: str  # url, wifi, sms, email, phone, contact, geo, text
+    urls: Tuple[str, ...] = ()
+    phones: Tuple[str, ...] = ()
+    emails: Tuple[str, ...] = ()
+    text: str = ""  # message body, note or plain text for the text detectors
+    content_type: str = "message"  # how the text is scored: sms, email or message
+    fields: Tuple[Tuple[str, str], ...] = ()  # other parsed fields (ssid, security, name, ...)
+
+    def field(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        return dict(self.fields).get(name, default)
+
+
+def _split_fields(body: str) -> List[Tuple[str, str]]:
+    """KEY:value; pairs of WIFI, MECARD, MATMSG and MEBKM codes (backslash escapes ; , : \\ ")"""
+    parts, current, escaped = [], [], False
+    for char in body:
+        if escaped:
+            current.append(char)
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char == ";":
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+    parts.append("".join(current))
+    fields = []
+    for part in parts:
+        key, colon, value = part.partition(":")
+        if colon:
+            fields.append((key.strip().upper(), value))
+    return fields
+
+
+def _values(fields: List[Tuple[str, str]], key: str) -> Tuple[str, ...]:
+    return tuple(value.strip() for name, value in fields if name == key and value.strip())
+
+
+def _vcard_properties(text: str) -> List[Tuple[str, str]]:
+    """(NAME, value) of every vCard line, folded lines joined and \\n \\, \\; escapes undone"""
+    lines: List[str] = []
+    for line in _VCARD_LINE_BREAK.split(text):
+        if line[:1] in (" ", "\t") and lines:
+            lines[-1] += line[1:]
+        else:
+            lines.append(line)
+    properties = []
+    for line in lines:
+        name, colon, value = line.partition(":")
+        if not colon:
+            continue
+        # "item1.URL;TYPE=work" -> "URL"
+        name = name.split(";")[0].split(".")[-1].strip().upper()
+        value = re.sub(r"\\(.)", lambda m: "\n" if m.group(1) in "nN" else m.group(1), value)
+        properties.append((name, value))
+    return properties
+
+
+def _query(query: str) -> Dict[str, str]:
+    return {key.lower(): values[0] for key, values in parse_qs(query, keep_blank_values=True).items()}
+
+
+def _addresses(value: str) -> Tuple[str, ...]:
+    return tuple(address.strip() for address in unquote(value).split(",") if address.strip())
+
+
+def _join(*texts: Optional[str]) -> str:
+    return "\n".join(text for text in texts if text)
+
+
+def parse_qr_payload(data: str) -> QRPayload:
+    """Typed contents of a QR code's text; anything unrecognized is plain text"""
+    payload = data.strip()
+    scheme, colon, rest = payload.partition(":")
+    scheme = scheme.upper() if colon else ""
+
+    if scheme == "WIFI":
+        fields = _split_fields(rest)
+        security = (_values(fields, "T") or ("nopass",))[0]
+        hidden = (_values(fields, "H") or ("false",))[0].lower()
+        return QRPayload("wifi", fields=(
+            ("ssid", (_values(fields, "S") or ("",))[0]),
+            ("security", security),
+            ("hidden", "true" if hidden == "true" else "false"),
+        ))  # the password is never carried over
+
+    if scheme in ("SMSTO", "MMSTO", "SMS", "MMS"):
+        if "?" in rest and scheme in ("SMS", "MMS"):
+            # sms:+15551234567?body=text (RFC 5724)
+            numbers, _, query = rest.partition("?")
+            body = _query(query).get("body", "")
+        else:
+            # SMSTO:+15551234567:text
+            numbers, _, body = rest.partition(":")
+        return QRPayload("sms", phones=_addresses(numbers), text=body, content_type="sms")
+
+    if scheme == "TEL":
+        return QRPayload("phone", phones=_addresses(rest))
+
+    if scheme == "MAILTO":
+        addresses, _, query = rest.partition("?")
+        params = _query(query)
+        return QRPayload("email", emails=_addresses(addresses) + _addresses(params.get("cc", "")),
+                         text=_join(params.get("subject"), params.get("body")), content_type="email",
+                         fields=(("subject", params.get("subject", "")),))
+
+    if scheme == "MATMSG":
+        fields = _split_fields(rest)
+        subject = " ".join(_values(fields, "SUB"))
+        return QRPayload("email", emails=_values(fields, "TO"), text=_join(subject, *_values(fields, "BODY")),
+                         content_type="email", fields=(("subject", subject),))
+
+    if scheme == "MECARD":
+        fields = _split_fields(rest)
+        return QRPayload("contact", urls=_values(fields, "URL"), phones=_values(fields, "TEL"),
+                         emails=_values(fields, "EMAIL"), text=_join(*_values(fields, "NOTE")),
+                         fields=(("name", " ".join(_values(fields, "N"))), ("org", " ".join(_values(fields, "ORG")))))
+
+    if payload[:11].upper() == "BEGIN:VCARD":
+        properties = _vcard_properties(payload)
+        return QRPayload("contact", urls=_values(properties, "URL"), phones=_values(properties, "TEL"),
+                         emails=_values(properties, "EMAIL"), text=_join(*_values(properties, "NOTE")),
+                         fields=(("name", " ".join(_values(properties, "FN"))),
+                                 ("org", " ".join(_values(properties, "ORG")))))
+
+    if scheme in ("MEBKM", "URLTO"):
+        # Bookmarks: MEBKM:TITLE:name;URL:link;; and the older URLTO:link
+        fields = _split_fields(rest)
+        urls = _values(fields, "URL") if scheme == "MEBKM" else (rest.strip(),)
+        return QRPayload("url", urls=tuple(url for url in urls if url), text=_join(*_values(fields, "TITLE")))
+
+    if scheme == "GEO":
+        location, _, query = rest.partition("?")
+        return QRPayload("geo", text=_query(query).get("q", ""), fields=(("location", location),))
+
+    if _URL_PAYLOAD.match(payload):
+        return QRPayload("url", urls=(payload,))
+
+    return QRPayload("text", text=payload)
+
+
+class QRPayloadDetector:
+    """Scores what a QR code makes the phone do: dial, text or join a network"""
+
+    name = "qr"
+
+    def __init__(self):
+        # International (+) and national dialing prefixes of premium-rate numbers
+        self.premium_prefixes = [
+            "+1900", "1900", "+44871", "+44872", "+44873", "+449", "0871", "0872", "0873", "0900", "0906", "0909",
+            "+49900", "+49137", "+31900", "+32900", "+33899", "+34803", "+34806", "+34807",
+            "+39899", "+61190", "+351760",
+        ]
+        # Wi-Fi security values that let anyone in range join or listen in
+        self.insecure_wifi = ["nopass", "", "wep"]
+        # Longest number still treated as an SMS short code (premium subscriptions)
+        self.limits = {"short_code_digits": 6}
+
+    @staticmethod
+    def dial_string(number: str) -> str:
+        """Number as dialed: digits, +, * and #, with a 00 international prefix as +"""
+        dial = "".join(char for char in unquote(number) if char.isdigit() or char in "+*#")
+        return "+" + dial[2:] if dial.startswith("00") else dial
+
+    def evaluate(self, payload: QRPayload) -> DetectionResult:
+        """Score a parsed payload without touching instance state"""
+        confidence = 0.0
+        matched_rules = []
+        indicators = []
+
+        for number in payload.phones:
+            dial = self.dial_string(number)
+            # tel:*#... runs a USSD/MMI command the moment it is dialed (wipes, call forwarding)
+            if "*" in dial or "#" in dial:
+                confidence += 0.7
+                matched_rules.append("qr.ussd_code")
+                indicators.append(f"Phone code {dial} runs a command on the phone")
+            elif any(dial.startswith(prefix) for prefix in self.premium_prefixes):
+                confidence += 0.4
+                matched_rules.append("qr.premium_number")
+                indicators.append(f"{dial} is a premium-rate number")
+            elif payload.kind == "sms" and dial.isdigit() and len(dial) <= self.limits["short_code_digits"]:
+                confidence += 0.25
+                matched_rules.append("qr.sms_short_code")
+                indicators.append(f"Texting short code {dial} may start a paid subscription")
+
+        if payload.kind == "wifi":
+            if (payload.field("security") or "").lower() in self.insecure_wifi:
+                confidence += 0.35
+                matched_rules.append("qr.insecure_wifi")
+                indicators.append("Wi-Fi network without a password or with broken (WEP) encryption")
+            if payload.field("hidden") == "true":
+                confidence += 0.1
+                matched_rules.append("qr.hidden_wifi")
+                indicators.append("Hidden Wi-Fi network")
+
+        return DetectionResult(
+            detector=self.name,
+            detected=confidence > 0.3,
+            confidence=min(1.0, confidence),
+            matched_rules=tuple(matched_rules),
+            indicators=tuple(indicators),
+        )
@@ -0,0 +1,34 @@
+"""Detection result module - immutable per-call results returned by every detector"""
+
+from dataclasses import dataclass
+from typing import Any, Dict, Tuple
+
+
+@dataclass(frozen=True)
+class DetectionResult:
+    """
+    Outcome of a single detector call. Results carry everything the caller needs, so
+    detector instances hold no per-call state and can be shared across threads; the
+    tuple-based fields keep results hashable and picklable for process pools.
+    """
+
+    detector: str
+    detected: bool
+    confidence: float  # 0.0 to 1.0
+    matched_rules: Tuple[str, ...] = ()  # rule ids, e.g. "phishing.keywords:3"
+    sub_scores: Tuple[Tuple[str, float], ...] = ()  # named partial scores
+    indicators: Tuple[str, ...] = ()  # human-readable findings
+    details: Tuple[Tuple[str, Any], ...] = ()  # extra analysis fields
+
+    @property
+    def scores(self) -> Dict[str, float]:
+        """Sub-scores as a fresh dict"""
+        return dict(self.sub_scores)
+
+    def score(self, name: str, default: float = 0.0) -> float:
+        """Look up a single sub-score"""
+        return dict(self.sub_scores).get(name, default)
+
+    def detail(self, name: str, default: Any = None) -> Any:
+        """Look up a single detail field"""
+        return dict(self.details).get(name, default)
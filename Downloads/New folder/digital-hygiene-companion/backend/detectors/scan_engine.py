@@ -0,0 +1,443 @@
+"""Shared scan engine - evaluates every registered detector pattern from a single pass over the content"""
+
+import re
+import threading
+import time
+from typing import Dict, FrozenSet, Iterable, List, Optional, Pattern, Set, Tuple
+import logging
+
+from detectors.timing import rule_times
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:  # Python < 3.11
+    import sre_parse
+    import sre_constants
+
+logger = logging.getLogger(__name__)
+
+# Characters that re.IGNORECASE folds onto an ASCII letter but that str.lower() leaves alone
+_CASE_FOLDS = {"i": "ı", "s": "ſ"}
+_UNFOLD = str.maketrans({fold: letter for letter, fold in _CASE_FOLDS.items()})
+
+
+def _required_literals(nodes, ignorecase: bool = False) -> Optional[Set[str]]:
+    """
+    Return a set of literals such that every match of the parsed sequence contains at
+    least one of them, preferring the most selective set. None if no such set exists.
+    """
+    candidates = []
+    run: List[str] = []
+
+    def flush():
+        if run:
+            candidates.append({"".join(run)})
+            run.clear()
+
+    for op, av in nodes:
+        if op is sre_constants.LITERAL:
+            char = chr(av)
+            if ignorecase:
+                if not char.isascii():
+                    flush()
+                    continue
+                char = char.lower()
+            run.append(char)
+            continue
+        flush()
+        if op is sre_constants.SUBPATTERN:
+            _, add_flags, del_flags, sub = av
+            sub_ignorecase = (ignorecase or bool(add_flags & sre_constants.SRE_FLAG_IGNORECASE)) \
+                and not del_flags & sre_constants.SRE_FLAG_IGNORECASE
+            literals = _required_literals(sub, sub_ignorecase)
+            if literals:
+                candidates.append(literals)
+        elif op is sre_constants.BRANCH:
+            alternatives = [_required_literals(alt, ignorecase) for alt in av[1]]
+            if all(alternatives):
+                candidates.append(set().union(*alternatives))
+        elif op is sre_constants.IN:
+            chars = [chr(value) for member, value in av if member is sre_constants.LITERAL]
+            if len(chars) == len(av) and (not ignorecase or all(c.isascii() for c in chars)):
+                candidates.append({c.lower() if ignorecase else c for c in chars})
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) and av[0] >= 1:
+            literals = _required_literals(av[2], ignorecase)
+            if literals:
+                candidates.append(literals)
+    flush()
+
+    if not candidates:
+        return None
+    return max(candidates, key=lambda literals: (min(len(lit) for lit in literals), -len(literals)))
+
+
+def _is_plain_literal(nodes) -> bool:
+    return bool(nodes) and all(op is sre_constants.LITERAL for op, _ in nodes)
+
+
+def trie_pattern(words: Iterable[str]) -> str:
+    """
+    Compile literals into a prefix-factored regex (a trie), so the regex engine walks
+    shared prefixes once instead of trying every word at every position. Longest
+    alternatives win; 'i' and 's' also accept their IGNORECASE-only folds.
+    """
+    trie: Dict[str, dict] = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def char_pattern(char: str) -> str:
+        if char in _CASE_FOLDS:
+            return f"[{char}{_CASE_FOLDS[char]}]"
+        return re.escape(char)
+
+    def build(node: dict) -> str:
+        branches = [char_pattern(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        terminal = "" in node
+        if len(branches) == 1 and not terminal:
+            return branches[0]
+        group = "(?:" + "|".join(branches) + ")"
+        return group + "?" if terminal else group
+
+    return build(trie)
+
+
+class LiteralAutomaton:
+    """
+    Multi-literal matcher. Every word is compiled into one trie regex that is run once
+    over the text as a zero-width lookahead, so each position reports the longest word
+    starting there; the shorter words that are prefixes of it come from a table built
+    up front. The cost of a pass grows with the text, not with the number of words.
+    """
+
+    def __init__(self, words: Iterable[str]):
+        self.words = frozenset(words)
+        # word -> every word that is a prefix of it (itself included)
+        self.prefixes = {
+            word: [word[:end] for end in range(1, len(word) + 1) if word[:end] in self.words]
+            for word in self.words
+        }
+        self.regex = re.compile(f"(?=({trie_pattern(self.words)}))") if self.words else None
+
+    def occurrences(self, text: str) -> Dict[str, bool]:
+        """
+        Words present in the text -> True if found verbatim, False if only present
+        through a case fold ('ı', 'ſ') that IGNORECASE patterns accept
+        """
+        found_words: Dict[str, bool] = {}
+        if self.regex is None:
+            return found_words
+        for found in set(self.regex.findall(text)):
+            longest = found.translate(_UNFOLD)
+            for word in self.prefixes.get(longest) or self.prefixes.get(found, ()):
+                if found.startswith(word):
+                    found_words[word] = True
+                else:
+                    found_words.setdefault(word, False)
+        return found_words
+
+    def find(self, text: str) -> Set[str]:
+        """Words that occur verbatim in the text (the ``word in text`` checks, all at once)"""
+        return {word for word, verbatim in self.occurrences(text).items() if verbatim}
+
+
+class ScanResult:
+    """Rule hits produced by one scan; detectors score from this instead of re-reading the content"""
+
+    __slots__ = ("_families", "_hits")
+
+    def __init__(self, families: Dict[str, List[int]], hits: FrozenSet[int]):
+        self._families = families
+        self._hits = hits
+
+    def matched(self, family: str) -> List[int]:
+        """Indices (in registration order) of the family's patterns that matched"""
+        return [i for i, slot in enumerate(self._families.get(family, ())) if slot in self._hits]
+
+    def count(self, family: str) -> int:
+        """Number of the family's patterns that matched"""
+        return sum(1 for slot in self._families.get(family, ()) if slot in self._hits)
+
+    def any(self, family: str) -> bool:
+        """True if at least one of the family's patterns matched"""
+        return any(slot in self._hits for slot in self._families.get(family, ()))
+
+    def has(self, family: str, index: int) -> bool:
+        """True if the family's pattern at ``index`` matched"""
+        slots = self._families.get(family, ())
+        return index < len(slots) and slots[index] in self._hits
+
+    def rule_ids(self, *families: str) -> Tuple[str, ...]:
+        """Ids ("family:index") of the matched patterns in the given families"""
+        return tuple(f"{family}:{i}" for family in families for i in self.matched(family))
+
+
+class _CompiledRules:
+    """Immutable snapshot of the engine, rebuilt whenever a family is registered"""
+
+    def __init__(self, sources: List[str], families: Dict[str, List[int]]):
+        self.families = {name: list(slots) for name, slots in families.items()}
+        active = sorted({slot for slots in self.families.values() for slot in slots})
+        self.groups: Dict[str, Set[int]] = {}  # "phishing" -> slots of every "phishing.*" family
+        for name, slots in self.families.items():
+            self.groups.setdefault(name.split(".", 1)[0], set()).update(slots)
+
+        self.patterns: Dict[int, Pattern] = {}
+        self.unanchored: Set[int] = set()  # no required literal: always verified
+        self.candidates: Dict[str, Set[int]] = {}  # anchor -> slots that need a regex check
+        self.confirmed: Dict[str, Set[int]] = {}  # anchor -> plain-literal slots it proves
+        self.slot_anchors: Dict[int, Optional[Set[str]]] = {}
+        self.slot_names: Dict[int, str] = {}  # slot -> "rule.<family>.<index>" of its first family
+        for name, slots in self.families.items():
+            for index, slot in enumerate(slots):
+                self.slot_names.setdefault(slot, f"rule.{name}.{index}")
+        for slot in active:
+            source = sources[slot]
+            self.patterns[slot] = re.compile(source)
+            parsed = sre_parse.parse(source)
+            literals = _required_literals(parsed, bool(parsed.state.flags & re.IGNORECASE))
+            self.slot_anchors[slot] = literals
+            if literals is None:
+                self.unanchored.add(slot)
+            elif len(literals) == 1 and _is_plain_literal(parsed):
+                self.confirmed.setdefault(next(iter(literals)), set()).add(slot)
+            else:
+                for literal in literals:
+                    self.candidates.setdefault(literal, set()).add(slot)
+
+        self.anchors = LiteralAutomaton(set(self.candidates) | set(self.confirmed))
+
+
+class ScanEngine:
+    """
+    Collects the pattern lists of all detectors and evaluates them from one pass.
+
+    Each pattern is reduced to the literals any of its matches must contain. A single
+    trie-compiled regex walks the lowercased content once and reports which of those
+    anchors occur; only patterns whose anchors were seen are then confirmed with their
+    own regex, and plain keyword patterns are confirmed by the anchor hit alone. The hit
+    set is identical to calling ``re.search`` for every pattern.
+    """
+
+    def __init__(self):
+        self._sources: List[str] = []  # slot -> pattern source
+        self._slot_by_source: Dict[str, int] = {}
+        self._families: Dict[str, List[int]] = {}
+        self._compiled: Optional[_CompiledRules] = None
+        self._group_rules: Dict[str, _CompiledRules] = {}
+        self._lock = threading.Lock()
+
+    def register(self, family: str, patterns: Iterable[str], flags: int = 0) -> None:
+        """
+        Register a family of regex patterns. Identical patterns registered by several
+        detectors share one slot and are evaluated once. Re-registering a family replaces it.
+        """
+        with self._lock:
+            slots = []
+            for pattern in patterns:
+                source = f"(?i:{pattern})" if flags & re.IGNORECASE else pattern
+                if source not in self._slot_by_source:
+                    self._slot_by_source[source] = len(self._sources)
+                    self._sources.append(source)
+                slots.append(self._slot_by_source[source])
+            self._families[family] = slots
+            self._compiled = None
+            self._group_rules = {}
+
+    def register_literals(self, family: str, words: Iterable[str]) -> None:
+        """Register plain substrings (the ``word in content_lower`` checks)"""
+        self.register(family, [re.escape(word) for word in words])
+
+    @property
+    def families(self) -> List[str]:
+        return list(self._families)
+
+    def compile(self) -> _CompiledRules:
+        """Build the anchor automaton; called lazily by scan() after registration changes"""
+        with self._lock:
+            if self._compiled is None:
+                self._compiled = _CompiledRules(self._sources, self._families)
+                logger.info(
+                    f"Scan engine compiled {len(self._compiled.patterns)} patterns from "
+                    f"{len(self._families)} families"
+                )
+            return self._compiled
+
+    def scan(self, content: str, group: Optional[str] = None) -> ScanResult:
+        """
+        Lowercase the content once and return the hits for every registered family, or
+        only for the families of one group ("<group>.*") - e.g. a URL scanned for the
+        "url" keyword families without the message-text rules.
+        """
+        rules = (self._compiled or self.compile()) if group is None else self._rules_for_group(group)
+        return ScanResult(rules.families, frozenset(_match(rules, content.lower())))
+
+    def _rules_for_group(self, group: str) -> _CompiledRules:
+        rules = self._group_rules.get(group)
+        if rules is None:
+            with self._lock:
+                families = {name: slots for name, slots in self._families.items() if name.startswith(group + ".")}
+                rules = self._group_rules[group] = _CompiledRules(self._sources, families)
+        return rules
+
+    def anchors(self, group: str) -> Optional[FrozenSet[str]]:
+        """
+        Literals one of which must occur (lowercased) for any pattern of the group to
+        match; None if some pattern has no such literal and the group cannot be prefiltered
+        """
+        rules = self._compiled or self.compile()
+        anchors: Set[str] = set()
+        for slot in rules.groups.get(group, ()):
+            if rules.slot_anchors[slot] is None:
+                return None
+            anchors |= rules.slot_anchors[slot]
+        return frozenset(anchors)
+
+    def group_size(self, group: str) -> int:
+        """Number of distinct patterns in a group (the families named "<group>.*")"""
+        return len({slot for family, slots in self._families.items()
+                    if family.startswith(group + ".") for slot in slots})
+
+    def lazy(self, content: str) -> "LazyScan":
+        """Lowercase the content once and scan family groups only when they are asked for"""
+        return LazyScan(self._compiled or self.compile(), content.lower())
+
+    def stream(self, overlap: int = 1024, chunk_size: int = 64 * 1024) -> "StreamScanner":
+        """Start an incremental scan for content that arrives in pieces"""
+        return StreamScanner(self._compiled or self.compile(), overlap, chunk_size)
+
+
+def _anchor_pass(rules: _CompiledRules, text: str) -> Tuple[Set[int], Set[int]]:
+    """Slots proven by their anchor alone, and slots that still need their regex checked"""
+    hits: Set[int] = set()
+    pending = set(rules.unanchored)
+    for anchor, verbatim in rules.anchors.occurrences(text).items():
+        # A folded letter only proves the anchor for case-insensitive patterns
+        (hits if verbatim else pending).update(rules.confirmed.get(anchor, ()))
+        pending.update(rules.candidates.get(anchor, ()))
+    return hits, pending - hits
+
+
+def _match(rules: _CompiledRules, text: str, known: FrozenSet[int] = frozenset()) -> Set[int]:
+    """Slots matching the lowercased text; slots in ``known`` are not re-checked"""
+    hits, pending = _anchor_pass(rules, text)
+    _confirm(rules, text, pending - known, hits)
+    return hits
+
+
+def _confirm(rules: _CompiledRules, text: str, slots: Iterable[int], hits: Set[int]) -> None:
+    """Add the slots whose regex matches the text to ``hits`` (each check timed with DEBUG_RULE_TIMING)"""
+    times = rule_times()
+    if times is None:
+        for slot in slots:
+            if rules.patterns[slot].search(text):
+                hits.add(slot)
+        return
+    for slot in slots:
+        started = time.perf_counter()
+        if rules.patterns[slot].search(text):
+            hits.add(slot)
+        times.add_rule(rules.slot_names[slot], time.perf_counter() - started)
+
+
+class LazyScan:
+    """
+    Scan whose regex checks run per family group (the "<group>." prefix, e.g.
+    "phishing") on demand. The anchor pass still covers every group at once; only the
+    costlier regex confirmations wait until a planner asks for the group.
+    """
+
+    def __init__(self, rules: _CompiledRules, text: str):
+        self._rules = rules
+        self._text = text
+        self._hits, self._pending = _anchor_pass(rules, text)
+        self.groups_checked: List[str] = []
+
+    def anchored(self, group: str) -> bool:
+        """
+        Prefilter: False when none of the group's anchor literals occur, i.e. no pattern
+        of the group can match and its detector has nothing to score
+        """
+        slots = self._rules.groups.get(group, set())
+        return not (slots.isdisjoint(self._hits) and slots.isdisjoint(self._pending))
+
+    def require(self, group: str) -> ScanResult:
+        """Confirm the group's candidate patterns if not done yet; returns the hits so far"""
+        if group not in self.groups_checked:
+            checking = self._pending & self._rules.groups.get(group, set())
+            self._pending -= checking
+            _confirm(self._rules, self._text, checking, self._hits)
+            self.groups_checked.append(group)
+        return self.result()
+
+    def result(self) -> ScanResult:
+        """Hits so far; groups not yet required only report their anchor-proven patterns"""
+        return ScanResult(self._rules.families, frozenset(self._hits))
+
+
+class StreamScanner:
+    """
+    Incremental scan over content delivered in chunks. Text is buffered up to
+    ``chunk_size`` characters, then scanned together with the last ``overlap``
+    characters of the previous window so matches that straddle a boundary are still
+    found; anything older is dropped, keeping memory bounded by chunk_size + overlap.
+    A match longer than ``overlap`` that crosses a boundary can be missed.
+    """
+
+    def __init__(self, rules: _CompiledRules, overlap: int, chunk_size: int):
+        self._rules = rules
+        self.overlap = overlap
+        self.chunk_size = chunk_size
+        self._tail = ""
+        self._buffer: List[str] = []
+        self._buffered = 0
+        self._hits: Set[int] = set()
+        self.chars_scanned = 0
+
+    def __getstate__(self):
+        # The compiled rules stay behind: a scanner sent to a worker process is rebound to
+        # that process's default engine, where the detectors register the same families
+        state = dict(self.__dict__)
+        state["_rules"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._rules = default_engine.compile()
+
+    def feed(self, text: str) -> bool:
+        """Add text; returns True if a window was scanned (i.e. the hits may have changed)"""
+        if text:
+            self._buffer.append(text)
+            self._buffered += len(text)
+        if self._buffered < self.chunk_size:
+            return False
+        self._scan_buffer()
+        return True
+
+    def finish(self) -> ScanResult:
+        """Scan whatever is still buffered and return the final hits"""
+        if self._buffered:
+            self._scan_buffer()
+        return self.result()
+
+    def result(self) -> ScanResult:
+        """Hits over everything scanned so far"""
+        return ScanResult(self._rules.families, frozenset(self._hits))
+
+    def _scan_buffer(self) -> None:
+        chunk = "".join(self._buffer).lower()
+        self._buffer.clear()
+        self._buffered = 0
+        window = self._tail + chunk
+        self._hits |= _match(self._rules, window, frozenset(self._hits))
+        self._tail = window[-self.overlap:] if self.overlap else ""
+        self.chars_scanned += len(chunk)
+
+
+# Process-wide engine the detectors register with by default
+default_engine = ScanEngine()
@@ -0,0 +1,606 @@
+"""
+Byte signature engine - content rules for files, scanned straight from memory-mapped files.
+
+Rules use a subset of the YARA language:
+
+    rule OfficeMacroAutoExec
+    {
+        meta:
+            description = "Office document with a macro that runs when it is opened"
+            score = 0.6
+        strings:
+            $vba = "_VBA_PROJECT" wide ascii
+            $auto = "AutoOpen" nocase
+            $ole = { D0 CF 11 E0 A1 B1 1A E1 }
+        condition:
+            $ole at 0 and $vba and $auto
+    }
+
+Text strings take the nocase, ascii and wide modifiers; hex strings take byte values, ``??``
+and nibble wildcards (``4?``), jumps (``[4]``, ``[2-8]``, ``[4-]``) and alternatives
+(``( 4D 5A | 5A 4D )``). Jumps span at most 1 KB: an open jump ``[4-]`` stands for
+``[4-1024]`` and longer jumps are rejected, so verifying a hit never reads far past it. Conditions combine ``$name``, ``$name at <offset>``,
+``any|all|<n> of them``, ``<n> of ($a, $b*)``, ``filetype <name>`` (see file_type.py) and
+``filesize <op> <bytes>`` with and, or, not and parentheses.
+
+Every string contributes a short literal "atom" (a fixed run of bytes at a fixed distance
+from its start). All atoms are compiled into one trie regex - the multi-pattern automaton
+- that the regex engine runs directly over the mmap, so file bytes are never copied into
+Python objects; only atom hits are verified against the full string pattern. Strings are
+reported at their first offset, and once a string is found its atoms leave the automaton.
+"""
+
+import hashlib
+import itertools
+import logging
+import mmap
+import os
+import re
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+BUNDLED_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "signatures.yar")
+
+# nocase atoms are expanded into every upper/lower combination; this caps their letters
+_NOCASE_ATOM_LETTERS = 4
+_MIN_ATOM_BYTES = 2
+_ATOM_BYTES = 8
+# Longest hex jump, and the upper bound of an open one: each atom hit is verified within
+# the string's widest span, so uncapped jumps would make a scan quadratic in the file size
+_MAX_JUMP_BYTES = 1024
+
+
+class SignatureError(ValueError):
+    """A rule file that cannot be compiled; the message points at the rule and position"""
+
+
+@dataclass(frozen=True)
+class SignatureMatch:
+    rule: str
+    string: str  # "$name", or "" for rules that matched on their condition alone
+    offset: int  # first occurrence in the file
+
+
+@dataclass(frozen=True)
+class _Variant:
+    """One byte form of a string (a wide string has a UTF-16LE variant next to its ASCII one)"""
+
+    string: int  # index into SignatureSet.strings
+    regex: "re.Pattern[bytes]"
+    atom: bytes
+    atom_offset: int  # bytes between the start of a match and its atom
+    nocase: bool
+    span: int  # most bytes a match can cover; verification reads no further
+
+    def match(self, buffer, begin: int) -> bool:
+        return self.regex.match(buffer, begin, begin + self.span) is not None
+
+
+@dataclass
+class _String:
+    rule: str
+    name: str  # "$name"
+    variants: List[_Variant]
+
+
+@dataclass
+class SignatureRule:
+    name: str
+    meta: Dict[str, object]
+    strings: Dict[str, int]  # "$name" -> index into SignatureSet.strings
+    condition: tuple  # parsed condition tree
+
+    @property
+    def score(self) -> float:
+        return float(self.meta.get("score", 0.5))
+
+    @property
+    def description(self) -> str:
+        return str(self.meta.get("description", self.name))
+
+
+# --- hex strings -----------------------------------------------------------------------
+
+_HEX_TOKEN = re.compile(rb"\?\?|[0-9A-Fa-f?]{2}|\[\s*(\d*)\s*(-?)\s*(\d*)\s*\]|[(|)]|\s+")
+
+
+class _HexElement:
+    """
+    Piece of a hex string: its regex, width (None if variable), literal byte, if any, and
+    the most bytes it can cover
+    """
+
+    __slots__ = ("regex", "width", "literal", "span")
+
+    def __init__(self, regex: bytes, width: Optional[int], literal: Optional[int] = None,
+                 span: Optional[int] = None):
+        self.regex = regex
+        self.width = width
+        self.literal = literal
+        self.span = width if span is None else span
+
+
+def _parse_hex(source: bytes) -> List[_HexElement]:
+    stack: List[List[List[_HexElement]]] = [[[]]]  # groups -> alternatives -> elements
+    for token in _HEX_TOKEN.finditer(source):
+        text = token.group(0)
+        if text.isspace():
+            continue
+        alternatives = stack[-1]
+        if text == b"(":
+            stack.append([[]])
+        elif text == b"|":
+            if len(stack) == 1:
+                raise SignatureError("'|' outside of a hex alternative group")
+            alternatives.append([])
+        elif text == b")":
+            if len(stack) == 1:
+                raise SignatureError("unbalanced ')' in hex string")
+            stack.pop()
+            widths = {_width(branch) for branch in alternatives}
+            regex = b"(?:" + b"|".join(b"".join(e.regex for e in branch) for branch in alternatives) + b")"
+            stack[-1][-1].append(_HexElement(regex, widths.pop() if len(widths) == 1 else None,
+                                             span=max(_span(branch) for branch in alternatives)))
+        elif text.startswith(b"["):
+            low = int(token.group(1) or 0)
+            high = low if not token.group(2) else int(token.group(3)) if token.group(3) else max(low, _MAX_JUMP_BYTES)
+            if high > _MAX_JUMP_BYTES:
+                raise SignatureError(f"jump {text.decode('ascii')} is longer than {_MAX_JUMP_BYTES} bytes")
+            if low > high:
+                raise SignatureError(f"jump {text.decode('ascii')} has its bounds reversed")
+            if low == high:
+                alternatives[-1].append(_HexElement(b".{%d}" % low, low))
+            else:
+                alternatives[-1].append(_HexElement(b".{%d,%d}" % (low, high), None, span=high))
+        elif text == b"??":
+            alternatives[-1].append(_HexElement(b".", 1))
+        elif b"?" in text:
+            digit = text.replace(b"?", b"")
+            values = [int(digit + bytes([n]), 16) if text.endswith(b"?") else int(bytes([n]) + digit, 16)
+                      for n in b"0123456789abcdef"]
+            alternatives[-1].append(_HexElement(b"[" + b"".join(re.escape(bytes([v])) for v in values) + b"]", 1))
+        else:
+            value = int(text, 16)
+            alternatives[-1].append(_HexElement(re.escape(bytes([value])), 1, value))
+    covered = sum(len(token.group(0)) for token in _HEX_TOKEN.finditer(source))
+    if covered != len(source):
+        raise SignatureError(f"invalid hex string {{{source.decode('latin-1')}}}")
+    if len(stack) != 1:
+        raise SignatureError("unbalanced '(' in hex string")
+    return stack[0][0]
+
+
+def _width(elements: List[_HexElement]) -> Optional[int]:
+    total = 0
+    for element in elements:
+        if element.width is None:
+            return None
+        total += element.width
+    return total
+
+
+def _span(elements: List[_HexElement]) -> int:
+    return sum(element.span for element in elements)
+
+
+def _hex_atom(elements: List[_HexElement]) -> Tuple[bytes, int]:
+    """Longest run of literal bytes before the first variable-width element, and its offset"""
+    best, best_offset = b"", 0
+    run, run_offset, offset = bytearray(), 0, 0
+    for element in elements:
+        if element.literal is not None:
+            if not run:
+                run_offset = offset
+            run.append(element.literal)
+            if len(run) > len(best):
+                best, best_offset = bytes(run), run_offset
+        else:
+            run = bytearray()
+        if element.width is None:
+            break
+        offset += element.width
+    return best, best_offset
+
+
+def _letters(data: bytes) -> int:
+    return sum(1 for byte in data if bytes([byte]).isalpha())
+
+
+def _byte_cost(byte: int, nocase: bool) -> int:
+    """How often a byte starts a failed atom attempt: NULs and text letters are everywhere"""
+    char = bytes([byte])
+    if byte in (0x00, 0xFF):
+        return 8
+    if char.isspace():
+        return 6
+    if char.isalpha():
+        return (4 if char.islower() else 2) + (2 if nocase else 0)
+    return 2 if char.isdigit() else 1
+
+
+def _text_atom(text: bytes, nocase: bool) -> Tuple[bytes, int]:
+    """
+    Window of up to _ATOM_BYTES of the text whose leading bytes are rarest in ordinary
+    files (the automaton is only entered at those bytes), preferring longer windows;
+    nocase windows also need few enough letters to be folded into case variants.
+    """
+    if len(text) < _MIN_ATOM_BYTES:
+        return text, 0
+    candidates = []
+    for size in range(_MIN_ATOM_BYTES, min(len(text), _ATOM_BYTES) + 1):
+        for start in range(len(text) - size + 1):
+            window = text[start:start + size]
+            if nocase and _letters(window) > _NOCASE_ATOM_LETTERS:
+                continue
+            key = (_byte_cost(window[0], nocase), _byte_cost(window[1], nocase), -size, start)
+            candidates.append((key, window, start))
+    if not candidates:
+        return text[:_MIN_ATOM_BYTES], 0
+    _, atom, start = min(candidates)
+    return atom, start
+
+
+def _case_variants(atom: bytes) -> List[bytes]:
+    choices = [(bytes([c]).lower(), bytes([c]).upper()) if bytes([c]).isalpha() else (bytes([c]),) for c in atom]
+    return sorted({b"".join(combo) for combo in itertools.product(*choices)})
+
+
+def _trie_regex(atoms: Iterable[bytes]) -> "re.Pattern[bytes]":
+    """Prefix-factored alternation of literal byte strings (longest alternatives first)"""
+    trie: Dict[int, dict] = {}
+    for atom in atoms:
+        node = trie
+        for byte in atom:
+            node = node.setdefault(byte, {})
+        node[-1] = {}
+
+    def build(node: dict) -> bytes:
+        branches = [re.escape(bytes([byte])) + build(child) for byte, child in sorted(node.items()) if byte >= 0]
+        if not branches:
+            return b""
+        if len(branches) == 1 and -1 not in node:
+            return branches[0]
+        group = b"(?:" + b"|".join(branches) + b")"
+        return group + b"?" if -1 in node else group
+
+    return re.compile(build(trie), re.DOTALL)
+
+
+# --- rule file parser -------------------------------------------------------------------
+
+_CONDITION_TOKEN = re.compile(r"\s*(\$\w*\*?|\d+(?:KB|MB)?|==|!=|<=|>=|[<>(),]|\w+)")
+
+
+class _Parser:
+    def __init__(self, text: str):
+        self.text = text
+        self.pos = 0
+
+    def error(self, message: str) -> SignatureError:
+        line = self.text.count("\n", 0, self.pos) + 1
+        return SignatureError(f"line {line}: {message}")
+
+    def skip(self) -> None:
+        while True:
+            match = re.compile(r"\s+|//[^\n]*|/\*.*?\*/", re.DOTALL).match(self.text, self.pos)
+            if not match or not match.group(0):
+                return
+            self.pos = match.end()
+
+    def take(self, pattern: str, what: str) -> "re.Match":
+        self.skip()
+        match = re.compile(pattern, re.DOTALL).match(self.text, self.pos)
+        if not match:
+            raise self.error(f"expected {what}")
+        self.pos = match.end()
+        return match
+
+    def peek(self, pattern: str) -> bool:
+        self.skip()
+        return re.compile(pattern).match(self.text, self.pos) is not None
+
+    def at_end(self) -> bool:
+        self.skip()
+        return self.pos >= len(self.text)
+
+
+def _unescape(literal: str) -> bytes:
+    """Body of a "..." string with \\" \\\\ \\n \\t \\r and \\xHH escapes"""
+    out = bytearray()
+    i = 0
+    while i < len(literal):
+        char = literal[i]
+        if char == "\\" and i + 1 < len(literal):
+            escape = literal[i + 1]
+            if escape == "x":
+                out.append(int(literal[i + 2:i + 4], 16))
+                i += 4
+                continue
+            out += {"n": b"\n", "t": b"\t", "r": b"\r"}.get(escape, escape.encode("utf-8"))
+            i += 2
+            continue
+        out += char.encode("utf-8")
+        i += 1
+    return bytes(out)
+
+
+def _parse_condition(tokens: List[str], rule: SignatureRule) -> tuple:
+    position = 0
+
+    def peek() -> Optional[str]:
+        return tokens[position] if position < len(tokens) else None
+
+    def take(expected: Optional[str] = None) -> str:
+        nonlocal position
+        token = peek()
+        if token is None or (expected is not None and token != expected):
+            raise SignatureError(f"rule {rule.name}: expected {expected or 'more condition'}, got {token!r}")
+        position += 1
+        return token
+
+    def number(token: str) -> int:
+        units = {"KB": 1024, "MB": 1024 * 1024}
+        for suffix, factor in units.items():
+            if token.endswith(suffix):
+                return int(token[:-len(suffix)]) * factor
+        if not token.isdigit():
+            raise SignatureError(f"rule {rule.name}: expected a number, got {token!r}")
+        return int(token)
+
+    def string_set() -> List[int]:
+        if peek() == "them":
+            take()
+            return list(rule.strings.values())
+        take("(")
+        chosen: List[int] = []
+        while True:
+            name = take()
+            names = [n for n in rule.strings if n.startswith(name[:-1])] if name.endswith("*") else [name]
+            for n in names:
+                if n not in rule.strings:
+                    raise SignatureError(f"rule {rule.name}: undefined string {n}")
+                chosen.append(rule.strings[n])
+            if peek() != ",":
+                break
+            take(",")
+        take(")")
+        return chosen
+
+    def primary() -> tuple:
+        token = take()
+        if token == "(":
+            node = expression()
+            take(")")
+            return node
+        if token == "not":
+            return ("not", primary())
+        if token in ("true", "false"):
+            return ("const", token == "true")
+        if token.startswith("$"):
+            if token not in rule.strings:
+                raise SignatureError(f"rule {rule.name}: undefined string {token}")
+            if peek() == "at":
+                take()
+                return ("at", rule.strings[token], number(take()))
+            return ("found", rule.strings[token])
+        if token in ("any", "all") or token.isdigit():
+            take("of")
+            return ("of", token, string_set())
+        if token == "filetype":
+            return ("filetype", take())
+        if token == "filesize":
+            operator = take()
+            if operator not in ("==", "!=", "<", "<=", ">", ">="):
+                raise SignatureError(f"rule {rule.name}: bad filesize comparison {operator!r}")
+            return ("filesize", operator, number(take()))
+        raise SignatureError(f"rule {rule.name}: unexpected {token!r} in condition")
+
+    def conjunction() -> tuple:
+        node = primary()
+        while peek() == "and":
+            take()
+            node = ("and", node, primary())
+        return node
+
+    def expression() -> tuple:
+        node = conjunction()
+        while peek() == "or":
+            take()
+            node = ("or", node, conjunction())
+        return node
+
+    tree = expression()
+    if peek() is not None:
+        raise SignatureError(f"rule {rule.name}: unexpected {peek()!r} in condition")
+    return tree
+
+
+_COMPARE: Dict[str, Callable[[int, int], bool]] = {
+    "==": lambda a, b: a == b, "!=": lambda a, b: a != b, "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b, ">": lambda a, b: a > b, ">=": lambda a, b: a >= b,
+}
+
+
+class SignatureSet:
+    """Compiled rule file: the strings of every rule behind one atom automaton"""
+
+    def __init__(self, source: str = ""):
+        self.rules: List[SignatureRule] = []
+        self.strings: List[_String] = []
+        self._variants: List[_Variant] = []
+        self.fingerprint = hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+        self._parse(source)
+        # atom -> variants that contain it; atom -> atoms that are prefixes of it (itself too)
+        self._by_atom: Dict[bytes, List[_Variant]] = {}
+        for variant in self._variants:
+            atoms = _case_variants(variant.atom) if variant.nocase else [variant.atom]
+            for atom in atoms:
+                self._by_atom.setdefault(atom, []).append(variant)
+        self._prefixes = {
+            atom: [atom[:end] for end in range(1, len(atom) + 1) if atom[:end] in self._by_atom]
+            for atom in self._by_atom
+        }
+        # Automata for the sets of strings still pending; files tend to find strings in
+        # the same order, so few distinct sets recur
+        self._automata = LRUCache(max_entries=256)
+
+    @classmethod
+    def load(cls, path: str = BUNDLED_RULES_PATH) -> "SignatureSet":
+        with open(path, "r", encoding="utf-8") as handle:
+            signatures = cls(handle.read())
+        logger.info(f"Loaded {len(signatures.rules)} signature rules ({len(signatures.strings)} strings) from {path}")
+        return signatures
+
+    def _parse(self, source: str) -> None:
+        parser = _Parser(source)
+        while not parser.at_end():
+            parser.take(r"rule\b", "'rule'")
+            name = parser.take(r"[A-Za-z_]\w*", "rule name").group(0)
+            parser.take(r"\{", "'{'")
+            rule = SignatureRule(name, {}, {}, ("const", False))
+            if parser.peek(r"meta\s*:"):
+                parser.take(r"meta\s*:", "'meta:'")
+                while not parser.peek(r"strings\s*:|condition\s*:"):
+                    key = parser.take(r"\w+", "meta key").group(0)
+                    parser.take(r"=", "'='")
+                    value = parser.take(r'"((?:\\.|[^"\\])*)"|-?\d+(?:\.\d+)?|true|false', "meta value")
+                    raw = value.group(0)
+                    rule.meta[key] = (value.group(1) if raw.startswith('"') else
+                                      raw == "true" if raw in ("true", "false") else float(raw))
+            if parser.peek(r"strings\s*:"):
+                parser.take(r"strings\s*:", "'strings:'")
+                while not parser.peek(r"condition\s*:"):
+                    string_name = parser.take(r"\$\w+", "string name").group(0)
+                    if string_name in rule.strings:
+                        raise parser.error(f"rule {name}: duplicate string {string_name}")
+                    parser.take(r"=", "'='")
+                    try:
+                        self._add_string(rule, string_name, parser)
+                    except SignatureError as e:
+                        raise parser.error(f"rule {name}, {string_name}: {e}")
+            parser.take(r"condition\s*:", "'condition:'")
+            body = parser.take(r"[^}]*", "condition").group(0)
+            parser.take(r"\}", "'}'")
+            tokens = _CONDITION_TOKEN.findall(body)
+            if "".join(tokens) != re.sub(r"\s+", "", body):
+                raise parser.error(f"rule {name}: unreadable condition")
+            rule.condition = _parse_condition(tokens, rule)
+            self.rules.append(rule)
+
+    def _add_string(self, rule: SignatureRule, name: str, parser: _Parser) -> None:
+        index = len(self.strings)
+        variants = []
+        if parser.peek(r"\{"):
+            body = parser.take(r"\{([^}]*)\}", "hex string").group(1)
+            elements = _parse_hex(body.encode("ascii"))
+            atom, offset = _hex_atom(elements)
+            regex = re.compile(b"".join(element.regex for element in elements), re.DOTALL)
+            variants.append(self._variant(index, regex, atom, offset, nocase=False, span=_span(elements)))
+        else:
+            text = _unescape(parser.take(r'"((?:\\.|[^"\\])*)"', "string").group(1))
+            modifiers = set()
+            while parser.peek(r"(nocase|wide|ascii)\b"):
+                modifiers.add(parser.take(r"\w+", "modifier").group(0))
+            nocase = "nocase" in modifiers
+            forms = []
+            if "ascii" in modifiers or "wide" not in modifiers:
+                forms.append(text)
+            if "wide" in modifiers:
+                forms.append(b"".join(bytes([c, 0]) for c in text))
+            for form in forms:
+                atom, offset = _text_atom(form, nocase)
+                regex = re.compile(re.escape(form), re.DOTALL | (re.IGNORECASE if nocase else 0))
+                variants.append(self._variant(index, regex, atom, offset, nocase, span=len(form)))
+        rule.strings[name] = index
+        self.strings.append(_String(rule.name, name, variants))
+        self._variants += variants
+
+    @staticmethod
+    def _variant(index: int, regex, atom: bytes, offset: int, nocase: bool, span: int) -> _Variant:
+        if len(atom) < _MIN_ATOM_BYTES:
+            raise SignatureError(f"needs {_MIN_ATOM_BYTES} fixed bytes before any variable-length jump or alternative")
+        return _Variant(index, regex, atom, offset, nocase, span)
+
+    def _automaton(self, pending: frozenset) -> Optional["re.Pattern[bytes]"]:
+        """Trie regex over the atoms that still lead to an unfound string"""
+        if not pending:
+            return None
+        automaton = self._automata.get(pending)
+        if automaton is None:
+            atoms = [atom for atom, variants in self._by_atom.items()
+                     if any(variant.string in pending for variant in variants)]
+            automaton = _trie_regex(atoms)
+            self._automata.put(pending, automaton, size=0)
+        return automaton
+
+    def find_strings(self, buffer) -> Dict[int, int]:
+        """First offset of every string found in a bytes-like object (bytes, mmap)"""
+        found: Dict[int, int] = {}
+        pending = frozenset(range(len(self.strings)))
+        automaton = self._automaton(pending)
+        position = 0
+        while automaton is not None:
+            hit = automaton.search(buffer, position)
+            if hit is None:
+                break
+            start = hit.start()
+            for atom in self._prefixes[hit.group(0)]:
+                for variant in self._by_atom[atom]:
+                    begin = start - variant.atom_offset
+                    if variant.string in found or begin < 0:
+                        continue
+                    if variant.match(buffer, begin):
+                        found[variant.string] = begin
+            if len(found) != len(self.strings) - len(pending):
+                # Matched strings leave the automaton; the smaller one skips their atoms
+                pending = frozenset(pending - found.keys())
+                automaton = self._automaton(pending)
+            position = start + 1
+        return found
+
+    def scan(self, buffer, file_type: Optional[str] = None) -> List[Tuple[SignatureRule, List[SignatureMatch]]]:
+        """Rules whose condition holds for the buffer, each with the strings it found"""
+        found = self.find_strings(buffer)
+        size = len(buffer)
+
+        def holds(node: tuple) -> bool:
+            kind = node[0]
+            if kind == "found":
+                return node[1] in found
+            if kind == "at":
+                return any(variant.match(buffer, node[2]) for variant in self.strings[node[1]].variants)
+            if kind == "of":
+                count = sum(1 for index in node[2] if index in found)
+                needed = {"any": 1, "all": len(node[2])}.get(node[1]) or int(node[1])
+                return count >= needed
+            if kind == "and":
+                return holds(node[1]) and holds(node[2])
+            if kind == "or":
+                return holds(node[1]) or holds(node[2])
+            if kind == "not":
+                return not holds(node[1])
+            if kind == "filetype":
+                return file_type == node[1]
+            if kind == "filesize":
+                return _COMPARE[node[1]](size, node[2])
+            return node[1]  # const
+
+        matched = []
+        for rule in self.rules:
+            if holds(rule.condition):
+                matches = [SignatureMatch(rule.name, name, found[index])
+                           for name, index in rule.strings.items() if index in found]
+                matched.append((rule, matches or [SignatureMatch(rule.name, "", 0)]))
+        return matched
+
+    def scan_file(self, path: str, file_type: Optional[str] = None) -> List[Tuple[SignatureRule, List[SignatureMatch]]]:
+        """Scan a file through a read-only memory map (the file is never read into memory)"""
+        with open(path, "rb") as handle:
+            if os.fstat(handle.fileno()).st_size == 0:
+                return self.scan(b"", file_type)
+            with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return self.scan(mapped, file_type)
@@ -1,17 +1,23 @@
 """Social engineering detection module - identifies manipulation and social engineering tactics"""
 
-import re
-from typing import List
+from typing import List, Optional
 import logging
 
+from detectors.result import DetectionResult
+from detectors.scan_engine import ScanEngine, ScanResult, default_engine
+
 logger = logging.getLogger(__name__)
 
 
 class SocialEngineeringDetector:
     """Detects social engineering attacks and manipulation tactics"""
 
-    def __init__(self):
+    name = "social_engineering"
+    max_confidence = 1.0  # highest confidence evaluate() can report (used by the planner)
+
+    def __init__(self, engine: Optional[ScanEngine] = None):
         self.confidence = 0.0
+        self.engine = engine or default_engine
         # Social engineering tactics
         self.pressure_tactics = [
             r"(?:act\s+now|urgent|immediately|limited\s+time|expire|deadline)",
@@ -35,58 +41,106 @@ class SocialEngineeringDetector:
             r"(?:claim|receive|get|won?)\s+(?:prize|reward|refund|money|gift)",
             r"(?:exclusive|special)\s+(?:offer|deal|opportunity)",
         ]
+        self.request_words = ["click", "confirm", "verify", "send", "provide"]
+        self.personalization_words = ["dear", "valued", "dear customer", "friend"]
 
-    def detect(self, content: str) -> bool:
+        self.engine.register("social_engineering.pressure", self.pressure_tactics)
+        self.engine.register("social_engineering.authority", self.authority_tactics)
+        self.engine.register("social_engineering.trust", self.trust_building)
+        self.engine.register("social_engineering.fear", self.fear_tactics)
+        self.engine.register("social_engineering.reward", self.reward_tactics)
+        self.engine.register_literals("social_engineering.requests", self.request_words)
+        self.engine.register_literals("social_engineering.personalization", self.personalization_words)
+
+    def evaluate(self, content: str, scan: Optional[ScanResult] = None) -> DetectionResult:
         """
-        Detect social engineering tactics in content
-        Returns True if manipulation detected
+        Score content for social engineering tactics without touching instance state.
+        Pass ``scan`` to reuse hits from a shared scan of the same content.
         """
-        content_lower = content.lower()
-        self.confidence = 0.0
+        if scan is None:
+            scan = self.engine.scan(content)
+        confidence = 0.0
         tactics_found = 0
+        sub_scores = []
 
         # Check for pressure tactics
-        for pattern in self.pressure_tactics:
-            if re.search(pattern, content_lower):
-                tactics_found += 1
-                self.confidence += 0.15
+        pressure = scan.count("social_engineering.pressure")
+        tactics_found += pressure
+        for _ in range(pressure):
+            confidence += 0.15
+        sub_scores.append(("pressure", 0.15 * pressure))
 
         # Check for authority appeals
-        for pattern in self.authority_tactics:
-            if re.search(pattern, content_lower):
-                tactics_found += 1
-                self.confidence += 0.18
+        authority = scan.count("social_engineering.authority")
+        tactics_found += authority
+        for _ in range(authority):
+            confidence += 0.18
+        sub_scores.append(("authority", 0.18 * authority))
 
         # Check for trust building (especially combined with requests)
-        trust_keywords_count = sum(1 for pattern in self.trust_building
-                                  if re.search(pattern, content_lower))
+        trust_keywords_count = scan.count("social_engineering.trust")
+        trust_score = 0.0
         if trust_keywords_count > 0:
-            if any(word in content_lower for word in ["click", "confirm", "verify", "send", "provide"]):
+            if scan.any("social_engineering.requests"):
                 tactics_found += 1
-                self.confidence += 0.2
+                confidence += 0.2
+                trust_score = 0.2
+        sub_scores.append(("trust", trust_score))
 
         # Check for fear/scarcity tactics
-        for pattern in self.fear_tactics:
-            if re.search(pattern, content_lower):
-                tactics_found += 1
-                self.confidence += 0.15
+        fear = scan.count("social_engineering.fear")
+        tactics_found += fear
+        for _ in range(fear):
+            confidence += 0.15
+        sub_scores.append(("fear", 0.15 * fear))
 
         # Check for reward/incentive tactics
-        for pattern in self.reward_tactics:
-            if re.search(pattern, content_lower):
-                tactics_found += 1
-                self.confidence += 0.12
+        reward = scan.count("social_engineering.reward")
+        tactics_found += reward
+        for _ in range(reward):
+            confidence += 0.12
+        sub_scores.append(("reward", 0.12 * reward))
 
         # Multiple tactics combined = higher confidence
         if tactics_found >= 2:
-            self.confidence = min(0.9, self.confidence * 1.2)
+            confidence = min(0.9, confidence * 1.2)
 
         # Check for personalization (attempts to seem genuine)
-        if any(word in content_lower for word in ["dear", "valued", "dear customer", "friend"]):
+        personalization_score = 0.0
+        if scan.any("social_engineering.personalization"):
             if tactics_found >= 1:
-                self.confidence += 0.1
+                confidence += 0.1
+                personalization_score = 0.1
+        sub_scores.append(("personalization", personalization_score))
+
+        return DetectionResult(
+            detector=self.name,
+            detected=confidence > 0.5,
+            confidence=min(1.0, confidence),
+            matched_rules=scan.rule_ids(
+                "social_engineering.pressure", "social_engineering.authority",
+                "social_engineering.trust", "social_engineering.fear", "social_engineering.reward",
+            ),
+            sub_scores=tuple(sub_scores),
+        )
+
+    def lowest_reachable(self, result: DetectionResult) -> float:
+        """
+        Lowest confidence evaluate() can report once more text is added to the content of
+        ``result``: more matches only raise the score (the multiple-tactics cap, 0.9, is
+        above anything a single tactic reaches)
+        """
+        return result.confidence
 
-        return self.confidence > 0.5
+    def detect(self, content: str, scan: Optional[ScanResult] = None) -> bool:
+        """
+        Detect social engineering tactics in content
+        Returns True if manipulation detected. Kept for single-threaded callers: the score
+        is stored on the instance for get_confidence(); concurrent code should use evaluate().
+        """
+        result = self.evaluate(content, scan)
+        self.confidence = result.confidence
+        return result.detected
 
     def get_confidence(self) -> float:
         """Get the confidence score of the last detection"""
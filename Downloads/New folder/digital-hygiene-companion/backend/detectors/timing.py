@@ -0,0 +1,106 @@
+"""
+Stage timing - where the time of one request goes (auth, cache, each detector, the
+explainer, serialization), for the Server-Timing header and the stage histograms.
+
+Code marks a stage with ``with timed("phishing"):``; the time is added to the
+StageTimes of the current context, or dropped when nothing is collecting (benchmarks,
+scripts), which costs one context variable lookup. The request's StageTimes is set by
+the HTTP middleware; detection jobs run on executor workers (other threads or
+processes) under their own StageTimes, which travels back with the job's result and is
+merged into the request's.
+
+With DEBUG_RULE_TIMING=true the scan engine also times every regex it runs, to find
+the individual pattern that costs the most.
+"""
+
+import contextvars
+import functools
+import os
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+# Time every scan engine regex check (for finding expensive patterns; adds per-pattern overhead)
+RULE_TIMING = os.getenv("DEBUG_RULE_TIMING", "false").strip().lower() in ("1", "true", "yes", "on")
+
+
+class StageTimes:
+    """Seconds per stage (summed when a stage repeats, e.g. over batch items) and per rule"""
+
+    __slots__ = ("stages", "rules", "last_end")
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.rules: Dict[str, float] = {}  # only filled with RULE_TIMING
+        self.last_end = 0.0  # perf_counter when the last stage recorded here ended
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        self.last_end = time.perf_counter()
+
+    def add_rule(self, rule: str, seconds: float) -> None:
+        self.rules[rule] = self.rules.get(rule, 0.0) + seconds
+
+    def merge(self, other: "StageTimes") -> None:
+        """Add the stages of a job that ran elsewhere (its last_end is another clock)"""
+        for stage, seconds in other.stages.items():
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        for rule, seconds in other.rules.items():
+            self.rules[rule] = self.rules.get(rule, 0.0) + seconds
+        self.last_end = time.perf_counter()
+
+    def server_timing(self, *extra: Tuple[str, float]) -> str:
+        """Server-Timing header value: stages, then rules (slowest first), durations in ms"""
+        entries = list(self.stages.items()) + list(extra)
+        entries += sorted(self.rules.items(), key=lambda item: -item[1])
+        return ", ".join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in entries)
+
+
+_current: contextvars.ContextVar[Optional[StageTimes]] = contextvars.ContextVar("stage_times", default=None)
+
+
+def current() -> Optional[StageTimes]:
+    return _current.get()
+
+
+def collecting(times: StageTimes) -> contextvars.Token:
+    """Make ``times`` collect the stages of this context; pass the token to ``reset``"""
+    return _current.set(times)
+
+
+def reset(token: contextvars.Token) -> None:
+    _current.reset(token)
+
+
+def rule_times() -> Optional[StageTimes]:
+    """Where the scan engine records per-rule times, None unless RULE_TIMING is on"""
+    return _current.get() if RULE_TIMING else None
+
+
+class timed:
+    """Context manager adding the time spent in its block to ``stage``"""
+
+    __slots__ = ("stage", "times", "started")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.times = _current.get()
+
+    def __enter__(self) -> "timed":
+        if self.times is not None:
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self.times is not None:
+            self.times.add(self.stage, time.perf_counter() - self.started)
+
+
+def timed_stage(stage: str) -> Callable[[Callable], Callable]:
+    """Decorator: every call of the function is timed as ``stage``"""
+    def decorate(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
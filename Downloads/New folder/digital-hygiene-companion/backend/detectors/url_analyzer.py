@@ -1,111 +1,238 @@
 """URL analysis module - identifies suspicious URLs and phishing indicators"""
 
-import re
+from dataclasses import dataclass
 from urllib.parse import urlparse
-from typing import Dict, List
+from typing import Dict, FrozenSet, List, Optional, Tuple
 import logging
+import re
+
+from cache import LRUCache
+from detectors.brand_index import BrandIndex, BrandMatch
+from detectors.public_suffix import HostParts, PublicSuffixList, default_suffix_list, netloc_of
+from detectors.result import DetectionResult
+from detectors.scan_engine import ScanEngine, default_engine
 
 logger = logging.getLogger(__name__)
 
+# A host starting with a dotted quad (1.2.3.4.evil.com) passes for an IP address to the
+# reader, so it is flagged like one
+_DOTTED_QUAD_PREFIX = re.compile(r"\d+\.\d+\.\d+\.\d+")
+
+
+@dataclass(frozen=True)
+class HostFeatures:
+    """Everything URLAnalyzer derives from the host alone; cached per host"""
+
+    parts: HostParts
+    suspicious_tlds: Tuple[str, ...]  # entries of suspicious_tlds matching the host's TLD or public suffix
+    subdomain_count: int  # labels left of the registrable domain
+    uses_ip: bool  # IP literal, or a host starting with a dotted quad
+    keyword_indices: FrozenSet[int]  # suspicious_keywords found in the host
+    trusted: bool  # host is on the keyword allow-list
+    brand: Optional[BrandMatch]  # protected brand the host imitates (homograph or typosquat)
+
 
 class URLAnalyzer:
     """Analyzes URLs for suspicious characteristics and phishing indicators"""
 
-    def __init__(self):
+    name = "url"
+
+    def __init__(self, engine: Optional[ScanEngine] = None, host_cache_size: int = 4096,
+                 suffixes: Optional[PublicSuffixList] = None, brand_index: Optional[BrandIndex] = None):
         self.confidence = 0.0
         self.phishing_confidence = 0.0
+        self.engine = engine or default_engine
+        self.suffixes = suffixes or default_suffix_list
         # Common phishing domains/patterns
         self.suspicious_tlds = [".tk", ".ml", ".ga", ".cf"]
+        # Registrable domains (and their subdomains) allowed to use login/verify keywords
+        self.trusted_domains = ["secure.example", "login.official"]
+        self._suspicious_tld_set = frozenset(self.suspicious_tlds)
+        self._trusted_domain_set = frozenset(self.trusted_domains)
+        # Protected brands and confusable table; the fingerprint keeps cached verdicts
+        # from outliving a brand list change
+        self.brand_index = brand_index or BrandIndex.load(suffixes=self.suffixes)
+        self.brand_list_version = self.brand_index.fingerprint
         self.suspicious_keywords = [
             "secure", "verify", "confirm", "update", "account",
             "login", "authenticate", "validate", "steam", "apple", "amazon", "paypal"
         ]
-
-    def analyze(self, url: str, context: str = "unknown") -> Dict:
+        self.engine.register_literals("url.suspicious_keywords", self.suspicious_keywords)
+        # Keywords that count against hosts outside trusted_domains
+        self.credential_keywords = ["secure", "verify", "confirm", "login", "authenticate"]
+        # rule -> (suspicious, phishing) confidence added when it matches; shared with the
+        # columnar scorer in detectors/url_batch.py
+        self.rule_weights = {
+            "url.missing_protocol": (0.2, 0.0),
+            "url.suspicious_tld": (0.3, 0.0),
+            "url.excessive_subdomains": (0.15, 0.0),
+            "url.ip_address": (0.4, 0.4),
+            "url.long_url": (0.15, 0.0),
+            "url.suspicious_keyword": (0.0, 0.2),
+            "url.homograph": (0.35, 0.3),
+            "url.typosquat": (0.3, 0.2),
+            "url.encoding": (0.3, 0.0),
+            "url.parse_error": (0.2, 0.1),
+        }
+        self.limits = {"subdomains": 2, "url_length": 100}
+        # Traffic concentrates on few hosts: a new URL on a known host only pays for its path
+        self.host_cache = LRUCache(max_entries=host_cache_size)
+
+    def host_features(self, domain: str) -> HostFeatures:
+        """Host-level features of a lowercased netloc, served from the host cache when seen before"""
+        features = self.host_cache.get(domain)
+        if features is None:
+            features = self.compute_host_features(domain)
+            self.host_cache.put(domain, features, size=0)
+        return features
+
+    def compute_host_features(self, domain: str) -> HostFeatures:
+        """Host-level features of a lowercased netloc, bypassing the host cache"""
+        parts = self.suffixes.decompose(domain)
+        return HostFeatures(
+            parts=parts,
+            suspicious_tlds=tuple(dict.fromkeys(
+                suffix for suffix in (f".{parts.tld}", f".{parts.public_suffix}")
+                if parts.registrable_domain and suffix in self._suspicious_tld_set
+            )),
+            subdomain_count=parts.subdomain_depth,
+            uses_ip=parts.is_ip or bool(_DOTTED_QUAD_PREFIX.match(parts.host)),
+            keyword_indices=frozenset(
+                self.engine.scan(domain, group=self.name).matched("url.suspicious_keywords")
+            ),
+            trusted=any(name in self._trusted_domain_set for name in parts.domains()),
+            brand=self.brand_index.match(parts),
+        )
+
+    def evaluate(self, url: str, context: str = "unknown") -> DetectionResult:
         """
-        Analyze URL for suspicious characteristics
-        Returns dict with is_suspicious, confidence, and phishing_indicators
+        Analyze URL for suspicious characteristics without touching instance state.
+        Sub-scores hold the "suspicious" and "phishing" confidences; details hold the
+        parsed domain and analysis_details.
         """
         try:
             parsed = urlparse(url)
             domain = parsed.netloc.lower()
             path = parsed.path.lower()
-            
-            self.confidence = 0.0
-            self.phishing_confidence = 0.0
+            if not parsed.scheme and not domain:
+                # "bit.ly/x": urlparse reads the host as part of the path
+                domain = netloc_of(url).lower()
+                path = path[len(domain):]
+            host = self.host_features(domain)
+
+            confidence = 0.0
+            phishing_confidence = 0.0
             phishing_indicators = []
+            matched_rules = []
+
+            def add(rule: str, indicator: str) -> None:
+                nonlocal confidence, phishing_confidence
+                suspicious, phishing = self.rule_weights[rule]
+                confidence += suspicious
+                phishing_confidence += phishing
+                phishing_indicators.append(indicator)
+                matched_rules.append(rule)
 
             # Check for missing protocol
             if not parsed.scheme:
-                self.confidence += 0.2
-                phishing_indicators.append("Missing protocol")
+                add("url.missing_protocol", "Missing protocol")
 
             # Check for suspicious TLD
-            for tld in self.suspicious_tlds:
-                if domain.endswith(tld):
-                    self.confidence += 0.3
-                    phishing_indicators.append(f"Suspicious TLD: {tld}")
+            for tld in host.suspicious_tlds:
+                add("url.suspicious_tld", f"Suspicious TLD: {tld}")
 
-            # Check for too many subdomains (common in phishing)
-            subdomain_count = domain.count(".")
-            if subdomain_count > 3:
-                self.confidence += 0.15
-                phishing_indicators.append("Excessive subdomains")
+            # Check for too many subdomains (common in phishing); counted left of the
+            # registrable domain, so a.b.co.uk has one
+            subdomain_count = host.subdomain_count
+            if subdomain_count > self.limits["subdomains"]:
+                add("url.excessive_subdomains", "Excessive subdomains")
 
             # Check for IP address instead of domain
-            if re.match(r"^\d+\.\d+\.\d+\.\d+", domain):
-                self.confidence += 0.4
-                self.phishing_confidence += 0.4
-                phishing_indicators.append("Direct IP address used")
+            uses_ip = host.uses_ip
+            if uses_ip:
+                add("url.ip_address", "Direct IP address used")
 
             # Check URL length (phishing URLs often very long)
-            if len(url) > 100:
-                self.confidence += 0.15
-                phishing_indicators.append("Unusually long URL")
+            if len(url) > self.limits["url_length"]:
+                add("url.long_url", "Unusually long URL")
 
             # Check for suspicious keywords combined with domain mismatch
-            keyword_found = False
-            for keyword in self.suspicious_keywords:
-                if keyword in path or keyword in domain:
-                    keyword_found = True
-                    if keyword in ["secure", "verify", "confirm", "login", "authenticate"]:
-                        if not any(bank in domain for bank in ["secure.example", "login.official"]):
-                            self.phishing_confidence += 0.2
-                            phishing_indicators.append(f"Suspicious keyword: {keyword}")
-
-            # Check for homograph attacks (similar looking domains)
-            if re.search(r"(0=o|l=1|rn=m)", domain):
-                self.confidence += 0.35
-                phishing_indicators.append("Potential homograph attack")
+            # (host keywords are cached; only the path is scanned per URL)
+            path_keywords = self.engine.scan(path, group=self.name).matched("url.suspicious_keywords")
+            for index in sorted(host.keyword_indices.union(path_keywords)):
+                keyword = self.suspicious_keywords[index]
+                if keyword in self.credential_keywords:
+                    if not host.trusted:
+                        add("url.suspicious_keyword", f"Suspicious keyword: {keyword}")
+
+            # Check for homograph attacks and typosquats of protected brands
+            brand = host.brand
+            if brand is not None and brand.technique == "homograph":
+                add("url.homograph", f"Potential homograph attack (imitates {brand.brand})")
+            elif brand is not None:
+                add("url.typosquat", f"Possible typosquat of {brand.brand}")
 
             # Check for encoding/obfuscation
             if "%2e" in url or "%3a" in url:
-                self.confidence += 0.3
-                phishing_indicators.append("URL encoding detected")
-
-            return {
-                "is_suspicious": self.confidence > 0.3,
-                "confidence": min(1.0, self.confidence),
-                "phishing_indicators": phishing_indicators,
-                "phishing_confidence": min(1.0, self.phishing_confidence),
-                "domain": domain,
-                "analysis_details": {
-                    "has_protocol": bool(parsed.scheme),
-                    "subdomain_count": subdomain_count,
-                    "url_length": len(url),
-                    "uses_ip": bool(re.match(r"^\d+\.\d+\.\d+\.\d+", domain))
-                }
-            }
+                add("url.encoding", "URL encoding detected")
+
+            return DetectionResult(
+                detector=self.name,
+                detected=confidence > 0.3,
+                confidence=min(1.0, confidence),
+                matched_rules=tuple(dict.fromkeys(matched_rules)),
+                sub_scores=(
+                    ("suspicious", min(1.0, confidence)),
+                    ("phishing", min(1.0, phishing_confidence)),
+                ),
+                indicators=tuple(phishing_indicators),
+                details=(
+                    ("domain", domain),
+                    ("analysis_details", {
+                        "has_protocol": bool(parsed.scheme),
+                        "subdomain_count": subdomain_count,
+                        "registrable_domain": host.parts.registrable_domain,
+                        "public_suffix": host.parts.public_suffix,
+                        "imitated_brand": host.brand.brand if host.brand else None,
+                        "url_length": len(url),
+                        "uses_ip": uses_ip
+                    }),
+                ),
+            )
         except Exception as e:
             logger.error(f"Error analyzing URL: {str(e)}")
-            return {
-                "is_suspicious": True,
-                "confidence": 0.2,
-                "phishing_indicators": ["Error parsing URL"],
-                "phishing_confidence": 0.1,
-                "domain": "",
-                "analysis_details": {}
-            }
+            suspicious, phishing = self.rule_weights["url.parse_error"]
+            return DetectionResult(
+                detector=self.name,
+                detected=True,
+                confidence=suspicious,
+                matched_rules=("url.parse_error",),
+                sub_scores=(("suspicious", suspicious), ("phishing", phishing)),
+                indicators=("Error parsing URL",),
+                details=(("domain", ""), ("analysis_details", {})),
+            )
+
+    def analyze(self, url: str, context: str = "unknown") -> Dict:
+        """
+        Analyze URL for suspicious characteristics
+        Returns dict with is_suspicious, confidence, and phishing_indicators
+        """
+        result = self.evaluate(url, context)
+        self.confidence = result.confidence
+        self.phishing_confidence = result.score("phishing")
+        return self.to_dict(result)
+
+    @staticmethod
+    def to_dict(result: DetectionResult) -> Dict:
+        """Convert an evaluate() result into the analyze() response shape"""
+        return {
+            "is_suspicious": result.detected,
+            "confidence": result.confidence,
+            "phishing_indicators": list(result.indicators),
+            "phishing_confidence": result.score("phishing"),
+            "domain": result.detail("domain", ""),
+            "analysis_details": dict(result.detail("analysis_details", {}))
+        }
 
     def get_confidence(self) -> float:
         """Get confidence score of last analysis"""
@@ -0,0 +1,281 @@
+"""
+Columnar URL scoring for offline rescoring of link logs.
+
+``URLAnalyzer.evaluate`` builds indicator strings and a DetectionResult per URL. For
+millions of URLs only the two scores matter, so this module parses each URL once,
+computes the host-level features once per distinct host, and keeps every feature
+behind ``analysis_details`` in a NumPy column. The analyzer's ``rule_weights`` are then
+applied to whole columns, in the same order as ``evaluate`` adds them, so both paths
+give bit-identical ``confidence`` and ``phishing_confidence`` values.
+
+    python -m detectors.url_batch urls.txt -o scores.tsv   # one URL per line, spot-checked
+    python -m detectors.url_batch urls.txt --check          # compare against evaluate()
+"""
+
+import argparse
+import logging
+import sys
+from dataclasses import dataclass, fields
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+from urllib.parse import urlparse
+
+import numpy as np
+
+from detectors.public_suffix import netloc_of
+from detectors.url_analyzer import URLAnalyzer
+
+logger = logging.getLogger(__name__)
+
+# brand_class values
+NO_BRAND, HOMOGRAPH, TYPOSQUAT = 0, 1, 2
+
+
+@dataclass
+class URLFeatures:
+    """One row per URL; every field is a NumPy array of the batch length"""
+
+    url_length: np.ndarray  # int64
+    has_protocol: np.ndarray  # bool
+    encoded: np.ndarray  # bool, "%2e" or "%3a" in the URL
+    parse_error: np.ndarray  # bool, the URL could not be parsed
+    host_id: np.ndarray  # int64, rows with the same value share a host
+    subdomain_count: np.ndarray  # int64
+    uses_ip: np.ndarray  # bool
+    tld_class: np.ndarray  # int8, 1 + index into suspicious_tlds, 0 for none
+    suspicious_tld_count: np.ndarray  # int8
+    trusted: np.ndarray  # bool
+    brand_class: np.ndarray  # int8, NO_BRAND / HOMOGRAPH / TYPOSQUAT
+    keyword_mask: np.ndarray  # uint32, bit i set when suspicious_keywords[i] is in the host or path
+
+
+@dataclass
+class URLScores:
+    confidence: np.ndarray  # float64, the "suspicious" score of evaluate()
+    phishing_confidence: np.ndarray  # float64
+    detected: np.ndarray  # bool
+
+
+class URLBatchScorer:
+    """Feature extraction and scoring of many URLs at once with the rules of one URLAnalyzer"""
+
+    def __init__(self, analyzer: URLAnalyzer):
+        self.analyzer = analyzer
+        if len(analyzer.suspicious_keywords) > 32:
+            raise ValueError("keyword_mask holds at most 32 suspicious keywords")
+        self.credential_mask = np.uint32(sum(
+            1 << index for index, keyword in enumerate(analyzer.suspicious_keywords)
+            if keyword in analyzer.credential_keywords
+        ))
+
+    def features(self, urls: Sequence[str]) -> URLFeatures:
+        """
+        Feature rows of a batch. Link logs repeat the same URLs many times, so each distinct
+        URL is parsed once and each distinct host is analysed once; rows are gathered back
+        by index.
+        """
+        distinct: Dict[str, int] = {}
+        rows = np.fromiter((distinct.setdefault(url, len(distinct)) for url in urls), dtype=np.int64, count=len(urls))
+        if len(distinct) == len(urls):
+            return self._distinct_features(urls)
+        columns = self._distinct_features(list(distinct))
+        return URLFeatures(**{field.name: getattr(columns, field.name)[rows] for field in fields(URLFeatures)})
+
+    def _distinct_features(self, urls: Sequence[str]) -> URLFeatures:
+        analyzer = self.analyzer
+        count = len(urls)
+        has_protocol = np.zeros(count, dtype=bool)
+        parse_error = np.zeros(count, dtype=bool)
+        host_id = np.zeros(count, dtype=np.int64)
+        paths: List[str] = []
+        host_ids: Dict[str, int] = {}
+        for i, url in enumerate(urls):
+            try:
+                parsed = urlparse(url)
+            except ValueError:
+                # Scored as url.parse_error; the row still needs a host to index
+                parse_error[i] = True
+                host_id[i] = host_ids.setdefault("", len(host_ids))
+                paths.append("")
+                continue
+            domain = parsed.netloc.lower()
+            path = parsed.path.lower()
+            if not parsed.scheme and not domain:
+                domain = netloc_of(url).lower()
+                path = path[len(domain):]
+            has_protocol[i] = bool(parsed.scheme)
+            host_id[i] = host_ids.setdefault(domain, len(host_ids))
+            paths.append(path)
+
+        # Host columns, one entry per distinct host, gathered to URL rows by host_id
+        hosts = len(host_ids)
+        host_error = np.zeros(hosts, dtype=bool)
+        host_subdomains = np.zeros(hosts, dtype=np.int64)
+        host_ip = np.zeros(hosts, dtype=bool)
+        host_tld_class = np.zeros(hosts, dtype=np.int8)
+        host_tld_count = np.zeros(hosts, dtype=np.int8)
+        host_trusted = np.zeros(hosts, dtype=bool)
+        host_brand = np.zeros(hosts, dtype=np.int8)
+        host_keywords = np.zeros(hosts, dtype=np.uint32)
+        for domain, index in host_ids.items():
+            try:
+                host = analyzer.compute_host_features(domain)
+            except Exception as e:
+                logger.error(f"Error analyzing host {domain!r}: {str(e)}")
+                host_error[index] = True
+                continue
+            host_subdomains[index] = host.subdomain_count
+            host_ip[index] = host.uses_ip
+            if host.suspicious_tlds:
+                host_tld_class[index] = analyzer.suspicious_tlds.index(host.suspicious_tlds[0]) + 1
+            host_tld_count[index] = len(host.suspicious_tlds)
+            host_trusted[index] = host.trusted
+            if host.brand is not None:
+                host_brand[index] = HOMOGRAPH if host.brand.technique == "homograph" else TYPOSQUAT
+            host_keywords[index] = sum(1 << keyword for keyword in host.keyword_indices)
+
+        # String columns: variable-width NumPy strings, one vectorized search per literal
+        url_column = np.array(urls, dtype=np.dtypes.StringDType())
+        path_column = np.array(paths, dtype=np.dtypes.StringDType())
+        encoded = (np.strings.find(url_column, "%2e") >= 0) | (np.strings.find(url_column, "%3a") >= 0)
+        keyword_mask = host_keywords[host_id]
+        for index, keyword in enumerate(analyzer.suspicious_keywords):
+            keyword_mask |= np.where(np.strings.find(path_column, keyword) >= 0, np.uint32(1 << index), np.uint32(0))
+
+        parse_error |= host_error[host_id]
+        return URLFeatures(
+            # len() rather than np.strings.str_len, which ignores trailing NUL characters
+            url_length=np.fromiter(map(len, urls), dtype=np.int64, count=count),
+            has_protocol=has_protocol,
+            encoded=encoded,
+            parse_error=parse_error,
+            host_id=host_id,
+            subdomain_count=host_subdomains[host_id],
+            uses_ip=host_ip[host_id],
+            tld_class=host_tld_class[host_id],
+            suspicious_tld_count=host_tld_count[host_id],
+            trusted=host_trusted[host_id],
+            brand_class=host_brand[host_id],
+            keyword_mask=keyword_mask,
+        )
+
+    def score(self, features: URLFeatures) -> URLScores:
+        """
+        Apply the rule weights column by column. Rules are added in evaluate()'s order and
+        a rule that fires k times is added k times, so the float sums round identically;
+        rows where a rule does not fire add 0.0, which leaves the sum unchanged.
+        """
+        weights = self.analyzer.rule_weights
+        limits = self.analyzer.limits
+        count = len(features.url_length)
+        confidence = np.zeros(count)
+        phishing = np.zeros(count)
+
+        def add(rule: str, times: np.ndarray) -> None:
+            suspicious_weight, phishing_weight = weights[rule]
+            for k in range(int(times.max(initial=0))):
+                fired = times > k
+                confidence[:] += np.where(fired, suspicious_weight, 0.0)
+                phishing[:] += np.where(fired, phishing_weight, 0.0)
+
+        credential_hits = np.bitwise_count(features.keyword_mask & self.credential_mask)
+        add("url.missing_protocol", ~features.has_protocol)
+        add("url.suspicious_tld", features.suspicious_tld_count)
+        add("url.excessive_subdomains", features.subdomain_count > limits["subdomains"])
+        add("url.ip_address", features.uses_ip)
+        add("url.long_url", features.url_length > limits["url_length"])
+        add("url.suspicious_keyword", np.where(features.trusted, 0, credential_hits))
+        add("url.homograph", features.brand_class == HOMOGRAPH)
+        add("url.typosquat", features.brand_class == TYPOSQUAT)
+        add("url.encoding", features.encoded)
+
+        detected = confidence > 0.3
+        error_suspicious, error_phishing = weights["url.parse_error"]
+        confidence[features.parse_error] = error_suspicious
+        phishing[features.parse_error] = error_phishing
+        detected[features.parse_error] = True
+        return URLScores(np.minimum(1.0, confidence), np.minimum(1.0, phishing), detected)
+
+    def score_urls(self, urls: Sequence[str]) -> URLScores:
+        return self.score(self.features(urls))
+
+    def check_parity(self, urls: Sequence[str]) -> List[int]:
+        """Indices of URLs whose batch scores differ from URLAnalyzer.evaluate (empty when exact)"""
+        return self.mismatches(urls, self.score_urls(urls), range(len(urls)))
+
+    def mismatches(self, urls: Sequence[str], scores: URLScores, indices: Iterable[int]) -> List[int]:
+        """Those of ``indices`` whose ``scores`` (from score_urls) differ from URLAnalyzer.evaluate"""
+        mismatches = []
+        for i in indices:
+            result = self.analyzer.evaluate(urls[i])
+            if (result.confidence != scores.confidence[i] or result.score("phishing") != scores.phishing_confidence[i]
+                    or result.detected != scores.detected[i]):
+                mismatches.append(i)
+        return mismatches
+
+
+def _chunks(lines: Iterator[str], size: int) -> Iterator[List[str]]:
+    chunk: List[str] = []
+    for line in lines:
+        url = line.rstrip("\r\n")
+        if url:
+            chunk.append(url)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m detectors.url_batch",
+                                     description="Score a file of URLs (one per line) with the URL analyzer rules")
+    parser.add_argument("input", help="URL file, '-' for stdin")
+    parser.add_argument("-o", "--output", default="-", help="TSV of url, confidence, phishing_confidence, detected")
+    parser.add_argument("--chunk", type=int, default=100000, help="URLs scored per vectorized pass")
+    parser.add_argument("--check", action="store_true",
+                        help="also score every URL with URLAnalyzer.evaluate and report any difference")
+    parser.add_argument("--verify", type=int, default=1000,
+                        help="URLs per chunk re-scored with URLAnalyzer.evaluate before the chunk is written; "
+                             "any difference stops the run with status 1 (0 = no verification)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    scorer = URLBatchScorer(URLAnalyzer(host_cache_size=0))
+    source = sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8", errors="replace")
+    sink = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    total = mismatched = 0
+    try:
+        for chunk in _chunks(source, args.chunk):
+            if args.check:
+                for i in scorer.check_parity(chunk):
+                    logger.error(f"Batch score differs from evaluate() for {chunk[i]!r}")
+                    mismatched += 1
+                total += len(chunk)
+                continue
+            scores = scorer.score_urls(chunk)
+            # Spot-check evenly spaced URLs so a divergence from evaluate() never goes unnoticed
+            step = max(1, len(chunk) // args.verify) if args.verify > 0 else 0
+            differing = scorer.mismatches(chunk, scores, range(0, len(chunk), step)) if step else []
+            if differing:
+                for i in differing[:10]:
+                    logger.error(f"Batch score differs from evaluate() for {chunk[i]!r}")
+                logger.error(f"Stopped after {total} URLs: batch scores no longer match URLAnalyzer.evaluate")
+                return 1
+            for url, confidence, phishing, detected in zip(
+                    chunk, scores.confidence.tolist(), scores.phishing_confidence.tolist(), scores.detected.tolist()):
+                sink.write(f"{url}\t{confidence!r}\t{phishing!r}\t{int(detected)}\n")
+            total += len(chunk)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if sink is not sys.stdout:
+            sink.close()
+    if args.check:
+        logger.info(f"Checked {total} URLs, {mismatched} differ")
+        return 1 if mismatched else 0
+    logger.info(f"Scored {total} URLs")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""Detection executor module - runs CPU-bound scoring off the asyncio event loop"""
+
+import asyncio
+import os
+import threading
+import time
+import logging
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import profiling
+from detectors import timing
+
+logger = logging.getLogger(__name__)
+
+EXECUTOR_MODES = ("inline", "thread", "process")
+
+
+class ExecutorSaturated(Exception):
+    """Raised when the pending-job limit is reached; callers should shed load (HTTP 503)"""
+
+
+def _timed_call(fn: Callable, args: Tuple, profile: bool = False
+                ) -> Tuple[Any, float, float, timing.StageTimes, Optional[Dict[str, float]]]:
+    """
+    Runs inside the worker; reports when the job started, how long it ran, its stage
+    times and, when the request is profiled, its call stacks
+    """
+    started = time.time()
+    times = timing.StageTimes()
+    token = timing.collecting(times)
+    stacks = None
+    t0 = time.perf_counter()
+    try:
+        if profile:
+            result, stacks = profiling.profile_call(fn, args)
+        else:
+            result = fn(*args)
+    finally:
+        timing.reset(token)
+    return result, started, time.perf_counter() - t0, times, stacks
+
+
+class DetectionExecutor:
+    """
+    Execution backend for the detection pipeline.
+
+    Modes:
+    - inline: run on the event loop (previous behaviour, lowest overhead for tiny inputs)
+    - thread: run in a thread pool so the loop keeps serving other requests
+    - process: run in a process pool whose workers import and warm the detectors once
+
+    At most ``max_pending`` jobs may be queued or running; further submissions raise
+    ExecutorSaturated instead of building an unbounded backlog.
+    """
+
+    def __init__(self, mode: str = "thread", max_workers: Optional[int] = None,
+                 max_pending: int = 64, initializer: Optional[Callable[[], None]] = None,
+                 observer: Optional[Callable[[float, float], None]] = None):
+        if mode not in EXECUTOR_MODES:
+            raise ValueError(f"Unknown executor mode '{mode}', expected one of {EXECUTOR_MODES}")
+        self.mode = mode
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.initializer = initializer
+        self.observer = observer  # called with (queue wait, run seconds) of every completed job
+        self._pool: Optional[Executor] = None
+        self._lock = threading.Lock()
+
+        self._pending = 0
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "max_pending_seen": 0,
+            "queue_wait_seconds": 0.0,
+            "run_seconds": 0.0,
+        }
+
+    def start(self) -> None:
+        """Create the pool; for process mode every worker is spawned and warmed up front"""
+        if self.mode == "inline" or self._pool is not None:
+            return
+        if self.mode == "thread":
+            self._pool = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="detector",
+                initializer=self.initializer,
+            )
+        else:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers, initializer=self.initializer)
+            # Workers start lazily; force them all up now so no request pays for the import
+            warm = [self._pool.submit(time.sleep, 0.05) for _ in range(self.max_workers)]
+            for future in warm:
+                future.result()
+        logger.info(f"Detection executor started: mode={self.mode} workers={self.max_workers} "
+                    f"max_pending={self.max_pending}")
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    async def run(self, fn: Callable, *args) -> Any:
+        """Run ``fn(*args)`` on the configured backend and return its result"""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._stats["rejected"] += 1
+                raise ExecutorSaturated(f"{self._pending} detection jobs already pending")
+            self._pending += 1
+            self._stats["submitted"] += 1
+            self._stats["max_pending_seen"] = max(self._stats["max_pending_seen"], self._pending)
+
+        submitted = time.time()
+        try:
+            if self.mode == "inline":
+                # A profiled request's inline job is already traced with the event loop
+                result, started, duration, times, stacks = _timed_call(fn, args)
+            else:
+                if self._pool is None:
+                    self.start()
+                loop = asyncio.get_running_loop()
+                result, started, duration, times, stacks = await loop.run_in_executor(
+                    self._pool, _timed_call, fn, args, profiling.active())
+        except Exception:
+            with self._lock:
+                self._stats["failed"] += 1
+            raise
+        else:
+            with self._lock:
+                self._stats["completed"] += 1
+                self._stats["queue_wait_seconds"] += max(0.0, started - submitted)
+                self._stats["run_seconds"] += duration
+            if self.observer is not None:
+                self.observer(max(0.0, started - submitted), duration)
+            request_times = timing.current()
+            if request_times is not None:
+                # The job's own stages (detectors, explainer) join the request's
+                request_times.add("queue", max(0.0, started - submitted))
+                request_times.add("detection", duration)
+                request_times.merge(times)
+            if stacks:
+                profiling.add_job_stacks(stacks)
+            return result
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    @property
+    def pending(self) -> int:
+        """Jobs currently queued or running"""
+        return self._pending
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of the executor counters"""
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["pending"] = self._pending
+        snapshot.update(mode=self.mode, workers=self.max_workers, max_pending=self.max_pending)
+        return snapshot
+
+
+def create_executor_from_env(initializer: Optional[Callable[[], None]] = None,
+                             observer: Optional[Callable[[float, float], None]] = None) -> DetectionExecutor:
+    """
+    Build the executor from environment variables:
+    DETECTION_EXECUTOR (inline|thread|process, default thread),
+    DETECTION_WORKERS (default: CPU count), DETECTION_MAX_PENDING (default 64).
+    """
+    mode = os.getenv("DETECTION_EXECUTOR", "thread").strip().lower()
+    workers = int(os.getenv("DETECTION_WORKERS", "0")) or None
+    max_pending = int(os.getenv("DETECTION_MAX_PENDING", "64"))
+    return DetectionExecutor(mode=mode, max_workers=workers, max_pending=max_pending, initializer=initializer,
+                             observer=observer)
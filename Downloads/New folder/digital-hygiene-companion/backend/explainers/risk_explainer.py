@@ -40,6 +40,41 @@ class RiskExplainer:
                 "simple": "This link might download dangerous software (malware) to your device.",
                 "why": "Some websites host malicious programs that can damage your files or steal your data.",
                 "danger": "Malware can log your keystrokes, steal passwords, or lock your files for ransom."
+            },
+            "Suspicious attachment": {
+                "simple": "This file's name has warning signs of a dangerous attachment.",
+                "why": "Malware is often sent as programs or archives with names like 'invoice' or 'payment'.",
+                "danger": "Opening it could install malware on your device."
+            },
+            "Disguised attachment": {
+                "simple": "This file is not what its name says - for example a program pretending to be a PDF.",
+                "why": "Scammers rename dangerous programs so they look like harmless documents or photos.",
+                "danger": "Opening it would run the hidden program instead of showing a document."
+            },
+            "Malicious file content": {
+                "simple": "This file contains code that is typical of malware, such as a hidden program or a self-running macro.",
+                "why": "Attackers hide downloaders and macros inside documents and archives that look harmless.",
+                "danger": "Opening it could download and run malware on your device."
+            },
+            "Known malware attachment": {
+                "simple": "This exact file is on a list of known malware.",
+                "why": "Security researchers have already seen this file used in attacks.",
+                "danger": "Opening it will almost certainly infect your device."
+            },
+            "Dangerous phone code": {
+                "simple": "This QR code dials a special phone code that gives your phone a command.",
+                "why": "Codes with * and # can change phone settings, forward your calls or even erase the phone.",
+                "danger": "Dialing it could forward your calls to scammers or wipe your device."
+            },
+            "Premium-rate number": {
+                "simple": "This QR code calls or texts a number that charges extra money.",
+                "why": "Scammers earn a share of what premium numbers and text subscriptions cost you.",
+                "danger": "You could be charged a lot, sometimes every week, without noticing."
+            },
+            "Insecure Wi-Fi network": {
+                "simple": "This QR code connects you to a Wi-Fi network without proper protection.",
+                "why": "Anyone can set up an open or hidden network with a trusted-sounding name.",
+                "danger": "Whoever runs the network can watch your traffic or send you to fake login pages."
             }
         }
 
@@ -145,7 +180,8 @@ class RiskExplainer:
                 "Report the message to your school's IT or email provider."
             ])
 
-        if any('malware' in r.lower() or 'suspicious url' in r.lower() for r in detected_risks):
+        if any('malware' in r.lower() or 'suspicious url' in r.lower() or 'attachment' in r.lower()
+               for r in detected_risks):
             next_steps.extend([
                 "Do not download files from this source.",
                 "Run an updated antivirus scan if you interacted with it.",
@@ -158,6 +194,18 @@ class RiskExplainer:
                 "Do not act under pressure or urgency without confirmation.",
             ])
 
+        if any('phone code' in r.lower() or 'premium-rate' in r.lower() for r in detected_risks):
+            next_steps.extend([
+                "Do not call or text the number from this QR code.",
+                "Check your phone bill and settings if you already did.",
+            ])
+
+        if any('wi-fi' in r.lower() for r in detected_risks):
+            next_steps.extend([
+                "Do not join this network; use mobile data or a network you know.",
+                "Never log in to accounts on a network you cannot verify.",
+            ])
+
         # Fallback general tips
         if not next_steps:
             next_steps = [
@@ -4,21 +4,34 @@ AI-powered detector for phishing, suspicious URLs, social engineering, credentia
 with local-first privacy architecture
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, ValidationError
 from typing import List, Dict, Any, Optional
+import asyncio
+import codecs
 import logging
 import hashlib
+import json
+import os
 from fastapi import Header
 
-from auth import validate_api_key, check_rate_limit
-from detectors.phishing_detector import PhishingDetector
-from detectors.url_analyzer import URLAnalyzer
-from detectors.social_engineering_detector import SocialEngineeringDetector
-from detectors.credential_theft_detector import CredentialTheftDetector
-from detectors.malware_detector import MalwareDetector
-from explainers.risk_explainer import RiskExplainer
+from auth import (
+    RATE_LIMIT_EVICTION_SECONDS, RateLimitHeadersMiddleware, check_rate_limit, evict_idle_keys, rate_limiter,
+    validate_api_key,
+)
+from cache import create_verdict_cache_from_env
+from executor import ExecutorSaturated, create_executor_from_env
+from metrics import STAGE_BUCKETS, MetricFamily, MetricsMiddleware, create_metrics_from_env, record_metric_windows
+import pipeline
+from detectors.file_type import SNIFF_BYTES
+from detectors.public_suffix import netloc_of
+from detectors.timing import timed
+from pipeline import map_confidence_to_score_and_label
+from profiling import ProfilingMiddleware, create_profiler_from_env
+from shared_state import create_shared_state_from_env
+from uploads import UploadError, UploadReceiver
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -37,18 +50,145 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After", "X-RateLimit-Limit", "X-RateLimit-Remaining", "Server-Timing"],
+)
+# Reports the rate limit decision of each request in X-RateLimit-* headers
+app.add_middleware(RateLimitHeadersMiddleware)
+# Profiles requests sent with X-Profile-Key or sampled among slow ones (both off unless configured);
+# inside MetricsMiddleware, so request latency includes the profiling overhead
+app.add_middleware(ProfilingMiddleware, profiler=create_profiler_from_env())
+
+# Metrics of this process, served on /metrics (counts only, never inputs)
+metrics = create_metrics_from_env()
+http_requests = metrics.counter("http_requests_total", "HTTP requests by route, method and status",
+                                ("endpoint", "method", "status"), windowed=True)
+http_latency = metrics.histogram("http_request_duration_seconds", "Time from request to last response byte",
+                                 ("endpoint",), windowed=True)
+verdicts_returned = metrics.counter("verdicts_total", "Verdicts returned by safety label", ("endpoint", "safety_label"),
+                                    windowed=True)
+risks_detected = metrics.counter("detections_total", "Risks the detectors reported in verdicts", ("endpoint", "risk"))
+detection_queue_wait = metrics.histogram("detection_queue_wait_seconds", "Time detection jobs waited for a worker")
+detection_run_time = metrics.histogram("detection_run_seconds", "Time detection jobs ran on a worker")
+detection_queue_depth = metrics.histogram("detection_queue_depth", "Detection jobs already pending when one is submitted",
+                                          buckets=(0, 1, 2, 4, 8, 16, 32, 64, 128, 256))
+# By stage only: an endpoint label would multiply the series (Server-Timing has per-request detail)
+stage_latency = metrics.histogram("stage_duration_seconds", "Time per request spent in each stage (auth, cache, "
+                                  "queue, each detector, explain, serialize)", ("stage",), STAGE_BUCKETS)
+# Only filled with DEBUG_RULE_TIMING=true
+rule_latency = metrics.histogram("rule_duration_seconds", "Time per request spent checking each scan engine regex",
+                                 ("rule",), STAGE_BUCKETS)
+# Stage times of each request in a Server-Timing response header
+SERVER_TIMING = os.getenv("SERVER_TIMING", "true").strip().lower() in ("1", "true", "yes", "on")
+# Outermost, so the time includes the other middleware
+app.add_middleware(MetricsMiddleware, requests=http_requests, latency=http_latency, stages=stage_latency,
+                   rules=rule_latency, server_timing=SERVER_TIMING)
+
+# Detectors live in pipeline.py (all run locally); the executor decides where they run
+detection_executor = create_executor_from_env(
+    initializer=pipeline.warm_up,
+    observer=lambda wait, run: (detection_queue_wait.observe(wait), detection_run_time.observe(run)),
 )
 
-# Initialize detectors (all run locally)
-phishing_detector = PhishingDetector()
-url_analyzer = URLAnalyzer()
-social_engineering_detector = SocialEngineeringDetector()
-credential_theft_detector = CredentialTheftDetector()
-malware_detector = MalwareDetector()
-risk_explainer = RiskExplainer()
+# Verdicts of recently seen inputs, keyed by their SHA-256 (raw inputs are never stored)
+verdict_cache = create_verdict_cache_from_env(pipeline.ruleset_version())
+
+# Largest batch accepted by /api/analyze/text/batch, /api/analyze/url/batch and /api/analyze/qr/batch;
+# a key's batches are also capped at its per-minute rate limit (see check_batch_size)
+MAX_BATCH_ITEMS = int(os.getenv("MAX_BATCH_ITEMS", "500"))
+
+# Unique URLs per executor job in /api/analyze/url/batch: smaller jobs stream the first
+# verdicts sooner, larger ones spend less time on dispatch
+URL_BATCH_CHUNK = int(os.getenv("URL_BATCH_CHUNK", "32"))
+
+# Most characters a QR code can hold (version 40, numeric mode); longer qr_data is rejected
+MAX_QR_DATA_CHARS = 7089
+
+# Streaming text analysis: characters scanned per window and carried over between windows
+STREAM_CHUNK_CHARS = int(os.getenv("STREAM_CHUNK_CHARS", str(64 * 1024)))
+STREAM_OVERLAP_CHARS = int(os.getenv("STREAM_OVERLAP_CHARS", "1024"))
+
+# Attachment uploads: largest accepted file, and where uploads are spooled while they are
+# analyzed (empty = the system temp dir); files are deleted as soon as the verdict is ready
+ATTACHMENT_MAX_BYTES = int(os.getenv("ATTACHMENT_MAX_BYTES", str(256 * 1024 * 1024)))
+ATTACHMENT_SPOOL_DIR = os.getenv("ATTACHMENT_SPOOL_DIR", "").strip() or None
+# Room for multipart boundaries, part headers and small form fields around the file
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+# Aggregated anonymous stats (counts per safety label), summed over every worker when SHARED_STATE=mmap
+aggregated_stats = create_shared_state_from_env("stats", fields=1, slots=64)
+
+
+def record_verdict(endpoint: str, verdict: Dict[str, Any], count: int = 1) -> None:
+    """Count ``count`` copies of a verdict in the aggregated stats and metrics"""
+    aggregated_stats.add(verdict["safety_label"], 0, count)
+    verdicts_returned.inc(endpoint, verdict["safety_label"], amount=count)
+    for risk in verdict["detected_risks"]:
+        risks_detected.inc(endpoint, risk, amount=count)
+
+
+def component_metrics() -> List[MetricFamily]:
+    """Metrics read from the stats() counters the components keep themselves"""
+    executor = detection_executor.stats()
+    planner = pipeline.text_planner.stats()
+    limiter = rate_limiter.stats()
+    caches = {"verdict": verdict_cache.stats(), "url_host": pipeline.url_analyzer.host_cache.stats()}
+    return [
+        MetricFamily("detection_pending", "gauge", "Detection jobs queued or running", values={(): executor["pending"]}),
+        MetricFamily("detection_jobs_total", "counter", "Detection jobs by outcome (rejected = executor saturated)",
+                     ("outcome",), {(outcome,): executor[outcome] for outcome in ("completed", "failed", "rejected")}),
+        MetricFamily("cache_lookups_total", "counter", "Cache lookups by result", ("cache", "result"),
+                     {(name, result): stats[key] for name, stats in caches.items()
+                      for result, key in (("hit", "hits"), ("miss", "misses"))}),
+        MetricFamily("cache_hit_ratio", "gauge", "Cache hits per lookup since start", ("cache",),
+                     {(name,): stats["hit_ratio"] for name, stats in caches.items()}),
+        MetricFamily("cache_entries", "gauge", "Entries held by the cache", ("cache",),
+                     {(name,): stats["entries"] for name, stats in caches.items()}),
+        MetricFamily("cache_evictions_total", "counter", "Entries dropped to stay under the cache limits", ("cache",),
+                     {(name,): stats["evictions"] for name, stats in caches.items()}),
+        MetricFamily("text_stages_total", "counter", "Text detector stages run or skipped by the planner", ("result",),
+                     {("run",): planner["stages_run"], ("skipped",): planner["stages_skipped"]}),
+        MetricFamily("rate_limit_rejections_total", "counter", "Requests refused with HTTP 429",
+                     values={(): limiter["rejected"]}, windowed=True),
+        MetricFamily("safety_labels_total", "counter", "Verdicts by safety label (all workers with SHARED_STATE=mmap)",
+                     ("safety_label",), {(label,): values[0] for label, values in aggregated_stats.items()}),
+    ]
+
+
+metrics.collector(component_metrics)
+
+
+@app.on_event("startup")
+async def start_detection_executor():
+    """Warm the detectors and start the worker pool before serving traffic"""
+    pipeline.warm_up()
+    detection_executor.start()
+
+
+@app.on_event("shutdown")
+async def stop_detection_executor():
+    detection_executor.shutdown()
+
+
+@app.on_event("startup")
+async def start_rate_limit_eviction():
+    """Drop idle API keys from the rate limiter in the background"""
+    app.state.rate_limit_eviction = asyncio.create_task(evict_idle_keys(rate_limiter, RATE_LIMIT_EVICTION_SECONDS))
+
 
-# In-memory aggregated anonymous stats (counts per safety label)
-aggregated_stats: Dict[str, int] = {"SAFE": 0, "SUSPICIOUS": 0, "UNSAFE": 0}
+@app.on_event("shutdown")
+async def stop_rate_limit_eviction():
+    app.state.rate_limit_eviction.cancel()
+
+
+@app.on_event("startup")
+async def start_metric_windows():
+    """Snapshot the metrics periodically for their rolling windows"""
+    app.state.metric_windows = asyncio.create_task(record_metric_windows(metrics))
+
+
+@app.on_event("shutdown")
+async def stop_metric_windows():
+    app.state.metric_windows.cancel()
 
 
 def hash_input(value: str) -> str:
@@ -56,18 +196,59 @@ def hash_input(value: str) -> str:
     return hashlib.sha256(value.encode('utf-8')).hexdigest()
 
 
-def map_confidence_to_score_and_label(confidence: float) -> (int, str):
-    """Map 0.0-1.0 confidence to 0-100 score and safety label.
-    Thresholds: 0-30 SAFE, 31-70 SUSPICIOUS, 71-100 UNSAFE
+def url_cache_key(url: str, context: str) -> Optional[tuple]:
+    """Verdict cache key of a URL; keyed on the reputation index build too, so a swapped
+    index is never answered from cache"""
+    return verdict_cache_key(url, "url", f"{context}|{pipeline.malware_detector.reputation.version}")
+
+
+def verdict_cache_key(value: str, kind: str, qualifier: str) -> Optional[tuple]:
+    """Cache key from the anonymized input; None if the input cannot be hashed"""
+    try:
+        with timed("cache"):
+            return verdict_cache.key(hash_input(value), kind, qualifier)
+    except Exception:
+        # In case hashing fails, never fall back to keying on raw content — skip the cache
+        return None
+
+
+async def cached_detection(cache_key: Optional[tuple], fn, *args) -> Dict[str, Any]:
+    """Serve a cached verdict for repeated inputs, otherwise run the detectors and remember it"""
+    with timed("cache"):
+        verdict = verdict_cache.get(cache_key) if cache_key else None
+    if verdict is None:
+        verdict = await run_detection(fn, *args)
+        if cache_key:
+            with timed("cache"):
+                verdict_cache.put(cache_key, verdict)
+    return verdict
+
+
+async def run_detection(fn, *args) -> Dict[str, Any]:
+    """Run a pipeline function on the detection executor, shedding load when it is saturated"""
+    detection_queue_depth.observe(detection_executor.pending)
+    try:
+        return await detection_executor.run(fn, *args)
+    except ExecutorSaturated:
+        logger.warning("Detection executor saturated, rejecting request")
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy analyzing other requests. Please retry shortly.",
+            headers={"Retry-After": "1"}
+        )
+
+
+def check_batch_size(key: str, items: List[Any]) -> None:
     """
-    score = int(round(confidence * 100))
-    if score <= 30:
-        label = "SAFE"
-    elif score <= 70:
-        label = "SUSPICIOUS"
-    else:
-        label = "UNSAFE"
-    return score, label
+    Rejects an empty batch (400) or one over the largest batch the key may send (413):
+    MAX_BATCH_ITEMS, or the key's per-minute rate limit if that is lower, since every item
+    counts against the limit and a larger batch could never be allowed
+    """
+    if not items:
+        raise HTTPException(status_code=400, detail="Batch must contain at least one item")
+    max_items = min(MAX_BATCH_ITEMS, rate_limiter.limit_for(key))
+    if len(items) > max_items:
+        raise HTTPException(status_code=413, detail=f"Batch too large. Max {max_items} items per request.")
 
 
 class TextAnalysisRequest(BaseModel):
@@ -93,10 +274,107 @@ class RiskAnalysisResponse(BaseModel):
     recommendations: List[str]  # What the user should do
 
 
+class SignatureHit(BaseModel):
+    """A content signature string found in an uploaded file"""
+    rule: str  # rule name in the signature file
+    string: str  # "$name" of the string within the rule
+    offset: int  # byte offset of its first occurrence
+
+
+class AttachmentAnalysisResponse(RiskAnalysisResponse):
+    """Response model for an uploaded file"""
+    sha256: str
+    size: int  # bytes
+    detected_type: Optional[str] = None  # type sniffed from the content (pe, pdf, zip, ...), None if unknown
+    signatures: List[SignatureHit] = []  # strings of the content signatures that matched
+
+
+class QRAnalysisRequest(BaseModel):
+    """Request model for analyzing the decoded text of a QR code"""
+    qr_data: str
+    context: str = "unknown"  # where the code was found: poster, email, web, etc.
+
+
+class QRAnalysisResponse(RiskAnalysisResponse):
+    """Response model for a QR code, with the targets found in its payload"""
+    payload_type: str  # url, wifi, sms, email, phone, contact, geo, text
+    urls: List[str] = []  # links analyzed, including links in the message text
+    phone_numbers: List[str] = []
+    email_addresses: List[str] = []
+
+
+class BatchItemResult(BaseModel):
+    """Outcome of one batch item: either a result or an error, never both"""
+    index: int  # Position of the item in the request array
+    result: Optional[RiskAnalysisResponse] = None
+    error: Optional[str] = None
+
+
+class BatchAnalysisResponse(BaseModel):
+    """Response model for batch analysis, results in input order"""
+    results: List[BatchItemResult]
+    succeeded: int
+    failed: int
+
+
+class QRBatchItemResult(BaseModel):
+    """Outcome of one QR code in a batch: either a result or an error, never both"""
+    index: int
+    result: Optional[QRAnalysisResponse] = None
+    error: Optional[str] = None
+
+
+class QRBatchAnalysisResponse(BaseModel):
+    """Response model for QR batch analysis, results in input order"""
+    results: List[QRBatchItemResult]
+    succeeded: int
+    failed: int
+
+
+class LinkVerdict(BaseModel):
+    """Verdict for one distinct link found in a message"""
+    url: str  # refanged, with a scheme
+    defanged: bool  # written as hxxp:// or with [.] in the message
+    occurrences: int  # times the link appears in the message
+    result: Optional[RiskAnalysisResponse] = None
+    error: Optional[str] = None
+
+
+class CombinedVerdict(BaseModel):
+    """Worst case over the text and all link verdicts"""
+    risk_level: str
+    confidence: float
+    safety_label: str
+    detected_risks: List[str]
+
+
+class CombinedAnalysisResponse(BaseModel):
+    """Response model for combined analysis"""
+    text_analysis: RiskAnalysisResponse
+    url_analysis: Optional[RiskAnalysisResponse] = None  # the explicit url_request, if given
+    links: List[LinkVerdict]  # links found in the text, in order of first appearance
+    combined: CombinedVerdict
+
+
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
-    return {"status": "healthy", "service": "digital-hygiene-companion"}
+    """Health check endpoint (includes detection executor load)"""
+    return {
+        "status": "healthy",
+        "service": "digital-hygiene-companion",
+        "executor": detection_executor.stats(),
+        "verdict_cache": verdict_cache.stats(),
+        "planner": pipeline.text_planner.stats(),
+        "url_host_cache": pipeline.url_analyzer.host_cache.stats(),
+        "reputation": pipeline.malware_detector.reputation.stats(),
+        "shared_state": {"rate_limits": rate_limiter.windows.stats(), "stats": aggregated_stats.stats()}
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Counters and latency histograms in the Prometheus text format, with rolling windows"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 
 @app.post("/api/analyze/text", response_model=RiskAnalysisResponse)
@@ -116,66 +394,148 @@ async def analyze_text(
         # Check rate limit
         check_rate_limit(key)
 
-        detected_risks = []
-        risk_scores = {}
+        # Anonymize input: the digest keys the verdict cache, raw content is never stored
+        cache_key = verdict_cache_key(request.content, "text", request.content_type)
 
-        # Run all detectors
-        if phishing_detector.detect(request.content):
-            detected_risks.append("Phishing attempt")
-            risk_scores["phishing"] = phishing_detector.get_confidence()
+        # CPU-bound detection runs on the executor so the event loop stays responsive
+        verdict = await cached_detection(cache_key, pipeline.analyze_text_content, request.content, request.content_type)
+        # Only store aggregated stats (no raw inputs saved)
+        record_verdict("/api/analyze/text", verdict)
 
-        if social_engineering_detector.detect(request.content):
-            detected_risks.append("Social engineering attempt")
-            risk_scores["social_engineering"] = social_engineering_detector.get_confidence()
+        return RiskAnalysisResponse(**verdict)
 
-        if credential_theft_detector.detect(request.content, request.content_type):
-            detected_risks.append("Credential theft attempt")
-            risk_scores["credential_theft"] = credential_theft_detector.get_confidence()
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error analyzing text: {str(e)}")
+        raise HTTPException(status_code=500, detail="Analysis failed")
 
-        # Calculate overall risk
-        if not detected_risks:
-            risk_level = "LOW"
-            avg_confidence = 0.0
-        else:
-            avg_confidence = sum(risk_scores.values()) / len(risk_scores) if risk_scores else 0
-            if avg_confidence > 0.7:
-                risk_level = "CRITICAL"
-            elif avg_confidence > 0.5:
-                risk_level = "HIGH"
-            elif avg_confidence > 0.3:
-                risk_level = "MEDIUM"
+
+@app.post("/api/analyze/text/batch", response_model=BatchAnalysisResponse)
+async def analyze_text_batch(
+    items: List[Dict[str, Any]],
+    authorization: Optional[str] = Header(None),
+    api_key: Optional[str] = Header(None)
+):
+    """
+    Analyze many messages in one request. Body: a JSON array of TextAnalysisRequest objects.
+    Auth and rate limiting are checked once for the batch (each item counts as one request);
+    invalid or failing items are reported in their own result slot.
+    """
+    try:
+        # Validate API key (optional if not configured)
+        key = validate_api_key(authorization, api_key)
+
+        check_batch_size(key, items)
+
+        # Check rate limit once, counted by item
+        check_rate_limit(key, cost=len(items))
+
+        results: List[Optional[BatchItemResult]] = [None] * len(items)
+        verdicts: Dict[int, Dict[str, Any]] = {}
+        pending = []
+        for index, item in enumerate(items):
+            try:
+                request = TextAnalysisRequest.parse_obj(item)
+            except ValidationError:
+                results[index] = BatchItemResult(index=index, error="Invalid item: expected {content, content_type}")
+                continue
+            cache_key = verdict_cache_key(request.content, "text", request.content_type)
+            cached = verdict_cache.get(cache_key) if cache_key else None
+            if cached is not None:
+                verdicts[index] = cached
             else:
-                risk_level = "LOW"
+                pending.append((index, cache_key, request.content, request.content_type))
+
+        # One executor job per worker, each scoring its share of the batch in a single pass
+        if pending:
+            chunk_size = -(-len(pending) // detection_executor.max_workers)
+            chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+            outcomes = await asyncio.gather(*(
+                run_detection(pipeline.analyze_text_batch, [(content, content_type) for _, _, content, content_type in chunk])
+                for chunk in chunks
+            ))
+            for chunk, chunk_outcomes in zip(chunks, outcomes):
+                for (index, cache_key, _, _), outcome in zip(chunk, chunk_outcomes):
+                    if "error" in outcome:
+                        results[index] = BatchItemResult(index=index, error=outcome["error"])
+                        continue
+                    verdicts[index] = outcome["result"]
+                    if cache_key:
+                        verdict_cache.put(cache_key, outcome["result"])
+
+        for index, verdict in verdicts.items():
+            # Anonymized aggregate only (no raw inputs saved)
+            record_verdict("/api/analyze/text/batch", verdict)
+            results[index] = BatchItemResult(index=index, result=RiskAnalysisResponse(**verdict))
+
+        failed = sum(1 for item in results if item.error is not None)
+        return BatchAnalysisResponse(results=results, succeeded=len(results) - failed, failed=failed)
 
-        # Generate explanation and recommendations
-        # Structured explanation (summary, reasons, next steps)
-        structured = risk_explainer.explain_structured(detected_risks, risk_level)
-        explanation_text = structured['summary'] + "\n\nReasons:\n- " + "\n- ".join(structured['reasons'])
-        recommendations = structured['next_steps']
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error analyzing text batch: {str(e)}")
+        raise HTTPException(status_code=500, detail="Batch analysis failed")
 
-        # Map to 0-100 and safety label
-        risk_score, safety_label = map_confidence_to_score_and_label(avg_confidence)
 
-        # Anonymize input and only store aggregated stats (no raw inputs saved)
-        try:
-            hashed = hash_input(request.content)
-            aggregated_stats[safety_label] = aggregated_stats.get(safety_label, 0) + 1
-        except Exception:
-            # In case hashing fails, avoid storing raw content — skip aggregation
-            pass
-
-        return RiskAnalysisResponse(
-            risk_level=risk_level,
-            confidence=avg_confidence,
-            risk_score=risk_score,
-            safety_label=safety_label,
-            detected_risks=detected_risks,
-            explanation=explanation_text,
-            recommendations=recommendations
+@app.post("/api/analyze/text/stream", response_model=RiskAnalysisResponse)
+async def analyze_text_stream(
+    request: Request,
+    response: Response,
+    content_type: str = "email",
+    authorization: Optional[str] = Header(None),
+    api_key: Optional[str] = Header(None)
+):
+    """
+    Analyze a very large message sent as the raw request body (UTF-8 text, any size).
+    The body is scanned in windows as it arrives and never held in memory as a whole;
+    reading stops early once the message is certain to be UNSAFE.
+    Response headers report X-Bytes-Scanned and X-Early-Termination.
+    Optional: Include 'Authorization: Bearer <api_key>' or 'api-key: <key>' header for authentication.
+    """
+    try:
+        # Validate API key (optional if not configured)
+        key = validate_api_key(authorization, api_key)
+        # Check rate limit
+        check_rate_limit(key)
+
+        analysis = pipeline.TextStreamAnalysis(
+            content_type, overlap=STREAM_OVERLAP_CHARS, chunk_size=STREAM_CHUNK_CHARS
         )
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        bytes_scanned = 0
+        buffered: List[str] = []
+        buffered_chars = 0
+
+        # Only decoding happens on the event loop: every STREAM_CHUNK_CHARS of text are
+        # scanned by one detection job, which counts against the executor's pending limit
+        async for chunk in request.stream():
+            bytes_scanned += len(chunk)
+            text = decoder.decode(chunk)
+            buffered.append(text)
+            buffered_chars += len(text)
+            if buffered_chars >= STREAM_CHUNK_CHARS:
+                analysis = await run_detection(pipeline.feed_text_stream, analysis, "".join(buffered))
+                buffered.clear()
+                buffered_chars = 0
+                if analysis.terminated_early:
+                    break
+        else:
+            buffered.append(decoder.decode(b"", final=True))
 
+        verdict, terminated_early = await run_detection(pipeline.finish_text_stream, analysis, "".join(buffered))
+        # Only store aggregated stats (no raw inputs saved)
+        record_verdict("/api/analyze/text/stream", verdict)
+
+        response.headers["X-Bytes-Scanned"] = str(bytes_scanned)
+        response.headers["X-Early-Termination"] = "true" if terminated_early else "false"
+        return RiskAnalysisResponse(**verdict)
+
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error analyzing text: {str(e)}")
+        logger.error(f"Error analyzing text stream: {str(e)}")
         raise HTTPException(status_code=500, detail="Analysis failed")
 
 
@@ -196,113 +556,303 @@ async def analyze_url(
         # Check rate limit
         check_rate_limit(key)
 
-        detected_risks = []
-        risk_scores = {}
+        # Anonymize input: the digest keys the verdict cache, raw URLs are never stored
+        cache_key = url_cache_key(request.url, request.context)
 
-        # Analyze URL
-        url_analysis = url_analyzer.analyze(request.url, request.context)
+        # CPU-bound detection runs on the executor so the event loop stays responsive
+        verdict = await cached_detection(cache_key, pipeline.analyze_url_target, request.url, request.context)
+        # Only store aggregated stats (no raw inputs saved)
+        record_verdict("/api/analyze/url", verdict)
 
-        if url_analysis["is_suspicious"]:
-            detected_risks.append("Suspicious URL")
-            risk_scores["url_suspicious"] = url_analysis["confidence"]
+        return RiskAnalysisResponse(**verdict)
 
-        if url_analysis["phishing_indicators"]:
-            detected_risks.append("Phishing URL indicators")
-            risk_scores["url_phishing"] = url_analysis["phishing_confidence"]
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error analyzing URL: {str(e)}")
+        raise HTTPException(status_code=500, detail="Analysis failed")
 
-        if malware_detector.check_url_reputation(request.url):
-            detected_risks.append("Potential malware source")
-            risk_scores["malware"] = malware_detector.get_confidence()
 
-        # Calculate overall risk
-        if not detected_risks:
-            risk_level = "LOW"
-            avg_confidence = 0.0
-        else:
-            avg_confidence = sum(risk_scores.values()) / len(risk_scores) if risk_scores else 0
-            if avg_confidence > 0.7:
-                risk_level = "CRITICAL"
-            elif avg_confidence > 0.5:
-                risk_level = "HIGH"
-            elif avg_confidence > 0.3:
-                risk_level = "MEDIUM"
-            else:
-                risk_level = "LOW"
+@app.post("/api/analyze/url/batch")
+async def analyze_url_batch(
+    items: List[Any],
+    authorization: Optional[str] = Header(None),
+    api_key: Optional[str] = Header(None)
+):
+    """
+    Analyze many URLs in one request, e.g. every link found on a crawled page.
+    Body: a JSON array of URLAnalysisRequest objects or plain URL strings.
+    Equivalent URLs (see pipeline.canonical_url) are analyzed once per batch, and URLs
+    of the same host go to the same executor job so host-level features are computed once.
+    Results stream back as NDJSON in completion order, one line per input item:
+    {"index": i, "result": {...}} or {"index": i, "error": "..."}, then a final
+    {"summary": {"items", "unique", "succeeded", "failed"}} line.
+    """
+    try:
+        # Validate API key (optional if not configured)
+        key = validate_api_key(authorization, api_key)
 
-        # Generate explanation and recommendations
-        structured = risk_explainer.explain_structured(detected_risks, risk_level)
-        explanation_text = structured['summary'] + "\n\nReasons:\n- " + "\n- ".join(structured['reasons'])
-        recommendations = structured['next_steps']
+        check_batch_size(key, items)
 
-        # Map to 0-100 and safety label
-        risk_score, safety_label = map_confidence_to_score_and_label(avg_confidence)
+        # Check rate limit once, counted by item
+        check_rate_limit(key, cost=len(items))
 
-        # Anonymize input and only store aggregated stats (no raw inputs saved)
-        try:
-            hashed = hash_input(request.url)
-            aggregated_stats[safety_label] = aggregated_stats.get(safety_label, 0) + 1
-        except Exception:
-            pass
-
-        return RiskAnalysisResponse(
-            risk_level=risk_level,
-            confidence=avg_confidence,
-            risk_score=risk_score,
-            safety_label=safety_label,
-            detected_risks=detected_risks,
-            explanation=explanation_text,
-            recommendations=recommendations
+        invalid: List[int] = []
+        targets: Dict[tuple, List[int]] = {}  # (canonical url, context) -> indices of the items
+        for index, item in enumerate(items):
+            try:
+                request = URLAnalysisRequest(url=item) if isinstance(item, str) else URLAnalysisRequest.parse_obj(item)
+            except ValidationError:
+                invalid.append(index)
+                continue
+            targets.setdefault((pipeline.canonical_url(request.url), request.context), []).append(index)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error analyzing URL batch: {str(e)}")
+        raise HTTPException(status_code=500, detail="Batch analysis failed")
+
+    async def results():
+        counts = {"items": len(items), "unique": len(targets), "succeeded": 0, "failed": 0}
+
+        def lines(indices: List[int], verdict: Optional[Dict[str, Any]] = None, error: Optional[str] = None) -> str:
+            if verdict is not None:
+                # Anonymized aggregate only (no raw inputs saved)
+                record_verdict("/api/analyze/url/batch", verdict, len(indices))
+                counts["succeeded"] += len(indices)
+                result = RiskAnalysisResponse(**verdict).dict()
+                return "".join(json.dumps({"index": index, "result": result}) + "\n" for index in indices)
+            counts["failed"] += len(indices)
+            return "".join(json.dumps({"index": index, "error": error}) + "\n" for index in indices)
+
+        if invalid:
+            yield lines(invalid, error="Invalid item: expected a URL string or {url, context}")
+
+        pending = []
+        for target, indices in targets.items():
+            cache_key = url_cache_key(*target)
+            cached = verdict_cache.get(cache_key) if cache_key else None
+            if cached is not None:
+                yield lines(indices, cached)
+            else:
+                pending.append((target, indices, cache_key))
+
+        # Group by host, then cut into jobs; at most one job per worker is in flight
+        pending.sort(key=lambda entry: netloc_of(entry[0][0]).lower())
+        chunks = [pending[i:i + URL_BATCH_CHUNK] for i in range(0, len(pending), URL_BATCH_CHUNK)]
+        running: Dict[asyncio.Task, list] = {}
+        while chunks or running:
+            while chunks and len(running) < detection_executor.max_workers:
+                chunk = chunks.pop(0)
+                job = asyncio.ensure_future(run_detection(pipeline.analyze_url_batch, [target for target, _, _ in chunk]))
+                running[job] = chunk
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for job in done:
+                chunk = running.pop(job)
+                try:
+                    outcomes = job.result()
+                except HTTPException as e:
+                    outcomes = [{"error": e.detail}] * len(chunk)
+                except Exception as e:
+                    logger.error(f"Error analyzing URL batch: {str(e)}")
+                    outcomes = [{"error": "Analysis failed"}] * len(chunk)
+                for (_, indices, cache_key), outcome in zip(chunk, outcomes):
+                    if "error" in outcome:
+                        yield lines(indices, error=outcome["error"])
+                        continue
+                    if cache_key:
+                        verdict_cache.put(cache_key, outcome["result"])
+                    yield lines(indices, outcome["result"])
+
+        yield json.dumps({"summary": counts}) + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
+_RISK_LEVEL_ORDER = {"LOW": 0, "MEDIUM": 1, "HIGH": 2, "CRITICAL": 3}
+_SAFETY_LABEL_ORDER = {"SAFE": 0, "SUSPICIOUS": 1, "UNSAFE": 2}
+
+
+@app.post("/api/analyze/combined", response_model=CombinedAnalysisResponse)
+async def analyze_combined(
+    text_request: TextAnalysisRequest,
+    url_request: Optional[URLAnalysisRequest] = None,
+    authorization: Optional[str] = Header(None),
+    api_key: Optional[str] = Header(None)
+):
+    """
+    Combined analysis of a message and every link in it (plus an optional explicit URL).
+    Links are extracted from the text, including defanged (hxxp://, [.]) and bare forms;
+    each distinct link is analyzed once, concurrently with the text detectors, and the
+    verdicts are merged into one response with a per-link breakdown.
+    Links in the text are analyzed in the text's content_type; only the explicit URL uses
+    its own context. The message and each distinct URL count as one request against the
+    rate limit, like the items of /api/analyze/url/batch.
+    Optional: Include 'Authorization: Bearer <api_key>' or 'api-key: <key>' header for authentication.
+    """
+    text_job = None
+    try:
+        # Validate API key (optional if not configured)
+        key = validate_api_key(authorization, api_key)
+        # Links are extracted first so that every URL analyzed is charged
+        links = await run_detection(pipeline.extract_links, text_request.content)
+
+        # (canonical url, context) -> {"result": verdict} or {"error": message}
+        targets: Dict[tuple, Any] = {}
+        link_targets = [(pipeline.canonical_url(link.url), text_request.content_type) for link in links]
+        explicit = (pipeline.canonical_url(url_request.url), url_request.context) if url_request else None
+        for target in link_targets + ([explicit] if explicit is not None else []):
+            targets.setdefault(target, None)
+        # Check rate limit: one unit for the message, one per distinct URL
+        check_rate_limit(key, cost=1 + len(targets))
+
+        # Text detectors run beside link scoring
+        text_job = asyncio.ensure_future(cached_detection(
+            verdict_cache_key(text_request.content, "text", text_request.content_type),
+            pipeline.analyze_text_content, text_request.content, text_request.content_type,
+        ))
+
+        pending = []
+        for target in targets:
+            cache_key = url_cache_key(*target)
+            cached = verdict_cache.get(cache_key) if cache_key else None
+            if cached is not None:
+                targets[target] = {"result": cached}
+            else:
+                pending.append((target, cache_key))
+
+        # Same job split as the URL batch endpoint: by host, at most one job per worker
+        pending.sort(key=lambda entry: netloc_of(entry[0][0]).lower())
+        chunk_size = max(1, -(-len(pending) // detection_executor.max_workers))
+        chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+        outcomes = await asyncio.gather(*(
+            run_detection(pipeline.analyze_url_batch, [target for target, _ in chunk]) for chunk in chunks
+        ))
+        for chunk, chunk_outcomes in zip(chunks, outcomes):
+            for (target, cache_key), outcome in zip(chunk, chunk_outcomes):
+                targets[target] = outcome
+                if "result" in outcome and cache_key:
+                    verdict_cache.put(cache_key, outcome["result"])
+
+        text_verdict = await text_job
+        verdicts = [text_verdict] + [outcome["result"] for outcome in targets.values() if "result" in outcome]
+        # Only store aggregated stats (no raw inputs saved)
+        for verdict in verdicts:
+            record_verdict("/api/analyze/combined", verdict)
+
+        link_verdicts = []
+        for link, target in zip(links, link_targets):
+            outcome = targets[target]
+            link_verdicts.append(LinkVerdict(
+                url=link.url,
+                defanged=link.defanged,
+                occurrences=link.occurrences,
+                result=RiskAnalysisResponse(**outcome["result"]) if "result" in outcome else None,
+                error=outcome.get("error"),
+            ))
+
+        detected_risks = list(dict.fromkeys(risk for verdict in verdicts for risk in verdict["detected_risks"]))
+        url_outcome = targets.get(explicit) if explicit is not None else None
+        if url_outcome is not None and "error" in url_outcome:
+            raise HTTPException(status_code=500, detail="Analysis failed")
+        return CombinedAnalysisResponse(
+            text_analysis=RiskAnalysisResponse(**text_verdict),
+            url_analysis=RiskAnalysisResponse(**url_outcome["result"]) if url_outcome else None,
+            links=link_verdicts,
+            combined=CombinedVerdict(
+                risk_level=max((v["risk_level"] for v in verdicts), key=_RISK_LEVEL_ORDER.__getitem__),
+                confidence=max(v["confidence"] for v in verdicts),
+                safety_label=max((v["safety_label"] for v in verdicts), key=_SAFETY_LABEL_ORDER.__getitem__),
+                detected_risks=detected_risks,
+            ),
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error analyzing URL: {str(e)}")
+        logger.error(f"Error in combined analysis: {str(e)}")
         raise HTTPException(status_code=500, detail="Analysis failed")
+    finally:
+        if text_job is not None and not text_job.done():
+            text_job.cancel()
 
 
-@app.post("/api/analyze/combined")
-async def analyze_combined(text_request: TextAnalysisRequest, url_request: URLAnalysisRequest = None):
+@app.post("/api/analyze/attachment", response_model=AttachmentAnalysisResponse)
+async def analyze_attachment(
+    request: Request,
+    authorization: Optional[str] = Header(None),
+    api_key: Optional[str] = Header(None)
+):
     """
-    Combined analysis of text and optional URL.
-    Useful for analyzing emails with links, messages with URLs, etc.
+    Analyze an uploaded file sent as multipart/form-data in the "file" field.
+    The upload is streamed to a temporary spool file while its SHA-256 is computed, so
+    memory use does not grow with the file size; files over ATTACHMENT_MAX_BYTES are
+    rejected with 413 as soon as the limit is crossed. The verdict combines the filename
+    heuristics, the file type sniffed from the leading bytes (an .exe renamed to .pdf is
+    caught), the hash against the reputation index and the byte signatures, which are
+    scanned over a memory map of the spooled file. The file is deleted afterwards.
+    Optional: Include 'Authorization: Bearer <api_key>' or 'api-key: <key>' header for authentication.
     """
+    upload = None
     try:
-        text_result = await analyze_text(text_request)
-        
-        results = {"text_analysis": text_result}
-        
-        if url_request:
-            url_result = await analyze_url(url_request)
-            results["url_analysis"] = url_result
-            
-            # Combine results if both have risks
-            if text_result.detected_risks or url_result.detected_risks:
-                combined_risks = list(set(text_result.detected_risks + url_result.detected_risks))
-                combined_confidence = max(text_result.confidence, url_result.confidence)
-                combined_risk_level = max([text_result.risk_level, url_result.risk_level],
-                                        key=lambda x: {"LOW": 0, "MEDIUM": 1, "HIGH": 2, "CRITICAL": 3}[x])
-                
-                results["combined"] = {
-                    "risk_level": combined_risk_level,
-                    "confidence": combined_confidence,
-                    "detected_risks": combined_risks
-                }
-        
-        return results
+        # Validate API key (optional if not configured)
+        key = validate_api_key(authorization, api_key)
+        # Check rate limit
+        check_rate_limit(key)
 
+        declared_length = request.headers.get("content-length", "")
+        if declared_length.isdigit() and int(declared_length) > ATTACHMENT_MAX_BYTES + MULTIPART_OVERHEAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"File too large. Max {ATTACHMENT_MAX_BYTES} bytes.")
+
+        receiver = UploadReceiver(
+            request.headers.get("content-type", ""),
+            max_bytes=ATTACHMENT_MAX_BYTES,
+            head_bytes=SNIFF_BYTES,
+            spool_dir=ATTACHMENT_SPOOL_DIR,
+        )
+        upload = await receiver.receive(request.stream())
+
+        # Anonymize input: keyed by the file digest, the file itself is never stored
+        cache_key = verdict_cache_key(
+            f"{upload.sha256}|{upload.filename}", "attachment", pipeline.malware_detector.reputation.version
+        )
+        verdict = await cached_detection(
+            cache_key, pipeline.analyze_attachment, upload.filename, upload.sha256, upload.head, upload.path
+        )
+        # Only store aggregated stats (no raw inputs saved)
+        record_verdict("/api/analyze/attachment", verdict)
+
+        return AttachmentAnalysisResponse(**verdict, sha256=upload.sha256, size=upload.size)
+
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error in combined analysis: {str(e)}")
+        logger.error(f"Error analyzing attachment: {str(e)}")
         raise HTTPException(status_code=500, detail="Analysis failed")
+    finally:
+        if upload is not None:
+            await asyncio.to_thread(upload.close)
 
 
-@app.post("/api/analyze/qr", response_model=RiskAnalysisResponse)
+def qr_cache_key(qr_data: str, context: str) -> Optional[tuple]:
+    """Verdict cache key of a QR payload (its links are checked against the reputation index)"""
+    return verdict_cache_key(qr_data, "qr", f"{context}|{pipeline.malware_detector.reputation.version}")
+
+
+@app.post("/api/analyze/qr", response_model=QRAnalysisResponse)
 async def analyze_qr(
     payload: Dict[str, Any],
     authorization: Optional[str] = Header(None),
     api_key: Optional[str] = Header(None)
 ):
     """
-    Analyze QR content. Expects JSON: { "qr_data": "<text or url>", "context": "email|chat|web|unknown" }
-    For this MVP we accept the QR data as text (often a URL) and analyze the contained link.
+    Analyze QR content. Expects JSON: { "qr_data": "<decoded text>", "context": "email|chat|web|unknown" }
+    Every payload type is read (see detectors/qr_payload.py): links, WIFI:, SMSTO:/sms:,
+    MAILTO:/MATMSG:, tel:, MECARD:, vCard, MEBKM: and geo:, with plain text as the fallback.
+    Links go to the URL detectors, message bodies and notes to the text detectors, and
+    phone numbers and Wi-Fi settings to the QR detector.
     Optional: Include 'Authorization: Bearer <api_key>' or 'api-key: <key>' header for authentication.
     """
     try:
@@ -311,19 +861,22 @@ async def analyze_qr(
         # Check rate limit
         check_rate_limit(key)
 
-        qr_data = payload.get("qr_data") if isinstance(payload, dict) else None
-        context = payload.get("context", "unknown") if isinstance(payload, dict) else "unknown"
-
-        if not qr_data:
+        try:
+            request = QRAnalysisRequest.parse_obj(payload)
+        except ValidationError:
+            raise HTTPException(status_code=400, detail="Missing qr_data in payload")
+        if not request.qr_data.strip():
             raise HTTPException(status_code=400, detail="Missing qr_data in payload")
+        if len(request.qr_data) > MAX_QR_DATA_CHARS:
+            raise HTTPException(status_code=400, detail=f"qr_data is longer than a QR code can hold ({MAX_QR_DATA_CHARS} characters)")
 
-        # If qr_data looks like a URL, forward to URL analyzer
-        if isinstance(qr_data, str) and qr_data.startswith("http"):
-            url_req = URLAnalysisRequest(url=qr_data, context=context)
-            return await analyze_url(url_req)
+        # Anonymize input: the digest keys the verdict cache, raw payloads are never stored
+        cache_key = qr_cache_key(request.qr_data, request.context)
+        verdict = await cached_detection(cache_key, pipeline.analyze_qr_payload, request.qr_data, request.context)
+        # Only store aggregated stats (no raw inputs saved)
+        record_verdict("/api/analyze/qr", verdict)
 
-        # Otherwise, we don't attempt image decoding server-side in this MVP
-        raise HTTPException(status_code=400, detail="qr_data must contain a URL for this demo")
+        return QRAnalysisResponse(**verdict)
 
     except HTTPException:
         raise
@@ -332,6 +885,81 @@ async def analyze_qr(
         raise HTTPException(status_code=500, detail="QR analysis failed")
 
 
+@app.post("/api/analyze/qr/batch", response_model=QRBatchAnalysisResponse)
+async def analyze_qr_batch(
+    items: List[Any],
+    authorization: Optional[str] = Header(None),
+    api_key: Optional[str] = Header(None)
+):
+    """
+    Analyze many QR codes in one request, e.g. everything a kiosk scanned since its last upload.
+    Body: a JSON array of QRAnalysisRequest objects or plain qr_data strings.
+    Identical codes are analyzed once per batch; the rest are split into one executor job
+    per worker, each running the whole pipeline over its share of the codes.
+    """
+    try:
+        # Validate API key (optional if not configured)
+        key = validate_api_key(authorization, api_key)
+
+        check_batch_size(key, items)
+
+        # Check rate limit once, counted by item
+        check_rate_limit(key, cost=len(items))
+
+        results: List[Optional[QRBatchItemResult]] = [None] * len(items)
+        verdicts: Dict[int, Dict[str, Any]] = {}
+        targets: Dict[tuple, List[int]] = {}  # (qr_data, context) -> indices of the items
+        for index, item in enumerate(items):
+            try:
+                request = QRAnalysisRequest(qr_data=item) if isinstance(item, str) else QRAnalysisRequest.parse_obj(item)
+            except ValidationError:
+                request = None
+            if request is None or not request.qr_data.strip() or len(request.qr_data) > MAX_QR_DATA_CHARS:
+                results[index] = QRBatchItemResult(index=index, error="Invalid item: expected a qr_data string or {qr_data, context}")
+                continue
+            targets.setdefault((request.qr_data, request.context), []).append(index)
+
+        pending = []
+        for target, indices in targets.items():
+            cache_key = qr_cache_key(*target)
+            cached = verdict_cache.get(cache_key) if cache_key else None
+            if cached is not None:
+                verdicts.update((index, cached) for index in indices)
+            else:
+                pending.append((target, indices, cache_key))
+
+        # One executor job per worker, each running its share of the codes in a single pass
+        if pending:
+            chunk_size = -(-len(pending) // detection_executor.max_workers)
+            chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+            outcomes = await asyncio.gather(*(
+                run_detection(pipeline.analyze_qr_batch, [target for target, _, _ in chunk]) for chunk in chunks
+            ))
+            for chunk, chunk_outcomes in zip(chunks, outcomes):
+                for (_, indices, cache_key), outcome in zip(chunk, chunk_outcomes):
+                    if "error" in outcome:
+                        for index in indices:
+                            results[index] = QRBatchItemResult(index=index, error=outcome["error"])
+                        continue
+                    verdicts.update((index, outcome["result"]) for index in indices)
+                    if cache_key:
+                        verdict_cache.put(cache_key, outcome["result"])
+
+        for index, verdict in verdicts.items():
+            # Anonymized aggregate only (no raw inputs saved)
+            record_verdict("/api/analyze/qr/batch", verdict)
+            results[index] = QRBatchItemResult(index=index, result=QRAnalysisResponse(**verdict))
+
+        failed = sum(1 for item in results if item.error is not None)
+        return QRBatchAnalysisResponse(results=results, succeeded=len(results) - failed, failed=failed)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error analyzing QR batch: {str(e)}")
+        raise HTTPException(status_code=500, detail="Batch analysis failed")
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,316 @@
+"""
+Metrics module - request counters and latency histograms exposed on /metrics in the
+Prometheus text format.
+
+Hot-path updates are a dict lookup and an addition: Counter.inc and Histogram.observe
+are called from the event loop only, so they take no lock. Components that already keep
+their own counters (executor, caches, planner, rate limiter) are not duplicated; a
+collector reads their stats() when the registry is scraped.
+
+Rolling windows come from snapshots: every ``slice_seconds`` a background task copies
+the counter and histogram values, and the value over the last N seconds is the current
+value minus the snapshot taken N seconds ago. Nothing time-related happens per update.
+Only families registered with ``windowed=True`` get rolling windows: each window repeats
+every label set (and every quantile of a histogram), which for per-stage or per-rule
+families would multiply the size of a scrape.
+"""
+
+import asyncio
+import bisect
+import math
+import os
+import time
+import logging
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from detectors import timing
+
+logger = logging.getLogger(__name__)
+
+# Seconds; fixed so histograms of every process and window can be added up
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Stages of a request (one detector, one regex) are often well under a millisecond
+STAGE_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005) + LATENCY_BUCKETS
+# Quantiles reported for the rolling windows of a histogram
+WINDOW_QUANTILES = (0.5, 0.9, 0.99)
+
+
+class MetricFamily:
+    """One named metric: ``values`` maps a tuple of label values to its value"""
+
+    def __init__(self, name: str, kind: str, help: str, labels: Sequence[str] = (), values: Optional[Dict] = None,
+                 windowed: bool = False):
+        self.name = name
+        self.kind = kind  # counter, gauge or histogram
+        self.help = help
+        self.labels = tuple(labels)
+        self.values: Dict[tuple, object] = values if values is not None else {}
+        self.windowed = windowed  # also report the change over the registry's rolling windows
+
+
+class Counter(MetricFamily):
+    """Monotonic count per label set"""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), windowed: bool = False):
+        super().__init__(name, "counter", help, labels, windowed=windowed)
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+
+class Histogram(MetricFamily):
+    """
+    Observations counted into fixed buckets per label set. Each value is a list of the
+    per-bucket counts (not cumulative, last one is +Inf) followed by the sum.
+    """
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS,
+                 windowed: bool = False):
+        super().__init__(name, "histogram", help, labels, windowed=windowed)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *label_values: str) -> None:
+        counts = self.values.get(label_values)
+        if counts is None:
+            counts = self.values[label_values] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def quantile(self, q: float, counts: List[float]) -> float:
+        """Estimate of the q-quantile from bucket counts (linear within a bucket)"""
+        total = sum(counts[:-1])
+        if not total:
+            return math.nan
+        rank = q * total
+        seen = 0
+        for i, count in enumerate(counts[:-1]):
+            if seen + count >= rank and count:
+                if i == len(self.buckets):
+                    return self.buckets[-1]  # in +Inf: the largest finite bound is all that is known
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+def _copy(family: MetricFamily) -> Dict[tuple, object]:
+    if family.kind == "histogram":
+        return {labels: list(counts) for labels, counts in family.values.items()}
+    return dict(family.values)
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _sample(name: str, labels: Iterable[Tuple[str, str]], value: float) -> str:
+    pairs = ",".join(f'{key}="{_escape(label)}"' for key, label in labels)
+    return f"{name}{{{pairs}}} {_format_value(value)}" if pairs else f"{name} {_format_value(value)}"
+
+
+class MetricsRegistry:
+    """
+    The metrics of this process, rendered with ``prefix`` in front of every name.
+    ``windows`` are the rolling windows (seconds) reported next to the totals; they are
+    accurate to ``slice_seconds``.
+    """
+
+    def __init__(self, prefix: str = "dhc", windows: Sequence[int] = (60, 300, 900),
+                 slice_seconds: float = 10.0, clock: Callable[[], float] = time.monotonic):
+        self.prefix = prefix
+        self.windows = tuple(sorted(windows))
+        self.slice_seconds = slice_seconds
+        self.clock = clock
+        self._families: List[MetricFamily] = []
+        self._collectors: List[Callable[[], Iterable[MetricFamily]]] = []
+        keep = int(max(self.windows, default=0) // slice_seconds) + 2
+        # (time, {family name: values}); the first snapshot is the empty state at start
+        self._snapshots: Deque[Tuple[float, Dict[str, Dict[tuple, object]]]] = deque([(clock(), {})], maxlen=keep)
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = (), windowed: bool = False) -> Counter:
+        family = Counter(name, help, labels, windowed)
+        self._families.append(family)
+        return family
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS, windowed: bool = False) -> Histogram:
+        family = Histogram(name, help, labels, buckets, windowed)
+        self._families.append(family)
+        return family
+
+    def collector(self, collect: Callable[[], Iterable[MetricFamily]]) -> None:
+        """Register a function returning families built at scrape time (from stats())"""
+        self._collectors.append(collect)
+
+    def families(self) -> List[MetricFamily]:
+        families = list(self._families)
+        for collect in self._collectors:
+            try:
+                families.extend(collect())
+            except Exception as e:
+                logger.error(f"Metrics collector {getattr(collect, '__name__', collect)} failed: {e}")
+        return families
+
+    def snapshot(self, families: Optional[List[MetricFamily]] = None) -> None:
+        """Remember the windowed counters and histograms now, as the start of later windows"""
+        families = self.families() if families is None else families
+        self._snapshots.append((self.clock(), {
+            family.name: _copy(family) for family in families
+            if family.windowed and family.kind in ("counter", "histogram")
+        }))
+
+    def _baseline(self, seconds: float, now: float) -> Dict[str, Dict[tuple, object]]:
+        """Newest snapshot at least ``seconds`` old (the oldest kept if none is)"""
+        baseline = self._snapshots[0][1]
+        for taken, values in self._snapshots:
+            if taken > now - seconds:
+                break
+            baseline = values
+        return baseline
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4)"""
+        now = self.clock()
+        families = self.families()
+        lines: List[str] = []
+        for family in families:
+            name = f"{self.prefix}_{family.name}"
+            lines.append(f"# HELP {name} {family.help}")
+            lines.append(f"# TYPE {name} {family.kind}")
+            for label_values, value in sorted(family.values.items()):
+                labels = list(zip(family.labels, label_values))
+                if family.kind != "histogram":
+                    lines.append(_sample(name, labels, value))
+                    continue
+                cumulative = 0
+                for bound, count in zip(family.buckets + (math.inf,), value[:-1]):
+                    cumulative += count
+                    lines.append(_sample(f"{name}_bucket", labels + [("le", _format_value(float(bound)))], cumulative))
+                lines.append(_sample(f"{name}_sum", labels, value[-1]))
+                lines.append(_sample(f"{name}_count", labels, cumulative))
+        for family in families:
+            if family.windowed and family.kind in ("counter", "histogram") and self.windows:
+                lines.extend(self._render_windows(family, now))
+        return "\n".join(lines) + "\n"
+
+    def _render_windows(self, family: MetricFamily, now: float) -> List[str]:
+        """Change of a counter (gauge) or histogram (summary) over each rolling window"""
+        base = family.name[:-len("_total")] if family.name.endswith("_total") else family.name
+        name = f"{self.prefix}_{base}_recent"
+        kind = "summary" if family.kind == "histogram" else "gauge"
+        lines = [f"# HELP {name} {family.help}, over the last window seconds",
+                 f"# TYPE {name} {kind}"]
+        for seconds in self.windows:
+            baseline = self._baseline(seconds, now).get(family.name, {})
+            window = ("window", f"{seconds}s")
+            for label_values, value in sorted(family.values.items()):
+                labels = list(zip(family.labels, label_values)) + [window]
+                previous = baseline.get(label_values)
+                if family.kind != "histogram":
+                    lines.append(_sample(name, labels, value - (previous or 0)))
+                    continue
+                counts = [a - b for a, b in zip(value, previous)] if previous else list(value)
+                for q in WINDOW_QUANTILES:
+                    lines.append(_sample(name, labels + [("quantile", str(q))], family.quantile(q, counts)))
+                lines.append(_sample(f"{name}_sum", labels, counts[-1]))
+                lines.append(_sample(f"{name}_count", labels, sum(counts[:-1])))
+        return lines
+
+
+def create_metrics_from_env() -> MetricsRegistry:
+    """
+    Build the registry from environment variables:
+    METRICS_WINDOWS (rolling windows in seconds, comma-separated, default 60,300,900),
+    METRICS_SLICE_SECONDS (snapshot interval = window accuracy, default 10).
+    """
+    windows = [int(value) for value in os.getenv("METRICS_WINDOWS", "60,300,900").split(",") if value.strip()]
+    return MetricsRegistry(windows=windows, slice_seconds=float(os.getenv("METRICS_SLICE_SECONDS", "10")))
+
+
+async def record_metric_windows(registry: MetricsRegistry) -> None:
+    """Background task: snapshot the registry every slice so rolling windows can be computed"""
+    while True:
+        await asyncio.sleep(registry.slice_seconds)
+        registry.snapshot()
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting every HTTP request and timing it until the last body byte
+    is sent, labelled by the route's path template (never the raw path, so the number of
+    series stays bounded) and the response status.
+
+    Each request also collects its stage times (see detectors/timing.py). They are sent
+    in a Server-Timing header when ``server_timing`` is on - with "serialize", the time
+    from the last stage to the response headers (building and encoding the response
+    model), and "total" - and observed into the ``stages`` and ``rules`` histograms.
+    A streamed response sends its headers first, so its header only covers the stages
+    before the first byte; the histograms get all of them.
+    """
+
+    def __init__(self, app, requests: Counter, latency: Histogram, stages: Optional[Histogram] = None,
+                 rules: Optional[Histogram] = None, server_timing: bool = True):
+        self.app = app
+        self.requests = requests
+        self.latency = latency
+        self.stages = stages
+        self.rules = rules
+        self.server_timing = server_timing
+        self._paths: Dict[object, str] = {}  # endpoint function -> route path
+
+    def _route_path(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        path = self._paths.get(endpoint)
+        if path is None:
+            for route in getattr(scope.get("app"), "routes", ()):
+                if getattr(route, "endpoint", None) is not None:
+                    self._paths[route.endpoint] = route.path
+            path = self._paths.setdefault(endpoint, "unmatched")
+        return path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = [500]  # if the app fails before responding
+        times = timing.StageTimes()
+        token = timing.collecting(times)
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                now = time.perf_counter()
+                if times.last_end:
+                    times.add("serialize", now - times.last_end)
+                if self.server_timing:
+                    header = times.server_timing(("total", now - started)).encode("latin-1")
+                    message["headers"] = list(message.get("headers", [])) + [(b"server-timing", header)]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            timing.reset(token)
+            path = self._route_path(scope)
+            self.requests.inc(path, scope["method"], str(status[0]))
+            self.latency.observe(time.perf_counter() - started, path)
+            if self.stages is not None:
+                for stage, seconds in times.stages.items():
+                    self.stages.observe(seconds, stage)
+            if self.rules is not None:
+                for rule, seconds in times.rules.items():
+                    self.rules.observe(seconds, rule)
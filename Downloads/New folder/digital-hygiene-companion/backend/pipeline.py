@@ -0,0 +1,492 @@
+"""
+Detection pipeline - the CPU-bound scoring behind the /api/analyze/* handlers.
+
+Kept free of FastAPI so executor workers (threads or processes) can import it and
+call these functions directly; every function takes plain values and returns a
+plain dict that maps onto RiskAnalysisResponse.
+"""
+
+from typing import Dict, List, Tuple
+import hashlib
+import logging
+import os
+
+from detectors.brand_index import BUNDLED_BRANDS_PATH, BUNDLED_CONFUSABLES_PATH, BrandIndex
+from detectors.phishing_detector import PhishingDetector
+from detectors.url_analyzer import URLAnalyzer
+from detectors.social_engineering_detector import SocialEngineeringDetector
+from detectors.credential_theft_detector import CredentialTheftDetector
+from detectors.file_type import sniff
+from detectors.malware_detector import MalwareDetector
+from detectors.signatures import BUNDLED_RULES_PATH, SignatureSet
+from detectors.link_extractor import ExtractedLink, LinkExtractor
+from detectors.qr_payload import QRPayloadDetector, parse_qr_payload
+from detectors.planner import MIN_DETECTED_CONFIDENCE, EvaluationPlanner, Stage
+from detectors.scan_engine import ScanResult, default_engine as scan_engine
+from detectors.timing import timed
+from explainers.risk_explainer import RiskExplainer
+from reputation import create_reputation_store_from_env
+
+logger = logging.getLogger(__name__)
+
+# Initialize detectors (all run locally, shared by every request)
+phishing_detector = PhishingDetector()
+url_analyzer = URLAnalyzer(
+    host_cache_size=int(os.getenv("URL_HOST_CACHE_SIZE", "4096")),
+    brand_index=BrandIndex.load(
+        os.getenv("BRAND_LIST_PATH") or BUNDLED_BRANDS_PATH,
+        os.getenv("BRAND_CONFUSABLES_PATH") or BUNDLED_CONFUSABLES_PATH,
+    ),
+)
+social_engineering_detector = SocialEngineeringDetector()
+credential_theft_detector = CredentialTheftDetector()
+malware_detector = MalwareDetector(
+    reputation=create_reputation_store_from_env(),
+    signatures=SignatureSet.load(os.getenv("SIGNATURE_RULES_PATH") or BUNDLED_RULES_PATH),
+)
+link_extractor = LinkExtractor(max_links=int(os.getenv("MAX_LINKS_PER_MESSAGE", "50")))
+qr_detector = QRPayloadDetector()
+risk_explainer = RiskExplainer()
+
+# Bump when scoring logic changes in a way the detectors' rule lists do not capture
+PIPELINE_VERSION = "1"
+
+
+def ruleset_version() -> str:
+    """Fingerprint of every detector's rules and explanations (part of the verdict cache key)"""
+    digest = hashlib.sha256(PIPELINE_VERSION.encode("utf-8"))
+    for component in (phishing_detector, url_analyzer, social_engineering_detector,
+                      credential_theft_detector, malware_detector, qr_detector, risk_explainer):
+        for name, value in sorted(vars(component).items()):
+            if isinstance(value, (str, list, dict)):
+                digest.update(f"{type(component).__name__}.{name}={value!r}".encode("utf-8"))
+    # Planned evaluation may leave detectors out of detected_risks; never mix the two modes
+    digest.update(f"full_evaluation={text_planner.full}".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def map_confidence_to_score_and_label(confidence: float) -> Tuple[int, str]:
+    """Map 0.0-1.0 confidence to 0-100 score and safety label.
+    Thresholds: 0-30 SAFE, 31-70 SUSPICIOUS, 71-100 UNSAFE
+    """
+    score = int(round(confidence * 100))
+    if score <= 30:
+        label = "SAFE"
+    elif score <= 70:
+        label = "SUSPICIOUS"
+    else:
+        label = "UNSAFE"
+    return score, label
+
+
+def risk_level_for_confidence(avg_confidence: float) -> str:
+    """Map an averaged confidence to LOW/MEDIUM/HIGH/CRITICAL"""
+    if avg_confidence > 0.7:
+        return "CRITICAL"
+    elif avg_confidence > 0.5:
+        return "HIGH"
+    elif avg_confidence > 0.3:
+        return "MEDIUM"
+    return "LOW"
+
+
+def risk_level_for(detected_risks: List[str], risk_scores: Dict[str, float]) -> Tuple[str, float]:
+    """Average the detector confidences and map them to LOW/MEDIUM/HIGH/CRITICAL"""
+    if not detected_risks:
+        return "LOW", 0.0
+
+    avg_confidence = sum(risk_scores.values()) / len(risk_scores) if risk_scores else 0
+    return risk_level_for_confidence(avg_confidence), avg_confidence
+
+
+def verdict_label(avg_confidence: float) -> Tuple[str, str]:
+    """The parts of a verdict that planned evaluation must never change"""
+    return risk_level_for_confidence(avg_confidence), map_confidence_to_score_and_label(avg_confidence)[1]
+
+
+def build_verdict(detected_risks: List[str], risk_scores: Dict[str, float]) -> Dict:
+    """Turn detector hits into the fields of RiskAnalysisResponse"""
+    risk_level, avg_confidence = risk_level_for(detected_risks, risk_scores)
+
+    # Structured explanation (summary, reasons, next steps)
+    with timed("explain"):
+        structured = risk_explainer.explain_structured(detected_risks, risk_level)
+    explanation_text = structured['summary'] + "\n\nReasons:\n- " + "\n- ".join(structured['reasons'])
+
+    # Map to 0-100 and safety label
+    risk_score, safety_label = map_confidence_to_score_and_label(avg_confidence)
+
+    return {
+        "risk_level": risk_level,
+        "confidence": avg_confidence,
+        "risk_score": risk_score,
+        "safety_label": safety_label,
+        "detected_risks": detected_risks,
+        "explanation": explanation_text,
+        "recommendations": structured['next_steps'],
+    }
+
+
+# Text detectors in report order: risk_scores key -> (detected_risks entry, evaluate(scan, content_type)).
+# Each call returns its own result, nothing is kept on the detector.
+_TEXT_DETECTORS = {
+    phishing_detector.name: (
+        "Phishing attempt",
+        lambda scan, content_type: phishing_detector.evaluate("", scan),
+    ),
+    social_engineering_detector.name: (
+        "Social engineering attempt",
+        lambda scan, content_type: social_engineering_detector.evaluate("", scan),
+    ),
+    credential_theft_detector.name: (
+        "Credential theft attempt",
+        lambda scan, content_type: credential_theft_detector.evaluate("", content_type, scan),
+    ),
+}
+TEXT_DETECTORS = len(_TEXT_DETECTORS)
+
+
+def _env_flag(name: str) -> bool:
+    return os.getenv(name, "false").strip().lower() in ("1", "true", "yes", "on")
+
+
+# Stages cost what their scan engine group costs; DETECTION_FULL_EVALUATION=true runs every
+# detector on every message (complete detected_risks for auditing)
+text_planner = EvaluationPlanner(
+    [
+        Stage(detector.name, scan_engine.group_size(detector.name), detector.max_confidence)
+        for detector in (phishing_detector, social_engineering_detector, credential_theft_detector)
+    ],
+    verdict_label,
+    full=_env_flag("DETECTION_FULL_EVALUATION"),
+)
+
+
+def _collect(results: Dict) -> Tuple[List[str], Dict[str, float]]:
+    """detected_risks/risk_scores from {detector name: DetectionResult}, always in report order"""
+    detected_risks = []
+    risk_scores = {}
+    for name, (risk, _) in _TEXT_DETECTORS.items():
+        result = results.get(name)
+        if result is not None and result.detected:
+            detected_risks.append(risk)
+            risk_scores[name] = result.confidence
+    return detected_risks, risk_scores
+
+
+def _score_text_results(scan: ScanResult, content_type: str = "email") -> Dict:
+    """{detector name: DetectionResult} of every text detector from one scan's rule hits"""
+    results = {}
+    for name, (_, evaluate) in _TEXT_DETECTORS.items():
+        with timed(name):
+            results[name] = evaluate(scan, content_type)
+    return results
+
+
+def score_text_scan(scan: ScanResult, content_type: str = "email") -> Tuple[List[str], Dict[str, float]]:
+    """Score every text detector from one scan's rule hits"""
+    return _collect(_score_text_results(scan, content_type))
+
+
+def _evaluate_text_stage(lazy, content_type: str):
+    """Planner callback: confirm the stage's patterns and score its detector (timed as the detector)"""
+    def evaluate(stage: Stage):
+        with timed(stage.name):
+            return _TEXT_DETECTORS[stage.name][1](lazy.require(stage.name), content_type)
+    return evaluate
+
+
+def text_risks(content: str, content_type: str = "email") -> Tuple[List[str], Dict[str, float]]:
+    """detected_risks/risk_scores of the text detectors for one message"""
+    # One anchor pass over the content; each detector's regex checks run only when the
+    # planner reaches it, and not at all when none of its anchor literals occur
+    with timed("scan"):
+        lazy = scan_engine.lazy(content)
+    results = text_planner.run(
+        _evaluate_text_stage(lazy, content_type),
+        prefilter=lambda stage: lazy.anchored(stage.name),
+    )
+    return _collect(results)
+
+
+def analyze_text_content(content: str, content_type: str = "email") -> Dict:
+    """Run the text detectors over one message"""
+    return build_verdict(*text_risks(content, content_type))
+
+
+_TEXT_DETECTOR_INSTANCES = {
+    detector.name: detector for detector in (phishing_detector, social_engineering_detector, credential_theft_detector)
+}
+
+
+def lowest_possible_confidence(results: Dict, detectors: int = TEXT_DETECTORS) -> float:
+    """
+    Lower bound on the final averaged confidence once more content is scanned, from the
+    {detector name: DetectionResult} so far: a detector that fired ends at no less than
+    its lowest_reachable() (still above the firing threshold), and each detector that has
+    not fired yet can at worst join the average at the firing threshold.
+    """
+    floors = [
+        _TEXT_DETECTOR_INSTANCES[name].lowest_reachable(result)
+        for name, result in results.items() if result.detected
+    ]
+    if not floors:
+        return 0.0
+    missing = detectors - len(floors)
+    return (sum(floors) + missing * MIN_DETECTED_CONFIDENCE) / detectors
+
+
+class TextStreamAnalysis:
+    """
+    Text analysis over a body that arrives in chunks (see StreamScanner). Reading can
+    stop as soon as the verdict is guaranteed to stay UNSAFE whatever the rest says.
+    Picklable, so each window can be scanned by an executor job (feed_text_stream).
+    """
+
+    def __init__(self, content_type: str = "email", overlap: int = 1024, chunk_size: int = 64 * 1024):
+        self.content_type = content_type
+        self.scanner = scan_engine.stream(overlap=overlap, chunk_size=chunk_size)
+        self.terminated_early = False
+
+    def feed(self, text: str) -> bool:
+        """Add decoded text; returns True once the remaining input cannot change the label"""
+        step = self.scanner.chunk_size
+        for start in range(0, len(text), step):
+            if self.terminated_early:
+                break
+            with timed("scan"):
+                scanned = self.scanner.feed(text[start:start + step])
+            if scanned:
+                results = _score_text_results(self.scanner.result(), self.content_type)
+                _, label = map_confidence_to_score_and_label(lowest_possible_confidence(results))
+                self.terminated_early = label == "UNSAFE"
+        return self.terminated_early
+
+    def verdict(self) -> Dict:
+        with timed("scan"):
+            scan = self.scanner.result() if self.terminated_early else self.scanner.finish()
+        return build_verdict(*score_text_scan(scan, self.content_type))
+
+
+def feed_text_stream(analysis: TextStreamAnalysis, text: str) -> TextStreamAnalysis:
+    """Scan the windows ``text`` completes; returns the analysis (a copy in process workers)"""
+    analysis.feed(text)
+    return analysis
+
+
+def finish_text_stream(analysis: TextStreamAnalysis, text: str = "") -> Tuple[Dict, bool]:
+    """Scan the rest of the body; returns the verdict and whether reading stopped early"""
+    analysis.feed(text)
+    return analysis.verdict(), analysis.terminated_early
+
+
+def analyze_text_batch(items: List[Tuple[str, str]]) -> List[Dict]:
+    """
+    Run the text detectors over a batch of (content, content_type) pairs in one job.
+    Each outcome is {"result": verdict} or {"error": message}; one bad item never
+    fails the rest of the batch.
+    """
+    outcomes = []
+    for content, content_type in items:
+        try:
+            outcomes.append({"result": analyze_text_content(content, content_type)})
+        except Exception as e:
+            logger.error(f"Error analyzing batch item: {str(e)}")
+            outcomes.append({"error": "Analysis failed"})
+    return outcomes
+
+
+def url_risks(url: str, context: str = "unknown") -> Tuple[List[str], Dict[str, float]]:
+    """detected_risks/risk_scores of the URL and malware detectors for one URL"""
+    detected_risks = []
+    risk_scores = {}
+
+    # Analyze URL
+    with timed("url"):
+        url_analysis = url_analyzer.evaluate(url, context)
+
+    if url_analysis.detected:
+        detected_risks.append("Suspicious URL")
+        risk_scores["url_suspicious"] = url_analysis.confidence
+
+    if url_analysis.indicators:
+        detected_risks.append("Phishing URL indicators")
+        risk_scores["url_phishing"] = url_analysis.score("phishing")
+
+    with timed("malware"):
+        malware = malware_detector.evaluate_url(url)
+    if malware.detected:
+        detected_risks.append("Potential malware source")
+        risk_scores["malware"] = malware.confidence
+
+    return detected_risks, risk_scores
+
+
+def analyze_url_target(url: str, context: str = "unknown") -> Dict:
+    """Run the URL and malware detectors over one URL"""
+    return build_verdict(*url_risks(url, context))
+
+
+def analyze_attachment(filename: str, sha256: str, head: bytes, path: str) -> Dict:
+    """
+    Run the malware detector over an uploaded file: its name, its type sniffed from the
+    leading bytes (see detectors/file_type.py), its SHA-256 against the reputation index
+    and its content (spooled at ``path``) against the byte signatures
+    """
+    detected_risks = []
+    risk_scores = {}
+
+    with timed("reputation"):
+        known = malware_detector.evaluate_file_hash(sha256)
+    if known.detected:
+        detected_risks.append("Known malware attachment")
+        risk_scores["file_hash"] = known.confidence
+
+    with timed("file_type"):
+        file_type = sniff(head)
+        disguise = malware_detector.evaluate_file_type(filename, file_type)
+    if disguise.detected:
+        detected_risks.append("Disguised attachment")
+        risk_scores["file_type"] = disguise.confidence
+
+    with timed("signatures"):
+        content = malware_detector.detect_file(path, file_type.name if file_type else None)
+    if content.detected:
+        detected_risks.append("Malicious file content")
+        risk_scores["signatures"] = content.confidence
+
+    with timed("filename"):
+        name = malware_detector.evaluate_attachment(filename)
+    if name.detected:
+        detected_risks.append("Suspicious attachment")
+        risk_scores["filename"] = name.confidence
+
+    verdict = build_verdict(detected_risks, risk_scores)
+    verdict["detected_type"] = file_type.name if file_type else None
+    verdict["signatures"] = [
+        {"rule": rule, "string": string, "offset": offset} for rule, string, offset in content.detail("signatures", ())
+    ]
+    return verdict
+
+
+_DEFAULT_PORTS = {"http": ":80", "https": ":443"}
+
+
+def extract_links(content: str) -> List[ExtractedLink]:
+    """Distinct links in a message (defanged and bare forms included), first appearance first"""
+    with timed("links"):
+        return link_extractor.extract(content)
+
+
+def canonical_url(url: str) -> str:
+    """
+    Form under which equivalent URLs are analyzed once in a batch: surrounding whitespace,
+    the fragment (never sent to the server), default ports and a trailing dot on the host
+    dropped; scheme and host lowercased
+    """
+    url = url.strip().split("#", 1)[0]
+    scheme, separator, rest = url.partition("://")
+    if not separator:
+        return url
+    scheme = scheme.lower()
+    netloc, slash, remainder = rest.partition("/")
+    credentials, at, hostport = netloc.rpartition("@")
+    hostport = hostport.lower()
+    default_port = _DEFAULT_PORTS.get(scheme)
+    if default_port and hostport.endswith(default_port):
+        hostport = hostport[:-len(default_port)]
+    if not hostport.startswith("["):
+        host, colon, port = hostport.partition(":")
+        hostport = host.rstrip(".") + colon + port
+    return f"{scheme}://{credentials}{at}{hostport}{slash}{remainder}"
+
+
+def analyze_url_batch(items: List[Tuple[str, str]]) -> List[Dict]:
+    """
+    Run the URL and malware detectors over a batch of (url, context) pairs in one job.
+    Same outcome shape as analyze_text_batch; callers group URLs of one host into the
+    same job so its host-level features are computed once and then served from cache.
+    """
+    outcomes = []
+    for url, context in items:
+        try:
+            outcomes.append({"result": analyze_url_target(url, context)})
+        except Exception as e:
+            logger.error(f"Error analyzing batch URL: {str(e)}")
+            outcomes.append({"error": "Analysis failed"})
+    return outcomes
+
+
+# QR detector rules -> detected_risks entry
+_QR_RISKS = {
+    "qr.ussd_code": "Dangerous phone code",
+    "qr.premium_number": "Premium-rate number",
+    "qr.sms_short_code": "Premium-rate number",
+    "qr.insecure_wifi": "Insecure Wi-Fi network",
+    "qr.hidden_wifi": "Insecure Wi-Fi network",
+}
+
+
+def _merge(detected_risks: List[str], risk_scores: Dict[str, float],
+           more_risks: List[str], more_scores: Dict[str, float]) -> None:
+    """Add one target's risks to a verdict's: each risk once, each score at its highest"""
+    for risk in more_risks:
+        if risk not in detected_risks:
+            detected_risks.append(risk)
+    for name, score in more_scores.items():
+        risk_scores[name] = max(risk_scores.get(name, 0.0), score)
+
+
+def analyze_qr_payload(data: str, context: str = "unknown") -> Dict:
+    """
+    Run the detectors over the text of a QR code (see detectors/qr_payload.py): the QR
+    detector over what the code dials, texts or joins, the text detectors over its message
+    body or note, and the URL and malware detectors over its links, including links in that
+    text. A plain URL code gets the same verdict as the URL on its own.
+    """
+    detected_risks: List[str] = []
+    risk_scores: Dict[str, float] = {}
+
+    with timed("qr"):
+        payload = parse_qr_payload(data)
+        qr = qr_detector.evaluate(payload)
+    if qr.detected:
+        _merge(detected_risks, risk_scores, [_QR_RISKS[rule] for rule in qr.matched_rules],
+               {qr_detector.name: qr.confidence})
+
+    urls = list(payload.urls)
+    if payload.text:
+        _merge(detected_risks, risk_scores, *text_risks(payload.text, payload.content_type))
+        with timed("links"):
+            urls += [link.url for link in link_extractor.extract(payload.text)]
+    urls = list(dict.fromkeys(urls))[:link_extractor.max_links]
+    for url in urls:
+        _merge(detected_risks, risk_scores, *url_risks(url, context))
+
+    verdict = build_verdict(detected_risks, risk_scores)
+    verdict.update(
+        payload_type=payload.kind,
+        urls=urls,
+        phone_numbers=list(payload.phones),
+        email_addresses=list(payload.emails),
+    )
+    return verdict
+
+
+def analyze_qr_batch(items: List[Tuple[str, str]]) -> List[Dict]:
+    """Run analyze_qr_payload over a batch of (qr_data, context) pairs in one job (same outcome shape)"""
+    outcomes = []
+    for data, context in items:
+        try:
+            outcomes.append({"result": analyze_qr_payload(data, context)})
+        except Exception as e:
+            logger.error(f"Error analyzing batch QR code: {str(e)}")
+            outcomes.append({"error": "Analysis failed"})
+    return outcomes
+
+
+def warm_up() -> None:
+    """Compile the scan engine ahead of the first request (also the process-pool initializer)"""
+    scan_engine.compile()
+    analyze_text_content("warm up")
+    analyze_url_target("https://example.com")
@@ -0,0 +1,309 @@
+"""
+Profiling module - call stacks of single requests, written as folded stacks
+("frame;frame;frame microseconds" per line) that flamegraph.pl, inferno and speedscope
+read directly.
+
+Two triggers, both off by default:
+- on demand: a request carrying ``X-Profile-Key: <PROFILE_ADMIN_KEY>`` is profiled and
+  its response names the file in an ``X-Profile`` header;
+- sampled: PROFILE_SAMPLE_RATE of all requests run under the profiler and the ones
+  slower than PROFILE_SLOW_MS are kept.
+
+The profiler is deterministic (sys.setprofile), not sampling: a verdict takes a few
+milliseconds, too short for a sampler to see. sys.setprofile is per thread, so a
+request is followed onto the worker that runs its detection job (thread or process,
+see executor.py) and that job's stacks come back with its result. On the event loop
+the profile function stays installed while any request is profiled, and only events
+of the profiled request's context are counted - the other requests of the process run
+slower meanwhile, but do not show up in its profile.
+
+Frames are labelled ``module:qualified name``, so each detector's methods are their
+own frames, e.g. ``detectors.phishing_detector:PhishingDetector.evaluate`` (before Python
+3.11, which has no qualified names on code objects, just ``module:function``).
+"""
+
+import contextvars
+import hmac
+import itertools
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Root frame of the stacks a detection job adds to the request's profile
+WORKER_FRAME = "[detection worker]"
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    # co_qualname (Class.method) is Python 3.11+; older versions only have the bare name
+    return f"{frame.f_globals.get('__name__', '?')}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def _builtin_label(fn) -> str:
+    owner = getattr(fn, "__self__", None)
+    module = getattr(fn, "__module__", None) or (type(owner).__module__ if owner is not None else "builtins")
+    return f"{module}:{getattr(fn, '__qualname__', getattr(fn, '__name__', '?'))}"
+
+
+class StackTracer:
+    """
+    sys.setprofile function adding up the seconds spent in each distinct call stack of
+    one thread. Stacks are cut at ``root`` (the frame profiling started in) when they
+    pass through it; the tracer's own time between events is left out.
+    """
+
+    def __init__(self, root=None):
+        self.root = root
+        self.stacks: Dict[str, float] = {}
+        self._paths: Dict[tuple, str] = {}  # (frame, caller) -> folded stack
+        self._current: Optional[str] = None
+        self._since = 0.0
+
+    def _path(self, frame) -> str:
+        caller = frame.f_back
+        key = (frame, caller)  # a resumed coroutine can have another caller
+        path = self._paths.get(key)
+        if path is None:
+            if frame is self.root or caller is None:
+                path = _frame_label(frame)
+            else:
+                path = f"{self._path(caller)};{_frame_label(frame)}"
+            self._paths[key] = path
+        return path
+
+    def __call__(self, frame, event: str, arg) -> None:
+        now = time.perf_counter()
+        if self._current is not None:
+            self.stacks[self._current] = self.stacks.get(self._current, 0.0) + now - self._since
+        if event == "c_call":
+            self._current = f"{self._path(frame)};{_builtin_label(arg)}"
+        elif event == "return":
+            caller = frame.f_back
+            self._current = None if frame is self.root or caller is None else self._path(caller)
+        else:  # call, c_return, c_exception
+            self._current = self._path(frame)
+        self._since = time.perf_counter()
+
+    def pause(self) -> None:
+        """Stop the clock until the next event (another request's code runs meanwhile)"""
+        if self._current is not None:
+            self.stacks[self._current] = self.stacks.get(self._current, 0.0) + time.perf_counter() - self._since
+            self._current = None
+
+
+class RequestProfile:
+    """Stacks of one request: its code on the event loop plus its detection jobs"""
+
+    def __init__(self, trigger: str, root=None):
+        self.trigger = trigger  # requested or sampled
+        self.tracer = StackTracer(root)
+
+    def add_job(self, stacks: Dict[str, float]) -> None:
+        for path, seconds in stacks.items():
+            key = f"{WORKER_FRAME};{path}"
+            self.tracer.stacks[key] = self.tracer.stacks.get(key, 0.0) + seconds
+
+    def folded(self) -> str:
+        """One "stack microseconds" line per stack, the input format of flamegraph tools"""
+        lines = []
+        for path, seconds in sorted(self.tracer.stacks.items()):
+            micros = round(seconds * 1_000_000)
+            if micros:
+                lines.append(f"{path} {micros}")
+        return "\n".join(lines) + "\n"
+
+
+_active: contextvars.ContextVar[Optional[RequestProfile]] = contextvars.ContextVar("request_profile", default=None)
+
+
+def active() -> bool:
+    """Whether the current request is being profiled (so its detection jobs should be)"""
+    return _active.get() is not None
+
+
+def profile_call(fn: Callable, args: Tuple) -> Tuple[object, Dict[str, float]]:
+    """Run ``fn(*args)`` under a tracer in this thread; returns the result and its stacks"""
+    tracer = StackTracer(root=sys._getframe())
+    previous = sys.getprofile()
+    sys.setprofile(tracer)
+    try:
+        result = fn(*args)
+    finally:
+        sys.setprofile(previous)
+        tracer.pause()
+    return result, tracer.stacks
+
+
+def add_job_stacks(stacks: Dict[str, float]) -> None:
+    """Add the stacks of a detection job (from profile_call on a worker) to the current request"""
+    profile = _active.get()
+    if profile is not None and stacks:
+        profile.add_job(stacks)
+
+
+class _LoopProfiling:
+    """
+    Profile function of the event loop thread while any request is profiled: forwards
+    each event to the tracer of the request whose context it happens in, and pauses a
+    tracer whenever other code takes over the loop.
+    """
+
+    def __init__(self):
+        self.profiles = 0
+        self.last: Optional[StackTracer] = None
+        self.previous = None
+
+    def __call__(self, frame, event: str, arg) -> None:
+        profile = _active.get()
+        tracer = profile.tracer if profile is not None else None
+        if tracer is not self.last:
+            if self.last is not None:
+                self.last.pause()
+            self.last = tracer
+        if tracer is not None:
+            tracer(frame, event, arg)
+
+    def start(self) -> None:
+        if self.profiles == 0:
+            self.previous = sys.getprofile()
+            sys.setprofile(self)
+        self.profiles += 1
+
+    def stop(self, profile: RequestProfile) -> None:
+        profile.tracer.pause()
+        if self.last is profile.tracer:
+            self.last = None
+        self.profiles -= 1
+        if self.profiles == 0:
+            sys.setprofile(self.previous)
+            self.previous = None
+
+
+_loop_profiling = _LoopProfiling()
+
+
+class RequestProfiler:
+    """
+    Decides which requests are profiled and writes their profiles to ``directory``,
+    keeping the newest ``keep`` files (the directory may be shared by several workers).
+    """
+
+    def __init__(self, directory: str, admin_key: str = "", sample_rate: float = 0.0,
+                 slow_seconds: float = 0.5, keep: int = 50):
+        self.directory = directory
+        self.admin_key = admin_key.encode("utf-8")
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.keep = keep
+        self._sequence = itertools.count(1)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.admin_key) or self.sample_rate > 0
+
+    def trigger(self, scope) -> Optional[str]:
+        """requested (valid X-Profile-Key), sampled, or None when the request is not profiled"""
+        if self.admin_key:
+            for name, value in scope.get("headers", ()):
+                if name == b"x-profile-key":
+                    if hmac.compare_digest(value, self.admin_key):
+                        return "requested"
+                    logger.warning("Ignoring X-Profile-Key header with an invalid key")
+                    break
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return "sampled"
+        return None
+
+    def file_name(self, scope, trigger: str) -> str:
+        route = re.sub(r"[^A-Za-z0-9]+", "_", scope.get("path", "")).strip("_")[:60] or "root"
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime())
+        return f"{stamp}-{os.getpid()}-{next(self._sequence)}-{trigger}-{route}.folded"
+
+    def write(self, name: str, profile: RequestProfile) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(profile.folded())
+        self._rotate()
+        return path
+
+    def _rotate(self) -> None:
+        """Delete the oldest profiles beyond ``keep``"""
+        try:
+            entries = [entry for entry in os.scandir(self.directory)
+                       if entry.name.endswith(".folded") and entry.is_file()]
+            entries.sort(key=lambda entry: entry.stat().st_mtime)
+            for entry in entries[:max(0, len(entries) - self.keep)]:
+                os.remove(entry.path)
+        except OSError as e:  # another worker may be rotating at the same time
+            logger.debug(f"Profile rotation in {self.directory} skipped: {e}")
+
+
+def create_profiler_from_env() -> RequestProfiler:
+    """
+    Build the request profiler from environment variables:
+    PROFILE_ADMIN_KEY (key of the X-Profile-Key header, empty = no on-demand profiling),
+    PROFILE_SAMPLE_RATE (fraction of requests profiled, default 0),
+    PROFILE_SLOW_MS (sampled profiles faster than this are discarded, default 500),
+    PROFILE_DIR (where profiles are written, default a directory in the temp dir),
+    PROFILE_KEEP (number of newest profiles kept, default 50).
+    """
+    return RequestProfiler(
+        directory=os.getenv("PROFILE_DIR", "").strip()
+        or os.path.join(tempfile.gettempdir(), "digital-hygiene-companion-profiles"),
+        admin_key=os.getenv("PROFILE_ADMIN_KEY", "").strip(),
+        sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "0")),
+        slow_seconds=float(os.getenv("PROFILE_SLOW_MS", "500")) / 1000,
+        keep=int(os.getenv("PROFILE_KEEP", "50")),
+    )
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling the requests picked by ``profiler`` (see the module
+    docstring). Requested profiles are always written; sampled ones only when the
+    request took at least the profiler's slow threshold.
+    """
+
+    def __init__(self, app, profiler: RequestProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.enabled:
+            await self.app(scope, receive, send)
+            return
+        trigger = self.profiler.trigger(scope)
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+        name = self.profiler.file_name(scope, trigger)
+
+        async def send_with_profile(message):
+            if message["type"] == "http.response.start" and trigger == "requested":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile", name.encode("latin-1"))]
+            await send(message)
+
+        profile = RequestProfile(trigger, root=sys._getframe())
+        token = _active.set(profile)
+        started = time.perf_counter()
+        _loop_profiling.start()
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            _loop_profiling.stop(profile)
+            _active.reset(token)
+            seconds = time.perf_counter() - started
+            if trigger == "requested" or seconds >= self.profiler.slow_seconds:
+                try:
+                    path = self.profiler.write(name, profile)
+                    logger.info(f"Wrote {trigger} profile of {scope.get('path')} ({seconds * 1000:.0f} ms) to {path}")
+                except OSError as e:
+                    logger.error(f"Could not write profile {name}: {e}")
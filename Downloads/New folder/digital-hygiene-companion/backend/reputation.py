@@ -0,0 +1,403 @@
+"""
+Local reputation index - offline blocklists of malicious hosts, URL prefixes and file
+hashes, compiled into one memory-mapped file.
+
+File layout (all integers little-endian, sections 8-byte aligned):
+
+    header   magic, version, Bloom hash count, Bloom size in bits, Bloom offset,
+             then (offset, count) for the host, URL-prefix and file-hash sections
+             and a 16-byte build id
+    bloom    Bloom filter over every entry (about 1% false positives at 10 bits/entry)
+    sections sorted 64-bit fingerprints, one array per entry kind
+
+Only fingerprints (the first 8 bytes of a BLAKE2b digest) are stored, never the raw
+entries. The file is opened read-only with mmap, so every worker process shares the
+same pages. A lookup checks the Bloom filter first; only on a Bloom hit does it binary
+search the section.
+
+Build an index from text feeds (one entry per line, '#' comments, hosts-file lines
+like "0.0.0.0 evil.example" are accepted):
+
+    python reputation.py --hosts hosts.txt --urls url_prefixes.txt --hashes sha256.txt \
+        -o reputation.idx
+
+The tool writes to a temporary file next to the output and renames it into place, so
+a running server (REPUTATION_INDEX_PATH) picks up the new index atomically. Building
+needs NumPy and about 16 bytes of memory per distinct entry; lookups need neither.
+"""
+
+import argparse
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"DHCREP\x00\x01"
+FORMAT_VERSION = 1
+KINDS = ("host", "url", "hash")
+_HEADER = struct.Struct("<8sIIQQ" + "QQ" * len(KINDS) + "16s")
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def _digest(kind: str, value: str) -> Tuple[int, int]:
+    """(fingerprint, second hash) of one entry; the kind keeps the namespaces apart"""
+    digest = hashlib.blake2b(f"{kind}\0{value}".encode("utf-8"), digest_size=16).digest()
+    return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+
+
+def _bloom_positions(fingerprint: int, second: int, hashes: int, bits: int) -> Iterator[int]:
+    """Double hashing: position i is (h1 + i * h2) mod m"""
+    for i in range(hashes):
+        yield (fingerprint + i * second) % bits
+
+
+def normalize_host(host: str) -> str:
+    """Lowercase host without credentials, port or trailing dot"""
+    host = host.strip().lower()
+    if "@" in host:
+        host = host.rsplit("@", 1)[1]
+    if host.startswith("["):  # IPv6 literal
+        return host.split("]", 1)[0] + "]"
+    return host.split(":", 1)[0].rstrip(".")
+
+
+def host_candidates(host: str) -> List[str]:
+    """The host and each parent domain with at least two labels (a.b.evil.tk -> ..., evil.tk)"""
+    host = normalize_host(host)
+    labels = host.split(".")
+    if len(labels) < 2 or host.startswith("["):
+        return [host] if host else []
+    return [".".join(labels[i:]) for i in range(len(labels) - 1)]
+
+
+def normalize_url(url: str) -> str:
+    """host/path form used for URL-prefix entries: no scheme, credentials, port, query,
+    fragment or trailing slash"""
+    if "://" not in url:
+        url = "http://" + url
+    parts = urlsplit(url.strip())
+    return normalize_host(parts.netloc) + parts.path.lower().rstrip("/")
+
+
+def url_prefix_candidates(url: str) -> List[str]:
+    """Every path-segment prefix of the normalized URL, longest first (down to the bare host)"""
+    normalized = normalize_url(url)
+    candidates = [normalized]
+    position = normalized.rfind("/")
+    while position != -1:
+        normalized = normalized[:position]
+        candidates.append(normalized)
+        position = normalized.rfind("/")
+    return candidates
+
+
+def _normalize_entry(kind: str, entry: str) -> Optional[str]:
+    if kind == "host":
+        return normalize_host(entry) or None
+    if kind == "url":
+        return normalize_url(entry)
+    entry = entry.strip().lower()
+    return entry if entry and all(c in "0123456789abcdef" for c in entry) else None
+
+
+def read_feed(path: str) -> Iterator[str]:
+    """Entries of a text feed: one per line, '#' comments, last field of hosts-file lines"""
+    with open(path, "r", encoding="utf-8", errors="replace") as handle:
+        for line in handle:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                yield line.split()[-1]
+
+
+# Entries fingerprinted before a batch is deduplicated into NumPy arrays
+_BUILD_BATCH = 1 << 20
+
+
+def _fingerprint_batches(kind: str, entries: Iterable[str]) -> Iterator[Tuple[array, array]]:
+    """(fingerprints, second hashes) of the feed's valid entries, in batches of _BUILD_BATCH"""
+    fingerprints, seconds = array("Q"), array("Q")
+    for entry in entries:
+        value = _normalize_entry(kind, entry)
+        if value is None:
+            continue
+        fingerprint, second = _digest(kind, value)
+        fingerprints.append(fingerprint)
+        seconds.append(second)
+        if len(fingerprints) >= _BUILD_BATCH:
+            yield fingerprints, seconds
+            fingerprints, seconds = array("Q"), array("Q")
+    if fingerprints:
+        yield fingerprints, seconds
+
+
+def _unique_fingerprints(kind: str, entries: Iterable[str]):
+    """
+    Sorted distinct fingerprints of one kind and the second hash of each (that of its
+    first entry), as uint64 arrays: 16 bytes per distinct entry (a few times that while
+    the batches are merged), so feeds of tens of millions of entries fit in memory.
+    """
+    import numpy as np  # only the build tool needs NumPy
+
+    fingerprints, seconds = [], []
+    for batch, batch_seconds in _fingerprint_batches(kind, entries):
+        unique, first = np.unique(np.frombuffer(batch, dtype=np.uint64), return_index=True)
+        fingerprints.append(unique)
+        seconds.append(np.frombuffer(batch_seconds, dtype=np.uint64)[first])
+    if not fingerprints:
+        return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.uint64)
+    if len(fingerprints) == 1:
+        return fingerprints[0], seconds[0]
+    merged, first = np.unique(np.concatenate(fingerprints), return_index=True)
+    return merged, np.concatenate(seconds)[first]
+
+
+def _bloom_filter(sections, hashes: int, bits: int):
+    """Bloom filter bytes over every (fingerprints, second hashes) pair of arrays"""
+    import numpy as np
+
+    modulus = np.uint64(bits)
+    bloom = np.zeros((bits + 7) // 8, dtype=np.uint8)
+    for fingerprints, seconds in sections:
+        for low in range(0, len(fingerprints), _BUILD_BATCH):
+            # (h1 + i * h2) mod m of _bloom_positions, reduced first so uint64 cannot overflow
+            start = fingerprints[low:low + _BUILD_BATCH] % modulus
+            step = seconds[low:low + _BUILD_BATCH] % modulus
+            for i in range(hashes):
+                positions = (start + np.uint64(i) * step) % modulus
+                np.bitwise_or.at(bloom, positions >> np.uint64(3),
+                                 np.left_shift(np.uint8(1), (positions & np.uint64(7)).astype(np.uint8)))
+    return bloom
+
+
+def build_index(output: str, feeds: Dict[str, Iterable[str]], bits_per_entry: int = 10,
+                hashes: int = 7) -> Dict[str, int]:
+    """
+    Compile entries ({kind: iterable of raw entries}) into an index file. The file is
+    written next to ``output`` and renamed over it, so readers never see a partial
+    index. Returns the number of distinct entries per kind.
+    """
+    sections = {kind: _unique_fingerprints(kind, feeds.get(kind, ())) for kind in KINDS}
+
+    total = sum(len(fingerprints) for fingerprints, _ in sections.values())
+    bits = max(64, total * bits_per_entry)
+    bloom = _bloom_filter(sections.values(), hashes, bits)
+
+    bloom_offset = _align(_HEADER.size)
+    offset = _align(bloom_offset + len(bloom))
+    layout = []
+    build_id = hashlib.blake2b(digest_size=16)
+    for kind in KINDS:
+        fingerprints = sections[kind][0].astype("<u8", copy=False)
+        layout += [offset, len(fingerprints)]
+        offset = _align(offset + len(fingerprints) * 8)
+        build_id.update(fingerprints)
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, hashes, bits, bloom_offset, *layout, build_id.digest())
+
+    directory = os.path.dirname(os.path.abspath(output))
+    fd, temporary = tempfile.mkstemp(prefix=".reputation-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as handle:
+            handle.write(header)
+            handle.seek(bloom_offset)
+            handle.write(bloom.data)
+            for index, kind in enumerate(KINDS):
+                handle.seek(layout[index * 2])
+                handle.write(sections[kind][0].astype("<u8", copy=False).data)
+            handle.truncate(offset)
+            handle.flush()
+            os.fsync(handle.fileno())
+        # mkstemp creates 0600; workers may run as another user (os.fchmod is POSIX-only
+        # before Python 3.13, chmod by path works everywhere)
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, output)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.unlink(temporary)
+        raise
+    return {kind: len(sections[kind][0]) for kind in KINDS}
+
+
+class ReputationIndex:
+    """One opened index file (read-only, memory-mapped)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as handle:
+            self.stat = os.fstat(handle.fileno())
+            self._map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        fields = _HEADER.unpack_from(self._map, 0)
+        magic, version, self.hashes, self.bits, bloom_offset = fields[:5]
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a reputation index (version {FORMAT_VERSION})")
+        if sys.byteorder != "little":
+            raise ValueError("Reputation index lookups need a little-endian platform")
+        self.build_id = fields[-1].hex()
+        view = memoryview(self._map)
+        self._bloom = view[bloom_offset:bloom_offset + (self.bits + 7) // 8]
+        self._sections = {}
+        for index, kind in enumerate(KINDS):
+            offset, count = fields[5 + index * 2], fields[6 + index * 2]
+            self._sections[kind] = view[offset:offset + count * 8].cast("Q")
+
+    def counts(self) -> Dict[str, int]:
+        return {kind: len(section) for kind, section in self._sections.items()}
+
+    def contains(self, kind: str, value: str) -> Tuple[bool, bool]:
+        """(maybe, present): maybe is the Bloom answer, present the exact fingerprint check"""
+        fingerprint, second = _digest(kind, value)
+        bloom = self._bloom
+        for position in _bloom_positions(fingerprint, second, self.hashes, self.bits):
+            if not bloom[position >> 3] & (1 << (position & 7)):
+                return False, False
+        section = self._sections[kind]
+        position = bisect_left(section, fingerprint)
+        return True, position < len(section) and section[position] == fingerprint
+
+
+class ReputationStore:
+    """
+    The index currently in use. Every ``check_interval`` seconds a lookup stats the
+    file; when the build tool has renamed a new index into place it is opened and
+    swapped in. Lookups already running keep the old mapping until they finish.
+    """
+
+    def __init__(self, path: str = "", check_interval: float = 5.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._index: Optional[ReputationIndex] = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self._stats = {"lookups": 0, "bloom_rejects": 0, "bloom_false_positives": 0, "hits": 0, "reloads": 0}
+        if path:
+            self.reload()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    @property
+    def version(self) -> str:
+        """Build id of the loaded index ("none" without one); part of URL verdict cache keys"""
+        index = self._current()
+        return index.build_id if index else "none"
+
+    def reload(self) -> bool:
+        """Open the index file if it changed on disk; returns True when a new index was loaded"""
+        with self._lock:
+            self._next_check = time.monotonic() + self.check_interval
+            try:
+                stat = os.stat(self.path)
+            except OSError:
+                if self._index is None:
+                    logger.warning(f"Reputation index {self.path} not found; reputation checks disabled")
+                return False
+            current = self._index
+            if current and (current.stat.st_ino, current.stat.st_mtime_ns, current.stat.st_size) == \
+                    (stat.st_ino, stat.st_mtime_ns, stat.st_size):
+                return False
+            try:
+                self._index = ReputationIndex(self.path)
+            except (OSError, ValueError) as e:
+                logger.error(f"Could not load reputation index {self.path}: {str(e)}")
+                return False
+            self._stats["reloads"] += 1
+            logger.info(f"Reputation index loaded: {self._index.counts()} build={self._index.build_id}")
+            return True
+
+    def _current(self) -> Optional[ReputationIndex]:
+        if self.path and time.monotonic() >= self._next_check:
+            self.reload()
+        return self._index
+
+    def _lookup(self, kind: str, candidates: List[str]) -> Optional[str]:
+        index = self._current()
+        if index is None:
+            return None
+        self._stats["lookups"] += 1
+        for candidate in candidates:
+            maybe, present = index.contains(kind, candidate)
+            if present:
+                self._stats["hits"] += 1
+                return candidate
+            if maybe:
+                self._stats["bloom_false_positives"] += 1
+            else:
+                self._stats["bloom_rejects"] += 1
+        return None
+
+    def lookup_host(self, host: str) -> Optional[str]:
+        """Listed entry matching the host or one of its parent domains, if any"""
+        return self._lookup("host", host_candidates(host))
+
+    def lookup_url(self, url: str) -> Optional[str]:
+        """Listed URL prefix covering the URL, if any"""
+        return self._lookup("url", url_prefix_candidates(url))
+
+    def lookup_hash(self, digest: str) -> bool:
+        """True if the file hash (hex) is listed"""
+        return self._lookup("hash", [digest.strip().lower()]) is not None
+
+    def stats(self) -> Dict[str, Any]:
+        index = self._index
+        snapshot: Dict[str, Any] = dict(self._stats)
+        snapshot.update(
+            enabled=self.enabled,
+            path=self.path,
+            version=index.build_id if index else "none",
+            entries=index.counts() if index else {},
+        )
+        return snapshot
+
+
+def create_reputation_store_from_env() -> ReputationStore:
+    """
+    Build the reputation store from environment variables:
+    REPUTATION_INDEX_PATH (index file built by this module; empty disables reputation checks),
+    REPUTATION_CHECK_INTERVAL (seconds between checks for a swapped index, default 5).
+    """
+    return ReputationStore(
+        os.getenv("REPUTATION_INDEX_PATH", "").strip(),
+        check_interval=float(os.getenv("REPUTATION_CHECK_INTERVAL", "5")),
+    )
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Compile text feeds into a reputation index")
+    parser.add_argument("--hosts", action="append", default=[], help="feed of malicious hosts/domains")
+    parser.add_argument("--urls", action="append", default=[], help="feed of malicious URL prefixes")
+    parser.add_argument("--hashes", action="append", default=[], help="feed of malicious file hashes (hex)")
+    parser.add_argument("--bits-per-entry", type=int, default=10, help="Bloom filter size (10 = ~1%% false positives)")
+    parser.add_argument("-o", "--output", required=True, help="index file to write (replaced atomically)")
+    args = parser.parse_args(argv)
+
+    def entries(paths: List[str]) -> Iterator[str]:
+        for path in paths:
+            yield from read_feed(path)
+
+    started = time.perf_counter()
+    counts = build_index(args.output, {
+        "host": entries(args.hosts),
+        "url": entries(args.urls),
+        "hash": entries(args.hashes),
+    }, bits_per_entry=args.bits_per_entry)
+    print(f"Wrote {args.output}: {counts} in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,321 @@
+"""
+Shared state - small integer records (rate limit windows, aggregated counters) that can
+be shared by every worker process of the server.
+
+``uvicorn --workers N`` runs N processes that each import the app. With LocalState (the
+default) every process keeps its own records, which is exact for a single worker. With
+MmapState the records live in a file that every worker maps into memory - put it on
+/dev/shm so it never touches the disk. The file is a fixed array of fixed-width slots
+addressed by a 64-bit hash of the key (open addressing, linear probing), and every
+read-modify-write happens under an exclusive flock on the file, so the workers see one
+consistent table.
+
+A file is never truncated once it has been sized: another worker may have it mapped, and
+shrinking it under that mapping crashes the worker (SIGBUS). The file name carries the
+format version and layout, so workers started with other settings (or a new release
+during a rolling restart) get their own table, and a file that still does not match is
+refused with an error.
+"""
+
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: only LocalState is available
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class SharedStateFull(RuntimeError):
+    """No free slot is left for a new key"""
+
+
+class LocalState:
+    """Records of this process only: a dict behind a lock"""
+
+    backend = "local"
+
+    def __init__(self, fields: int = 1):
+        self.fields = fields
+        self._records: Dict[str, List[int]] = {}
+        self._lock = threading.RLock()
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        """Hold the state for a read-modify-write of several calls"""
+        with self._lock:
+            yield
+
+    def get(self, key: str) -> Optional[List[int]]:
+        with self._lock:
+            values = self._records.get(key)
+            return list(values) if values is not None else None
+
+    def put(self, key: str, values: List[int]) -> None:
+        with self._lock:
+            self._records[key] = list(values)
+
+    def add(self, key: str, field: int = 0, amount: int = 1) -> int:
+        """Atomically add to one field of a record (created as zeros); returns the new value"""
+        with self._lock:
+            values = self._records.setdefault(key, [0] * self.fields)
+            values[field] += amount
+            return values[field]
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._records.pop(key, None)
+
+    def remove_if(self, predicate: Callable[[List[int]], bool]) -> int:
+        """Delete every record whose values match ``predicate``; returns how many"""
+        with self._lock:
+            removed = [key for key, values in self._records.items() if predicate(values)]
+            for key in removed:
+                del self._records[key]
+            return len(removed)
+
+    def items(self) -> List[Tuple[str, List[int]]]:
+        with self._lock:
+            return [(key, list(values)) for key, values in self._records.items()]
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def stats(self) -> Dict[str, object]:
+        return {"backend": self.backend, "records": len(self._records)}
+
+
+class MmapState:
+    """
+    Records in a memory-mapped file shared by every process that opens the same path.
+
+    Slot layout: key hash (uint64; 0 = empty, 1 = deleted), the key's first KEY_BYTES
+    bytes (for listing only, lookups use the hash) and ``fields`` int64 values. A
+    header holds the layout so processes with other settings start a fresh table.
+    """
+
+    backend = "mmap"
+    FORMAT = 2  # part of the file name from create_shared_state_from_env; bump with the layout
+    KEY_BYTES = 56
+    _HEADER = struct.Struct("<8sIIQQ")  # magic, slots, fields, deleted slots, live records
+    _HEADER_SIZE = 64
+    _MAGIC = b"DHCSTAT2"
+    _EMPTY, _DELETED = 0, 1
+
+    def __init__(self, path: str, slots: int = 65536, fields: int = 1, chunk_slots: int = 4096):
+        if fcntl is None:
+            raise RuntimeError("SHARED_STATE=mmap needs POSIX file locks (fcntl); use local on this platform")
+        self.path = path
+        self.slots = slots
+        self.fields = fields
+        self._slot = struct.Struct(f"<Q{self.KEY_BYTES}s{fields}q")
+        self._size = self._HEADER_SIZE + slots * self._slot.size
+        self.chunk_slots = chunk_slots  # slots scanned per lock hold by remove_if
+        self._lock = threading.RLock()  # flock does not exclude threads sharing the descriptor
+        self._depth = 0
+        self._pid = None
+        self._fd = -1
+        self._map: Optional[mmap.mmap] = None
+
+    def _open(self) -> None:
+        """Map the file in this process (again after a fork: flock must not be shared)"""
+        if self._pid == os.getpid():
+            return
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            size = os.fstat(fd).st_size
+            header = os.pread(fd, self._HEADER.size, 0)
+            if size == 0 or (size == self._size and header == bytes(self._HEADER.size)):
+                # New file (or one whose creator stopped before writing the header): nobody maps it yet
+                os.ftruncate(fd, self._size)
+                os.pwrite(fd, self._HEADER.pack(self._MAGIC, self.slots, self.fields, 0, 0), 0)
+                logger.info(f"Initialized shared state {self.path} ({self.slots} slots)")
+            elif size != self._size or not self._matches(header):
+                raise RuntimeError(
+                    f"Shared state {self.path} has another layout than slots={self.slots}, fields={self.fields} "
+                    f"(file of {size} bytes); it may be in use, so it is not reset. Delete it once no worker "
+                    f"uses it, or point SHARED_STATE_DIR elsewhere"
+                )
+            self._map = mmap.mmap(fd, self._size)
+        except BaseException:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+            raise
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        self._fd = fd
+        self._pid = os.getpid()
+
+    def _matches(self, header: bytes) -> bool:
+        magic, slots, fields, _, _ = self._HEADER.unpack(header)
+        return magic == self._MAGIC and slots == self.slots and fields == self.fields
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        """Hold the table (across processes) for a read-modify-write of several calls"""
+        with self._lock:
+            self._open()
+            if self._depth == 0:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        value = int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+        return value if value > MmapState._DELETED else value + 2
+
+    def _offset(self, slot: int) -> int:
+        return self._HEADER_SIZE + slot * self._slot.size
+
+    def _slot_hash(self, slot: int) -> int:
+        return struct.unpack_from("<Q", self._map, self._offset(slot))[0]
+
+    def _find(self, key_hash: int) -> Tuple[Optional[int], Optional[int]]:
+        """(slot holding the hash or None, first reusable slot on its probe path or None)"""
+        free = None
+        slot = key_hash % self.slots
+        for _ in range(self.slots):
+            found = self._slot_hash(slot)
+            if found == key_hash:
+                return slot, None
+            if found == self._EMPTY:
+                return None, slot if free is None else free
+            if found == self._DELETED and free is None:
+                free = slot
+            slot = (slot + 1) % self.slots
+        return None, free
+
+    def _count(self, deleted: int = 0, live: int = 0) -> Tuple[int, int]:
+        """Adjust the header's deleted slot and live record counts; returns the new ones"""
+        magic, slots, fields, deleted_slots, live_records = self._HEADER.unpack_from(self._map, 0)
+        deleted_slots += deleted
+        live_records += live
+        self._HEADER.pack_into(self._map, 0, magic, slots, fields, deleted_slots, live_records)
+        return deleted_slots, live_records
+
+    def get(self, key: str) -> Optional[List[int]]:
+        with self.locked():
+            slot, _ = self._find(self._hash(key))
+            if slot is None:
+                return None
+            return list(self._slot.unpack_from(self._map, self._offset(slot))[2:])
+
+    def put(self, key: str, values: List[int]) -> None:
+        if len(values) != self.fields:
+            raise ValueError(f"Expected {self.fields} values, got {len(values)}")
+        with self.locked():
+            key_hash = self._hash(key)
+            slot, free = self._find(key_hash)
+            if slot is None:
+                if free is None:
+                    raise SharedStateFull(f"Shared state {self.path} has no free slot ({self.slots} slots)")
+                self._count(deleted=-1 if self._slot_hash(free) == self._DELETED else 0, live=1)
+                slot = free
+            self._slot.pack_into(self._map, self._offset(slot), key_hash,
+                                 key.encode("utf-8")[:self.KEY_BYTES], *values)
+
+    def add(self, key: str, field: int = 0, amount: int = 1) -> int:
+        """Atomically add to one field of a record (created as zeros); returns the new value"""
+        with self.locked():
+            values = self.get(key) or [0] * self.fields
+            values[field] += amount
+            self.put(key, values)
+            return values[field]
+
+    def delete(self, key: str) -> None:
+        with self.locked():
+            slot, _ = self._find(self._hash(key))
+            if slot is None:
+                return
+            self._slot.pack_into(self._map, self._offset(slot), self._DELETED, b"", *([0] * self.fields))
+            if self._count(deleted=1, live=-1)[0] > self.slots // 4:
+                self._compact()
+
+    def remove_if(self, predicate: Callable[[List[int]], bool]) -> int:
+        """
+        Delete every record whose values match ``predicate``; returns how many. The table
+        is locked for ``chunk_slots`` slots at a time (unless the caller holds it), so the
+        other workers wait for one chunk rather than the whole scan.
+        """
+        removed = 0
+        for start in range(0, self.slots, self.chunk_slots):
+            with self.locked():
+                chunk_removed = 0
+                for slot in range(start, min(start + self.chunk_slots, self.slots)):
+                    if self._slot_hash(slot) <= self._DELETED:
+                        continue
+                    record = self._slot.unpack_from(self._map, self._offset(slot))
+                    if predicate(list(record[2:])):
+                        self._slot.pack_into(self._map, self._offset(slot), self._DELETED, b"", *([0] * self.fields))
+                        chunk_removed += 1
+                if chunk_removed:
+                    removed += chunk_removed
+                    if self._count(deleted=chunk_removed, live=-chunk_removed)[0] > self.slots // 4:
+                        # Moves records, possibly into chunks already scanned: they wait for the next sweep
+                        self._compact()
+        return removed
+
+    def _compact(self) -> None:
+        """Rewrite the live records so probe paths are no longer lengthened by deleted slots"""
+        live = []
+        for slot in range(self.slots):
+            record = self._slot.unpack_from(self._map, self._offset(slot))
+            if record[0] > self._DELETED:
+                live.append(record)
+        self._map[self._HEADER_SIZE:] = bytes(self._size - self._HEADER_SIZE)
+        self._count(deleted=-self._HEADER.unpack_from(self._map, 0)[3])
+        for record in live:
+            _, free = self._find(record[0])
+            self._slot.pack_into(self._map, self._offset(free), *record)
+
+    def items(self) -> List[Tuple[str, List[int]]]:
+        """Every live record, keyed by the stored (possibly truncated) key"""
+        with self.locked():
+            records = []
+            for slot in range(self.slots):
+                record = self._slot.unpack_from(self._map, self._offset(slot))
+                if record[0] > self._DELETED:
+                    records.append((record[1].rstrip(b"\0").decode("utf-8", "replace"), list(record[2:])))
+            return records
+
+    def __len__(self) -> int:
+        """Live records, kept in the header so stats() never scans the table"""
+        with self.locked():
+            return self._HEADER.unpack_from(self._map, 0)[4]
+
+    def stats(self) -> Dict[str, object]:
+        return {"backend": self.backend, "path": self.path, "slots": self.slots, "records": len(self)}
+
+
+def create_shared_state_from_env(name: str, fields: int = 1, slots: int = 65536):
+    """
+    Build a shared state from environment variables:
+    SHARED_STATE (local or mmap, default local),
+    SHARED_STATE_DIR (directory of the mmap files, default /dev/shm or the temp dir).
+    Every worker of one deployment must use the same directory; ``name`` picks the file,
+    whose name also carries the table format and layout (see MmapState).
+    """
+    backend = os.getenv("SHARED_STATE", "local").strip().lower()
+    if backend == "local":
+        return LocalState(fields=fields)
+    if backend != "mmap":
+        raise ValueError(f"Unknown SHARED_STATE {backend!r} (expected local or mmap)")
+    default_dir = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    directory = os.getenv("SHARED_STATE_DIR", "").strip() or default_dir
+    file_name = f"digital-hygiene-companion-{name}-v{MmapState.FORMAT}-{slots}x{fields}.state"
+    return MmapState(os.path.join(directory, file_name), slots=slots, fields=fields)
@@ -0,0 +1,32 @@
+"""Hex jump limits of the signature engine: verifying an atom hit stays within a bounded span"""
+
+import time
+
+import pytest
+
+from detectors.signatures import SignatureError, SignatureSet
+
+
+def _rules(hex_string: str) -> SignatureSet:
+    return SignatureSet(f"rule R {{ strings: $a = {{ {hex_string} }} condition: $a }}")
+
+
+@pytest.mark.parametrize("hex_string", ["4D 5A [2000] 50 45", "4D 5A [2-5000] 50 45", "4D 5A [2000-] 50 45",
+                                        "4D 5A [8-2] 50 45"])
+def test_long_or_reversed_jumps_are_rejected(hex_string):
+    with pytest.raises(SignatureError):
+        _rules(hex_string)
+
+
+def test_open_jump_is_capped():
+    rules = _rules("4D 5A [2-] 50 45 00 00")
+    assert rules.find_strings(b"junk MZ" + b"x" * 1000 + b"PE\0\0") == {0: 5}
+    assert rules.find_strings(b"junk MZ" + b"x" * 1100 + b"PE\0\0") == {}
+
+
+def test_repeated_atoms_scan_in_linear_time():
+    rules = _rules("4D 5A [2-] 50 45 00 00")
+    started = time.perf_counter()
+    assert rules.find_strings(b"MZ" * (64 * 1024)) == {}
+    # With an unbounded jump every "MZ" was verified up to the end of the buffer (quadratic)
+    assert time.perf_counter() - started < 10
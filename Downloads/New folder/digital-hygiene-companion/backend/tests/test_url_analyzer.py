@@ -0,0 +1,39 @@
+"""URLAnalyzer host rules whose behaviour is pinned across refactors of the host decomposition"""
+
+import pytest
+
+from detectors.url_analyzer import URLAnalyzer
+
+
+@pytest.fixture(scope="module")
+def analyzer():
+    return URLAnalyzer()
+
+
+@pytest.mark.parametrize("url", [
+    "http://192.168.0.1/login",
+    "http://[2001:db8::1]:8080/",
+    "http://user@10.0.0.7/",
+    # IP-looking prefixes disguise the real registrable domain
+    "http://1.2.3.4.evil.com/",
+    "https://10.0.0.1.secure-login.tk/verify",
+    "http://999.1.1.1/",
+])
+def test_ip_hosts_are_flagged(analyzer, url):
+    result = analyzer.evaluate(url)
+    assert "url.ip_address" in result.matched_rules
+    assert result.detail("analysis_details")["uses_ip"]
+
+
+@pytest.mark.parametrize("url", [
+    "http://1.2.3.example.com/",
+    "http://example.com/1.2.3.4",
+    "http://v1.2.3.4.example.com/",
+])
+def test_other_numeric_hosts_are_not_flagged(analyzer, url):
+    assert "url.ip_address" not in analyzer.evaluate(url).matched_rules
+
+
+def test_ip_prefix_scores_like_an_ip(analyzer):
+    # Direct IP address plus excessive subdomains, the same score as before the Public Suffix List decomposition
+    assert analyzer.evaluate("http://1.2.3.4.evil.com/").confidence == pytest.approx(0.55)
@@ -0,0 +1,189 @@
+"""
+Streaming multipart uploads: the file part is written to a temporary spool file chunk by
+chunk while its SHA-256 and leading bytes are taken, so memory use stays the same for a
+1 KB or a 500 MB upload and the size cap is enforced before the body has been read.
+
+The spool is closed once the upload is complete and removed explicitly, rather than
+kept open as a delete-on-close NamedTemporaryFile: Windows does not let another handle
+open such a file by name, and the signature scan (possibly in a worker process) maps it
+by path.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+from typing import AsyncIterator, Dict, List, Optional
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+logger = logging.getLogger(__name__)
+
+
+class UploadError(Exception):
+    """The request is not an acceptable upload; ``status_code`` is the HTTP status to answer with"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class SpooledUpload:
+    """One received file: a temporary file on disk plus what was learnt while writing it"""
+
+    def __init__(self, filename: str, content_type: str, path: str, head: bytes, sha256: str, size: int):
+        self.filename = filename
+        self.content_type = content_type  # as declared by the client
+        self.path = path  # closed temporary file, deleted on close()
+        self.head = head  # first head_bytes bytes, for file type sniffing
+        self.sha256 = sha256
+        self.size = size
+
+    def close(self) -> None:
+        _remove(self.path)
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.error(f"Could not delete upload spool {path}: {e}")
+
+
+class UploadReceiver:
+    """
+    Incremental multipart/form-data reader for a single file field. Feed it the raw body
+    chunks as they arrive; parser callbacks only collect the file's bytes, and the spool is
+    created, written (the file data of each chunk, hashed on the way) and closed on a
+    worker thread.
+    """
+
+    def __init__(self, content_type_header: str, field: str = "file", max_bytes: int = 256 * 1024 * 1024,
+                 head_bytes: int = 64 * 1024, spool_dir: Optional[str] = None):
+        content_type, params = parse_options_header(content_type_header)
+        boundary = params.get(b"boundary")
+        if content_type != b"multipart/form-data" or not boundary:
+            raise UploadError(415, "Expected a multipart/form-data body with a file field")
+        self.field = field
+        self.max_bytes = max_bytes
+        self.head_bytes = head_bytes
+        self.spool_dir = spool_dir
+
+        self._spool = None  # open while the file part is written
+        self._spool_path: Optional[str] = None
+        self._file_seen = False
+        self._digest = hashlib.sha256()
+        self._head = bytearray()
+        self._size = 0
+        self._filename = ""
+        self._file_content_type = ""
+        self._done = False  # the file part has ended
+        self._in_file = False
+        self._header_field = bytearray()
+        self._header_value = bytearray()
+        self._headers: Dict[bytes, bytes] = {}
+        self._pending: List[bytes] = []  # file data of the current body chunk
+        self._parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": lambda data, start, end: self._header_field.extend(data[start:end]),
+            "on_header_value": lambda data, start, end: self._header_value.extend(data[start:end]),
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    def _on_part_begin(self) -> None:
+        self._headers = {}
+
+    def _on_header_end(self) -> None:
+        self._headers[bytes(self._header_field).lower()] = bytes(self._header_value)
+        self._header_field.clear()
+        self._header_value.clear()
+
+    def _on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("utf-8", "replace")
+        if name != self.field or b"filename" not in options:
+            return  # other form fields are ignored
+        if self._file_seen:
+            raise UploadError(400, f"Send one file per request in the '{self.field}' field")
+        self._file_seen = True
+        self._in_file = True
+        self._filename = options[b"filename"].decode("utf-8", "replace")
+        self._file_content_type = self._headers.get(b"content-type", b"").decode("latin-1")
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._in_file:
+            self._size += end - start
+            if self._size > self.max_bytes:
+                raise UploadError(413, f"File too large. Max {self.max_bytes} bytes.")
+            self._pending.append(data[start:end])
+
+    def _on_part_end(self) -> None:
+        if self._in_file:
+            self._in_file = False
+            self._done = True
+
+    def _open_spool(self) -> None:
+        if self._spool is None:
+            self._spool = tempfile.NamedTemporaryFile(prefix="upload-", dir=self.spool_dir, delete=False)
+            self._spool_path = self._spool.name
+
+    def _write(self, chunks: List[bytes]) -> None:
+        self._open_spool()
+        for chunk in chunks:
+            self._digest.update(chunk)
+            if len(self._head) < self.head_bytes:
+                self._head += chunk[:self.head_bytes - len(self._head)]
+            self._spool.write(chunk)
+
+    async def feed(self, chunk: bytes) -> None:
+        """Parse one body chunk and spool its file data"""
+        try:
+            self._parser.write(chunk)
+        except UploadError:
+            raise
+        except Exception as e:
+            raise UploadError(400, f"Malformed multipart body: {e}")
+        if self._pending:
+            pending, self._pending = self._pending, []
+            await asyncio.to_thread(self._write, pending)
+
+    async def receive(self, stream: AsyncIterator[bytes]) -> SpooledUpload:
+        """Read the whole body and return the spooled file (the caller must close() it)"""
+        try:
+            async for chunk in stream:
+                await self.feed(chunk)
+            self._parser.finalize()
+            if not self._file_seen or not self._done:
+                raise UploadError(400, f"Missing file in the '{self.field}' field")
+            await asyncio.to_thread(self._finish)
+        except BaseException:
+            await asyncio.shield(asyncio.to_thread(self.discard))
+            raise
+        return SpooledUpload(self._filename, self._file_content_type, self._spool_path, bytes(self._head),
+                             self._digest.hexdigest(), self._size)
+
+    def _finish(self) -> None:
+        """Create the spool of an empty file too, and close it so it can be opened by name"""
+        self._open_spool()
+        self._spool.close()
+        self._spool = None
+
+    def discard(self) -> None:
+        """Close and delete the spool of an upload that failed (blocking)"""
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+        if self._spool_path is not None:
+            _remove(self._spool_path)
+            self._spool_path = None
+